@@ -0,0 +1,102 @@
+"""Пропускная способность генератора коротких кодов.
+
+Режим allocator меряет сам генератор: несколько корутин одновременно берут
+коды, блоки арендуются у последовательности Postgres (нужна БД из .env).
+Режим http нагружает POST /links/shorten запущенного сервиса и проверяет,
+что все выданные коды различны.
+
+    PYTHONPATH=src python benchmarks/bench_short_codes.py allocator --codes 200000 --concurrency 64
+    PYTHONPATH=src python benchmarks/bench_short_codes.py http --base-url http://localhost:9999 --requests 5000 --concurrency 64
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+
+async def bench_allocator(args) -> None:
+    from links.shortcodes import SequenceBlockSource, ShortCodeAllocator
+
+    class CountingSource(SequenceBlockSource):
+        leases = 0
+
+        async def next_block(self, session=None) -> int:
+            CountingSource.leases += 1
+            return await super().next_block(session)
+
+    allocator = ShortCodeAllocator(CountingSource(), block_size=args.block_size)
+    per_worker = args.codes // args.concurrency
+    codes = []
+
+    async def worker():
+        for _ in range(per_worker):
+            codes.append(await allocator.allocate())
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    print(f"кодов: {len(codes)}, уникальных: {len(set(codes))}")
+    print(f"аренд блоков: {CountingSource.leases} (блок {args.block_size})")
+    print(f"время: {elapsed:.3f} с, {len(codes) / elapsed:,.0f} кодов/с")
+
+
+async def bench_http(args) -> None:
+    import httpx
+
+    latencies = []
+    codes = []
+    errors = 0
+    queue = asyncio.Queue()
+    for _ in range(args.requests):
+        queue.put_nowait(None)
+
+    async def worker(client):
+        nonlocal errors
+        while not queue.empty():
+            queue.get_nowait()
+            started = time.perf_counter()
+            resp = await client.post(
+                "/links/shorten",
+                json={"long_link": f"https://bench.example/{uuid.uuid4()}"},
+            )
+            latencies.append(time.perf_counter() - started)
+            if resp.status_code == 200:
+                codes.append(resp.json()["short_link"])
+            else:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=30) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"запросов: {len(latencies)}, ошибок: {errors}, уникальных кодов: {len(set(codes))} из {len(codes)}")
+    print(f"пропускная способность: {len(latencies) / elapsed:,.0f} запросов/с")
+    print(f"задержка p50={quantiles[49] * 1000:.1f} мс p95={quantiles[94] * 1000:.1f} мс p99={quantiles[98] * 1000:.1f} мс")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="mode", required=True)
+
+    alloc = sub.add_parser("allocator")
+    alloc.add_argument("--codes", type=int, default=100000)
+    alloc.add_argument("--concurrency", type=int, default=64)
+    alloc.add_argument("--block-size", type=int, default=1000)
+
+    http = sub.add_parser("http")
+    http.add_argument("--base-url", default="http://localhost:9999")
+    http.add_argument("--requests", type=int, default=2000)
+    http.add_argument("--concurrency", type=int, default=32)
+
+    args = parser.parse_args()
+    asyncio.run(bench_allocator(args) if args.mode == "allocator" else bench_http(args))
+
+
+if __name__ == "__main__":
+    main()
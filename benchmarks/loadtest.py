@@ -0,0 +1,388 @@
+"""Нагрузочный стенд для редиректа, создания ссылок, статистики и поиска.
+
+Шаги:
+    seed     - заполняет локальную БД (из переменных DB_*) ссылками bench-1 ... bench-N,
+               счётчики переходов распределены по закону Ципфа
+    run      - нагружает GET /links/, POST /links/shorten, GET /links/{code}/stats и
+               GET /links/search, печатает пропускную способность и p50/p95/p99 и
+               сохраняет результат в JSON; с --spawn сам запускает приложение;
+               с --login-storm N параллельно держит N клиентов, непрерывно
+               логинящихся через POST /auth/jwt/login (замер изоляции редиректа
+               от хэширования паролей)
+    compare  - сравнивает результат с базовым и завершается с кодом 1 при регрессии
+    fastpath - дважды запускает приложение и нагружает редирект без быстрого пути
+               (REDIRECT_FAST_PATH=false, всё через маршрут FastAPI) и с ним,
+               печатает запросы в секунду на воркер для обоих
+
+Коды для редиректа, статистики и поиска выбираются тоже по Ципфу: несколько
+горячих ссылок и длинный хвост, как в реальном трафике.
+
+    PYTHONPATH=src python benchmarks/loadtest.py seed --links 1000000
+    PYTHONPATH=src python benchmarks/loadtest.py run --spawn --redis-url memory:// --output benchmarks/results/head.json
+    PYTHONPATH=src python benchmarks/loadtest.py run --spawn --scenarios redirect --login-storm 32
+    python benchmarks/loadtest.py compare benchmarks/results/baseline.json benchmarks/results/head.json
+    PYTHONPATH=src python benchmarks/loadtest.py fastpath --workers 1
+
+Redis для --spawn: --redis-url redis://localhost:6379/0 (локальный экземпляр)
+или memory:// (кэш в памяти процесса, только с одним воркером).
+"""
+import argparse
+import asyncio
+import bisect
+import itertools
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+SCENARIOS = ("redirect", "shorten", "stats", "search", "login")
+DEFAULT_SCENARIOS = ("redirect", "shorten", "stats", "search")
+BENCH_PREFIX = "bench-"  # "-" нет в алфавите коротких кодов, с реальными кодами не пересечётся
+BENCH_USER = {"email": "bench-user@example.com", "password": "bench-password"}
+
+
+def seed(args) -> None:
+    from sqlalchemy import text
+    from database import sync_engine
+
+    started = time.perf_counter()
+    with sync_engine.begin() as conn:
+        conn.execute(text("DELETE FROM links WHERE short_link LIKE :prefix"), {"prefix": BENCH_PREFIX + "%"})
+    # Каждая порция в своей транзакции, чтобы не держать одну огромную транзакцию в WAL
+    for start in range(1, args.links + 1, args.chunk):
+        end = min(start + args.chunk - 1, args.links)
+        with sync_engine.begin() as conn:
+            # long_link_digest как в links/urls.py: запись ссылки уже каноническая
+            conn.execute(text("""
+                INSERT INTO links (long_link, long_link_digest, host, short_link, auth, user_id, start_date, last_date, num, expires_at)
+                SELECT
+                    'https://bench.example/' || g,
+                    substring(sha256(convert_to('https://bench.example/' || g, 'UTF8')) from 1 for 16),
+                    'bench.example',
+                    :prefix || g,
+                    false,
+                    NULL,
+                    now(),
+                    now(),
+                    floor(:max_clicks / power(g, :zipf_s))::int,
+                    NULL
+                FROM generate_series(:start, :end) AS g
+            """), {
+                "prefix": BENCH_PREFIX, "max_clicks": args.max_clicks, "zipf_s": args.zipf_s,
+                "start": start, "end": end,
+            })
+        print(f"  {end}/{args.links}")
+    with sync_engine.begin() as conn:
+        conn.execute(text("ANALYZE links"))
+    print(f"засеяно ссылок: {args.links} за {time.perf_counter() - started:.1f} с")
+
+
+class ZipfSampler:
+    """Номера 1..n с вероятностью, пропорциональной 1 / k ** s."""
+
+    def __init__(self, n: int, s: float, seed: int):
+        self.random = random.Random(seed)
+        self.cumulative = list(itertools.accumulate(1 / k ** s for k in range(1, n + 1)))
+
+    def sample(self) -> int:
+        point = self.random.random() * self.cumulative[-1]
+        return bisect.bisect_left(self.cumulative, point) + 1
+
+
+def make_request(scenario: str, sampler: ZipfSampler):
+    if scenario == "login":
+        return "POST", "/auth/jwt/login", {"data": {"username": BENCH_USER["email"], "password": BENCH_USER["password"]}}
+    rank = sampler.sample()
+    if scenario == "redirect":
+        return "GET", "/links/", {"params": {"short_link": f"{BENCH_PREFIX}{rank}"}}
+    if scenario == "stats":
+        return "GET", f"/links/{BENCH_PREFIX}{rank}/stats", {}
+    if scenario == "search":
+        return "GET", "/links/search", {"params": {"long_link": f"https://bench.example/{rank}"}}
+    return "POST", "/links/shorten", {"json": {"long_link": f"https://bench.example/new/{uuid.uuid4()}"}}
+
+
+def process_cpu_seconds(pid: int) -> Optional[float]:
+    # Время CPU (user + system) процесса и его потомков (воркеры uvicorn) по /proc;
+    # None, если /proc нет. Нагрузку и приложение может делить одно ядро, тогда
+    # пропускная способность упирается в клиента, а CPU на запрос - нет
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        total = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                total += sum(process_cpu_seconds(int(child)) or 0 for child in f.read().split())
+    except (OSError, ValueError):
+        return None
+    return total
+
+
+async def run_scenario(client, scenario: str, args, cpu_probe=None) -> dict:
+    sampler = ZipfSampler(args.links, args.zipf_s, args.seed)
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + args.duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            method, url, kwargs = make_request(scenario, sampler)
+            started = time.perf_counter()
+            try:
+                resp = await client.request(method, url, **kwargs)
+                ok = resp.status_code < 400
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            if not ok:
+                errors += 1
+
+    # Прогрев: заполняем пулы соединений и кэши, результат не учитываем
+    warmup_deadline = time.perf_counter() + args.warmup
+    while time.perf_counter() < warmup_deadline:
+        method, url, kwargs = make_request(scenario, sampler)
+        await client.request(method, url, **kwargs)
+
+    storm = login_storm(client.base_url, args.login_storm, deadline) if args.login_storm else None
+    cpu_started = cpu_probe() if cpu_probe else None
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    cpu_finished = cpu_probe() if cpu_probe else None
+    storm_result = await storm if storm is not None else None
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [0.0] * 99
+    result = {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": quantiles[49] * 1000,
+        "p95_ms": quantiles[94] * 1000,
+        "p99_ms": quantiles[98] * 1000,
+    }
+    if cpu_started is not None and cpu_finished is not None and latencies:
+        # Сколько запросов в секунду выдержал бы один полностью занятый воркер
+        result["server_cpu_ms"] = (cpu_finished - cpu_started) / len(latencies) * 1000
+        result["throughput_per_cpu"] = 1000 / result["server_cpu_ms"] if result["server_cpu_ms"] else None
+    if storm_result is not None:
+        result["login_storm"] = storm_result
+    return result
+
+
+def login_storm(base_url, concurrency: int, deadline: float) -> asyncio.Task:
+    # Фоновые логины до конца замера сценария: сколько выполнено и сколько
+    # отклонено с 503 (переполнена очередь хэширования паролей). Свой клиент,
+    # чтобы логины не занимали соединения клиента замеряемого сценария
+    import httpx
+
+    counts = {"logins": 0, "rejected": 0, "errors": 0}
+
+    async def worker(client):
+        _, url, kwargs = make_request("login", None)
+        while time.perf_counter() < deadline:
+            try:
+                resp = await client.post(url, **kwargs)
+            except Exception:
+                counts["errors"] += 1
+                continue
+            if resp.status_code == 200:
+                counts["logins"] += 1
+            elif resp.status_code == 503:
+                counts["rejected"] += 1
+            else:
+                counts["errors"] += 1
+
+    async def run_all():
+        limits = httpx.Limits(max_connections=concurrency)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+            await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        return counts
+
+    return asyncio.create_task(run_all())
+
+
+def spawn_app(args) -> subprocess.Popen:
+    env = dict(os.environ, REDIS_URL=args.redis_url, PYTHONPATH="src")
+    # Все запросы нагрузочного теста идут с одного адреса: лимит частоты
+    # по IP (с Redis) отклонял бы почти всё. Сброс нагрузки остаётся включён
+    env.setdefault("RATE_LIMIT_SHORTEN_RATE", "0")
+    env.setdefault("RATE_LIMIT_REDIRECT_RATE", "0")
+    env["REDIRECT_FAST_PATH"] = "true" if args.fast_path else "false"
+    cmd = [
+        sys.executable, "-m", "uvicorn", "main:app", "--app-dir", "src",
+        "--port", str(args.port), "--workers", str(args.workers), "--log-level", "warning",
+    ]
+    return subprocess.Popen(cmd, env=env)
+
+
+async def wait_ready(client, timeout: float = 30) -> None:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if (await client.get("/metrics")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("приложение не поднялось")
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+async def run(args) -> dict:
+    import httpx
+
+    process = spawn_app(args) if args.spawn else None
+    cpu_probe = (lambda: process_cpu_seconds(process.pid)) if process is not None else None
+    base_url = f"http://127.0.0.1:{args.port}" if args.spawn else args.base_url
+    limits = httpx.Limits(max_connections=args.concurrency)
+    results = {}
+    try:
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+            await wait_ready(client)
+            if args.login_storm or "login" in args.scenarios:
+                # 400, если пользователь уже есть с прошлого запуска
+                await client.post("/auth/register", json=BENCH_USER)
+            for scenario in args.scenarios:
+                results[scenario] = await run_scenario(client, scenario, args, cpu_probe)
+                r = results[scenario]
+                print(
+                    f"{scenario:9} {r['throughput']:9,.0f} запр/с  p50={r['p50_ms']:.1f} мс  "
+                    f"p95={r['p95_ms']:.1f} мс  p99={r['p99_ms']:.1f} мс  ошибок: {r['errors']}/{r['requests']}"
+                )
+                if r.get("throughput_per_cpu"):
+                    print(f"{'':9} CPU приложения: {r['server_cpu_ms']:.2f} мс на запрос, {r['throughput_per_cpu']:,.0f} запр/с на ядро")
+                if "login_storm" in r:
+                    storm = r["login_storm"]
+                    print(f"{'':9} фоном логинов: {storm['logins']}, отклонено 503: {storm['rejected']}, ошибок: {storm['errors']}")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "params": {
+            key: getattr(args, key)
+            for key in ("links", "zipf_s", "duration", "concurrency", "workers", "redis_url", "seed", "login_storm")
+        },
+        "results": results,
+    }
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"результат сохранён в {args.output}")
+    return results
+
+
+async def compare_fast_path(args) -> None:
+    # Одинаковая нагрузка на редирект, между замерами приложение перезапускается.
+    # Прогрев заполняет кэш, поэтому почти все запросы - попадания
+    args.spawn = True
+    args.scenarios = ["redirect"]
+    args.output = None
+    results = {}
+    for enabled in (False, True):
+        args.fast_path = enabled
+        print(f"быстрый путь {'включён' if enabled else 'выключен'}:")
+        results[enabled] = (await run(args))["redirect"]
+    route, fast = results[False], results[True]
+    print(
+        f"запр/с на воркер: маршрут FastAPI {route['throughput'] / args.workers:,.0f}, "
+        f"быстрый путь {fast['throughput'] / args.workers:,.0f}"
+    )
+    if route.get("throughput_per_cpu") and fast.get("throughput_per_cpu"):
+        # Предел воркера, если клиент нагрузки не отнимает у него CPU
+        print(
+            f"запр/с на воркер по CPU: маршрут FastAPI {route['throughput_per_cpu']:,.0f}, "
+            f"быстрый путь {fast['throughput_per_cpu']:,.0f} "
+            f"(x{fast['throughput_per_cpu'] / route['throughput_per_cpu']:.2f})"
+        )
+
+
+def compare(args) -> int:
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    with open(args.current) as f:
+        current = json.load(f)["results"]
+    regressions = 0
+    print(f"изменение: + лучше, - хуже; регрессия - хуже более чем на {args.threshold:g}%")
+    for scenario in SCENARIOS:
+        if scenario not in baseline or scenario not in current:
+            continue
+        base, cur = baseline[scenario], current[scenario]
+        checks = [
+            ("throughput", -(cur["throughput"] / base["throughput"] - 1) * 100),
+            ("p95_ms", (cur["p95_ms"] / base["p95_ms"] - 1) * 100),
+            ("p99_ms", (cur["p99_ms"] / base["p99_ms"] - 1) * 100),
+        ]
+        for metric, worse_pct in checks:
+            flag = "РЕГРЕССИЯ" if worse_pct > args.threshold else ""
+            regressions += bool(flag)
+            print(f"{scenario:9} {metric:10} {base[metric]:10.1f} -> {cur[metric]:10.1f} ({-worse_pct:+.1f}%) {flag}")
+    return 1 if regressions else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="mode", required=True)
+
+    seed_parser = sub.add_parser("seed")
+    seed_parser.add_argument("--links", type=int, default=1000000)
+    seed_parser.add_argument("--chunk", type=int, default=100000)
+    seed_parser.add_argument("--max-clicks", type=int, default=1000000)
+    seed_parser.add_argument("--zipf-s", type=float, default=1.1)
+
+    load_parser = argparse.ArgumentParser(add_help=False)
+    load_parser.add_argument("--links", type=int, default=1000000, help="сколько ссылок засеяно")
+    load_parser.add_argument("--zipf-s", type=float, default=1.1)
+    load_parser.add_argument("--duration", type=float, default=20, help="секунд на сценарий")
+    load_parser.add_argument("--warmup", type=float, default=3)
+    load_parser.add_argument("--concurrency", type=int, default=64)
+    load_parser.add_argument("--seed", type=int, default=42)
+    load_parser.add_argument("--login-storm", type=int, default=0, help="клиентов, логинящихся фоном во время замера")
+    load_parser.add_argument("--port", type=int, default=8765)
+    load_parser.add_argument("--workers", type=int, default=1)
+    load_parser.add_argument("--redis-url", default="memory://")
+
+    run_parser = sub.add_parser("run", parents=[load_parser])
+    run_parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(DEFAULT_SCENARIOS))
+    run_parser.add_argument("--base-url", default="http://localhost:9999")
+    run_parser.add_argument("--output")
+    run_parser.add_argument("--spawn", action="store_true", help="запустить приложение (uvicorn) самому")
+    run_parser.add_argument("--no-fast-path", dest="fast_path", action="store_false",
+                            help="с --spawn: без быстрого пути редиректа (REDIRECT_FAST_PATH=false)")
+
+    sub.add_parser("fastpath", parents=[load_parser])
+
+    compare_parser = sub.add_parser("compare")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=10, help="допустимое ухудшение, %%")
+
+    args = parser.parse_args()
+    if args.mode == "seed":
+        seed(args)
+    elif args.mode == "run":
+        asyncio.run(run(args))
+    elif args.mode == "fastpath":
+        asyncio.run(compare_fast_path(args))
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,8 @@
 #!/bin/bash
 
 alembic upgrade head
+# Общий каталог метрик Prometheus для всех воркеров gunicorn, очищается при старте
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
 cd src
-gunicorn main:app --workers 4 --worker-class uvicorn.workers.UvicornWorker --bind=0.0.0.0:8000
\ No newline at end of file
+gunicorn main:app --config ../docker/gunicorn.conf.py --workers 4 --worker-class uvicorn.workers.UvicornWorker --bind=0.0.0.0:8000
\ No newline at end of file
@@ -1,5 +1,9 @@
 #!/bin/bash
 cd src
 if [[ "${1}" == "celery" ]]; then
+   export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}
+   rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
    celery -A tasks.tasks:celery_app worker --loglevel=info
+ elif [[ "${1}" == "beat" ]]; then
+   celery -A tasks.tasks:celery_app beat --loglevel=info --schedule /tmp/celerybeat-schedule
  fi
@@ -0,0 +1,27 @@
+"""short_code_block_seq
+
+Revision ID: 5e8a0f3c1d27
+Revises: 9c2d41e7b3a0
+Create Date: 2026-10-17 13:40:02.551904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e8a0f3c1d27'
+down_revision: Union[str, None] = '9c2d41e7b3a0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Номера блоков для генератора коротких кодов (см. links/shortcodes.py)
+    op.execute(sa.schema.CreateSequence(sa.Sequence('links_short_code_block_seq')))
+
+
+def downgrade() -> None:
+    op.execute(sa.schema.DropSequence(sa.Sequence('links_short_code_block_seq')))
@@ -0,0 +1,47 @@
+"""links_indexes
+
+Revision ID: 9c2d41e7b3a0
+Revises: 4f446e1fdfac
+Create Date: 2026-10-17 10:12:40.118230
+
+Индексы создаются с CONCURRENTLY, чтобы не блокировать запись в links.
+Такие операции нельзя выполнять внутри транзакции, поэтому они обёрнуты
+в autocommit_block. Перед миграцией в таблице не должно быть дублей
+short_link, иначе построение уникального индекса завершится ошибкой.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c2d41e7b3a0'
+down_revision: Union[str, None] = '4f446e1fdfac'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_links_short_link', 'links', ['short_link'],
+            unique=True, postgresql_concurrently=True, if_not_exists=True
+        )
+        op.create_index(
+            'ix_links_user_id_short_link', 'links', ['user_id', 'short_link'],
+            unique=False, postgresql_concurrently=True, if_not_exists=True
+        )
+        op.create_index(
+            'ix_links_expires_at', 'links', ['expires_at'],
+            unique=False, postgresql_concurrently=True, if_not_exists=True,
+            postgresql_where=sa.text('expires_at IS NOT NULL')
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_links_expires_at', table_name='links', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_links_user_id_short_link', table_name='links', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_links_short_link', table_name='links', postgresql_concurrently=True, if_exists=True)
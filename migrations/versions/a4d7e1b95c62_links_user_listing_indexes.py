@@ -0,0 +1,40 @@
+"""links_user_listing_indexes
+
+Revision ID: a4d7e1b95c62
+Revises: f2a9c4e7d310
+Create Date: 2026-10-17 20:03:51.662148
+
+Индекс под список своих ссылок (/links/mine): (user_id, id) с INCLUDE
+(start_date, expires_at) для фильтров по дате создания и сроку действия.
+Строится с CONCURRENTLY. Индекса с num нет: его обновлял бы каждый сброс
+счётчиков переходов (links/clicks.py), и эти обновления перестали бы быть HOT.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4d7e1b95c62'
+down_revision: Union[str, None] = 'f2a9c4e7d310'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_links_user_id_id', 'links', ['user_id', 'id'],
+            postgresql_include=['start_date', 'expires_at'],
+            postgresql_concurrently=True, if_not_exists=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_links_user_id_id', table_name='links',
+            postgresql_concurrently=True, if_exists=True
+        )
@@ -0,0 +1,41 @@
+"""links_owner_long_link_unique
+
+Revision ID: b71f2c9e4a18
+Revises: 5e8a0f3c1d27
+Create Date: 2026-10-17 16:05:31.274410
+
+Уникальность (user_id, md5(long_link)) с NULLS NOT DISTINCT (Postgres 15+):
+дубль ссылки у владельца теперь ловится конфликтом при вставке. Анонимные
+ссылки считаются одним владельцем. Если в таблице уже есть дубли, их нужно
+убрать до миграции, иначе построение индекса завершится ошибкой.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b71f2c9e4a18'
+down_revision: Union[str, None] = '5e8a0f3c1d27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ux_links_user_id_long_link_md5', 'links',
+            ['user_id', sa.text('md5(long_link)')],
+            unique=True, postgresql_nulls_not_distinct=True,
+            postgresql_concurrently=True, if_not_exists=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ux_links_user_id_long_link_md5', table_name='links',
+            postgresql_concurrently=True, if_exists=True
+        )
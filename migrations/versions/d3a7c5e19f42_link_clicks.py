@@ -0,0 +1,51 @@
+"""link_clicks
+
+Revision ID: d3a7c5e19f42
+Revises: b71f2c9e4a18
+Create Date: 2026-10-17 16:05:41.208334
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3a7c5e19f42'
+down_revision: Union[str, None] = 'b71f2c9e4a18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # История переходов и агрегаты по часам и дням (см. links/click_events.py)
+    op.create_table('link_clicks',
+    sa.Column('id', sa.BigInteger(), nullable=False),
+    sa.Column('link_id', sa.Integer(), nullable=False),
+    sa.Column('clicked_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('referrer', sa.String(), nullable=True),
+    sa.Column('user_agent', sa.String(), nullable=True),
+    sa.Column('ip_prefix', sa.String(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_link_clicks_clicked_at', 'link_clicks', ['clicked_at'], unique=False, postgresql_using='brin')
+    op.create_table('link_clicks_hourly',
+    sa.Column('link_id', sa.Integer(), nullable=False),
+    sa.Column('bucket', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('clicks', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('link_id', 'bucket')
+    )
+    op.create_table('link_clicks_daily',
+    sa.Column('link_id', sa.Integer(), nullable=False),
+    sa.Column('bucket', sa.Date(), nullable=False),
+    sa.Column('clicks', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('link_id', 'bucket')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('link_clicks_daily')
+    op.drop_table('link_clicks_hourly')
+    op.drop_index('ix_link_clicks_clicked_at', table_name='link_clicks', postgresql_using='brin')
+    op.drop_table('link_clicks')
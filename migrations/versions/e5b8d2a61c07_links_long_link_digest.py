@@ -0,0 +1,152 @@
+"""links_long_link_digest
+
+Revision ID: e5b8d2a61c07
+Revises: d3a7c5e19f42
+Create Date: 2026-10-17 18:42:09.530117
+
+Колонка long_link_digest - первые 16 байт SHA-256 канонической записи
+long_link (копия links/urls.py на момент ревизии) - и уникальный индекс (long_link_digest, user_id)
+вместо индекса по md5(long_link). Дайджесты заполняются порциями по id, каждая
+порция в своей транзакции; NOT NULL ставится через CHECK NOT VALID и VALIDATE,
+без долгой блокировки таблицы. Ссылки одного владельца, которые различались только
+записью (HTTP://Example.com и http://example.com/), после приведения совпадают:
+дайджест канонической записи получает одна из них (каноническая, иначе с
+меньшим id), остальные - дайджест своей исходной записи, чтобы не потерять
+данные и не нарушить уникальность.
+
+"""
+import hashlib
+from typing import Sequence, Union
+from urllib.parse import urlsplit, urlunsplit
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5b8d2a61c07'
+down_revision: Union[str, None] = 'd3a7c5e19f42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_BATCH_SIZE = 10000
+
+# Копия links/urls.py на момент этой ревизии: миграция должна записывать те же
+# дайджесты, что и тогда, даже если приложение позже изменит канонизацию
+DIGEST_SIZE = 16
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str) -> str:
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    if not parts.scheme or not parts.netloc:
+        return url
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if ":" in host:
+        host = f"[{host}]"
+    netloc = host
+    if port is not None and DEFAULT_PORTS.get(scheme) != port:
+        netloc = f"{host}:{port}"
+    userinfo, _, _ = parts.netloc.rpartition("@")
+    if userinfo:
+        netloc = f"{userinfo}@{netloc}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, parts.fragment))
+
+
+def long_link_digest(url: str) -> bytes:
+    return hashlib.sha256(normalize_url(url).encode()).digest()[:DIGEST_SIZE]
+
+
+def raw_digest(long_link: str) -> bytes:
+    return hashlib.sha256(long_link.encode()).digest()[:DIGEST_SIZE]
+
+
+def backfill(conn) -> None:
+    # Порции по id, каждая в своей транзакции; только строки без дайджеста
+    last_id = 0
+    while True:
+        rows = conn.execute(sa.text(
+            "SELECT id, long_link FROM links WHERE id > :last_id AND long_link_digest IS NULL"
+            " ORDER BY id LIMIT :limit"
+        ), {"last_id": last_id, "limit": BACKFILL_BATCH_SIZE}).all()
+        if not rows:
+            break
+        conn.execute(
+            sa.text("UPDATE links SET long_link_digest = :digest WHERE id = :id"),
+            [{"id": row.id, "digest": long_link_digest(row.long_link or "")} for row in rows]
+        )
+        last_id = rows[-1].id
+
+
+def resolve_duplicates(conn) -> None:
+    duplicates = conn.execute(sa.text("""
+        SELECT array_agg(id ORDER BY id) AS ids, array_agg(long_link ORDER BY id) AS long_links
+        FROM links
+        GROUP BY long_link_digest, user_id
+        HAVING count(*) > 1
+    """)).all()
+    for group in duplicates:
+        members = list(zip(group.ids, group.long_links))
+        keeper = next((m for m in members if normalize_url(m[1] or "") == m[1]), members[0])
+        conn.execute(
+            sa.text("UPDATE links SET long_link_digest = :digest WHERE id = :id"),
+            [{"id": link_id, "digest": raw_digest(long_link or "")}
+             for link_id, long_link in members if link_id != keeper[0]]
+        )
+
+
+def upgrade() -> None:
+    op.add_column('links', sa.Column('long_link_digest', sa.LargeBinary(), nullable=True))
+
+    with op.get_context().autocommit_block():
+        conn = op.get_bind()
+        backfill(conn)
+        # Пока шло заполнение, приложение прежней версии вставляло строки без
+        # дайджеста. CHECK NOT VALID проверяет только новые строки и не сканирует
+        # таблицу; после него такие вставки отклоняются, поэтому к этому шагу
+        # прежние версии должны быть остановлены. Строки, успевшие появиться
+        # до него, заполняются повторным проходом
+        conn.execute(sa.text(
+            "ALTER TABLE links ADD CONSTRAINT ck_links_long_link_digest_not_null"
+            " CHECK (long_link_digest IS NOT NULL) NOT VALID"
+        ))
+        backfill(conn)
+        resolve_duplicates(conn)
+        # VALIDATE сканирует таблицу под SHARE UPDATE EXCLUSIVE - чтение и запись
+        # не блокируются; SET NOT NULL с проверенным CHECK скан не повторяет (PG 12+)
+        conn.execute(sa.text("ALTER TABLE links VALIDATE CONSTRAINT ck_links_long_link_digest_not_null"))
+        conn.execute(sa.text("ALTER TABLE links ALTER COLUMN long_link_digest SET NOT NULL"))
+        conn.execute(sa.text("ALTER TABLE links DROP CONSTRAINT ck_links_long_link_digest_not_null"))
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ux_links_long_link_digest_user_id', 'links',
+            ['long_link_digest', 'user_id'],
+            unique=True, postgresql_nulls_not_distinct=True,
+            postgresql_concurrently=True, if_not_exists=True
+        )
+        op.drop_index(
+            'ux_links_user_id_long_link_md5', table_name='links',
+            postgresql_concurrently=True, if_exists=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ux_links_user_id_long_link_md5', 'links',
+            ['user_id', sa.text('md5(long_link)')],
+            unique=True, postgresql_nulls_not_distinct=True,
+            postgresql_concurrently=True, if_not_exists=True
+        )
+        op.drop_index(
+            'ux_links_long_link_digest_user_id', table_name='links',
+            postgresql_concurrently=True, if_exists=True
+        )
+    op.drop_column('links', 'long_link_digest')
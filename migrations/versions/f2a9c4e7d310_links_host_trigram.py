@@ -0,0 +1,86 @@
+"""links_host_trigram
+
+Revision ID: f2a9c4e7d310
+Revises: e5b8d2a61c07
+Create Date: 2026-10-17 19:20:14.871562
+
+Колонка host (хост long_link, копия links/urls.py на момент ревизии) с индексом (host, id) для
+поиска по домену и триграммный GIN-индекс по long_link для поиска по
+подстроке. Нужно расширение pg_trgm из contrib (в образе postgres оно есть).
+host заполняется порциями по id, каждая порция в своей транзакции; индексы
+строятся с CONCURRENTLY.
+
+"""
+from typing import Optional, Sequence, Union
+from urllib.parse import urlsplit
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2a9c4e7d310'
+down_revision: Union[str, None] = 'e5b8d2a61c07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_BATCH_SIZE = 10000
+
+
+# Копия links/urls.py на момент этой ревизии: миграция должна записывать те же
+# хосты, что и тогда, даже если приложение позже изменит разбор адресов
+def link_host(url: str) -> Optional[str]:
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        if not parts.netloc:
+            parts = urlsplit("http://" + url)
+        host = parts.hostname
+    except ValueError:
+        return None
+    if not host or any(char.isspace() for char in host):
+        return None
+    return host
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.add_column('links', sa.Column('host', sa.String(), nullable=True))
+
+    with op.get_context().autocommit_block():
+        conn = op.get_bind()
+        last_id = 0
+        while True:
+            rows = conn.execute(sa.text(
+                "SELECT id, long_link FROM links WHERE id > :last_id ORDER BY id LIMIT :limit"
+            ), {"last_id": last_id, "limit": BACKFILL_BATCH_SIZE}).all()
+            if not rows:
+                break
+            conn.execute(
+                sa.text("UPDATE links SET host = :host WHERE id = :id"),
+                [{"id": row.id, "host": link_host(row.long_link or "")} for row in rows]
+            )
+            last_id = rows[-1].id
+
+        op.create_index(
+            'ix_links_host_id', 'links', ['host', 'id'],
+            postgresql_concurrently=True, if_not_exists=True
+        )
+        op.create_index(
+            'ix_links_long_link_trgm', 'links', ['long_link'],
+            postgresql_using='gin', postgresql_ops={'long_link': 'gin_trgm_ops'},
+            postgresql_concurrently=True, if_not_exists=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_links_long_link_trgm', table_name='links',
+            postgresql_concurrently=True, if_exists=True
+        )
+        op.drop_index(
+            'ix_links_host_id', table_name='links',
+            postgresql_concurrently=True, if_exists=True
+        )
+    op.drop_column('links', 'host')
@@ -0,0 +1,86 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from fastapi_users.password import PasswordHelper, PasswordHelperProtocol
+
+from config import PASSWORD_HASH_MAX_PENDING, PASSWORD_HASH_NICE, PASSWORD_HASH_WORKERS
+from metrics import PASSWORD_HASH_PENDING, PASSWORD_HASH_REJECTED
+
+
+class PasswordHashBusy(Exception):
+    """Очередь хэширования паролей заполнена, запрос нужно повторить позже."""
+
+
+def lower_thread_priority(nice: int) -> None:
+    # В Linux приоритет планировщика задаётся каждому потоку отдельно:
+    # при нехватке CPU поток цикла событий вытесняет хэширование
+    if nice <= 0 or not hasattr(os, "setpriority"):
+        return
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), nice)
+    except OSError as e:
+        print(f"Не удалось понизить приоритет потока хэширования: {e}")
+
+
+class PasswordHasherPool:
+    """Хэширование и проверка паролей в отдельном пуле потоков.
+
+    argon2 и bcrypt считают хэш сотни миллисекунд, но отпускают GIL, поэтому
+    потоков хватает, чтобы цикл событий воркера продолжал обслуживать
+    редиректы во время волны логинов. Потоки пула работают с пониженным
+    приоритетом (nice), чтобы не отнимать CPU у цикла событий. Одновременно считается не больше
+    workers хэшей; если ждущих и выполняемых операций уже max_pending,
+    новая сразу получает PasswordHashBusy (ответ 503) вместо того, чтобы
+    копить очередь без предела.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING,
+                 helper: Optional[PasswordHelperProtocol] = None, nice: int = PASSWORD_HASH_NICE):
+        self.workers = workers
+        self.nice = nice
+        self.max_pending = max_pending
+        self.helper = helper or PasswordHelper()
+        self.pending = 0
+        self.rejected = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="password-hash",
+                initializer=lower_thread_priority,
+                initargs=(self.nice,)
+            )
+        return self._executor
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            PASSWORD_HASH_REJECTED.inc()
+            raise PasswordHashBusy()
+        self.pending += 1
+        PASSWORD_HASH_PENDING.inc()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+            PASSWORD_HASH_PENDING.dec()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.helper.hash, password)
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return await self._run(self.helper.verify_and_update, plain_password, hashed_password)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasherPool()
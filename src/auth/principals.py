@@ -0,0 +1,109 @@
+import hashlib
+import time
+import uuid
+from typing import Optional
+
+import jwt
+from fastapi_users import BaseUserManager, exceptions, models
+from fastapi_users.authentication import JWTStrategy
+from fastapi_users.jwt import decode_jwt
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from auth.db import User
+from config import AUTH_PRINCIPAL_CACHE_SIZE, AUTH_PRINCIPAL_CACHE_TTL
+from links.cache import LocalCache, register_invalidation_handler
+from metrics import record_cache
+
+# Канал Redis, через который воркеры сообщают об изменённых пользователях
+PRINCIPAL_INVALIDATION_CHANNEL = "auth:invalidate"
+
+USER_COLUMNS = [column.key for column in sa_inspect(User).column_attrs]
+
+# sha256(токен) -> значения колонок пользователя
+principal_cache = LocalCache(maxsize=AUTH_PRINCIPAL_CACHE_SIZE, ttl=AUTH_PRINCIPAL_CACHE_TTL)
+# Клиент Redis для рассылки инвалидаций, задаётся в lifespan приложения
+_redis = None
+
+
+def init_principal_cache(redis) -> None:
+    global _redis
+    _redis = redis
+
+
+def token_key(token: str) -> str:
+    # Сам токен в памяти не держим
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def user_to_row(user: User) -> dict:
+    return {name: getattr(user, name) for name in USER_COLUMNS}
+
+
+def user_from_row(row: dict) -> User:
+    # Каждому запросу свой объект, не привязанный к сессии: один и тот же
+    # экземпляр нельзя одновременно добавить в сессии разных запросов
+    user = User(**row)
+    make_transient_to_detached(user)
+    return user
+
+
+def drop_user(user_id: str) -> int:
+    return principal_cache.pop_where(lambda row: str(row["id"]) == user_id)
+
+
+async def invalidate_principal(user_id: uuid.UUID) -> None:
+    """Сбрасывает закэшированные токены пользователя во всех воркерах."""
+    drop_user(str(user_id))
+    if _redis is None:
+        return
+    try:
+        await _redis.publish(PRINCIPAL_INVALIDATION_CHANNEL, str(user_id))
+    except Exception as e:
+        print(f"Не удалось разослать инвалидацию пользователя {user_id}: {e}")
+
+
+register_invalidation_handler(PRINCIPAL_INVALIDATION_CHANNEL, drop_user, principal_cache.clear)
+
+
+class CachedJWTStrategy(JWTStrategy[models.UP, models.ID]):
+    """JWT-стратегия, которая не ходит в БД за пользователем на каждый запрос.
+
+    После проверки подписи и загрузки пользователя его данные кэшируются
+    в воркере по хэшу токена на AUTH_PRINCIPAL_CACHE_TTL секунд, но не
+    дольше срока действия токена (exp). Повторный запрос с тем же токеном
+    не декодирует JWT и не читает таблицу user. Изменение или удаление
+    пользователя через UserManager сбрасывает его токены (см. users.py).
+    """
+
+    async def read_token(
+        self, token: Optional[str], user_manager: BaseUserManager[models.UP, models.ID]
+    ) -> Optional[models.UP]:
+        if token is None:
+            return None
+        key = token_key(token)
+        row, result = principal_cache.lookup(key)
+        record_cache("principal", result)
+        if row is not None:
+            return user_from_row(row)
+
+        try:
+            data = decode_jwt(
+                token, self.decode_key, self.token_audience, algorithms=[self.algorithm]
+            )
+            user_id = data.get("sub")
+            if user_id is None:
+                return None
+        except jwt.PyJWTError:
+            return None
+
+        try:
+            parsed_id = user_manager.parse_id(user_id)
+            user = await user_manager.get(parsed_id)
+        except (exceptions.UserNotExists, exceptions.InvalidID):
+            return None
+
+        expires_at = data.get("exp")
+        ttl = None if expires_at is None else expires_at - time.time()
+        principal_cache.set(key, user_to_row(user), ttl)
+        return user
@@ -1,17 +1,18 @@
 # Импорт стандартного модуля uuid для работы с уникальными идентификаторами
 import uuid
-from typing import Optional
+from typing import Any, Dict, Optional
 
 # Depends используется для определения зависимостей в маршрутах и функциях,
 # Request позволяет получать данные HTTP-запроса, если потребуется
 from fastapi import Depends, Request
+from fastapi.security import OAuth2PasswordRequestForm
 
 # Импорт базовых классов и утилит из fastapi_users для управления пользователями:
 # - BaseUserManager: базовый класс для реализации логики управления пользователями
 # - UUIDIDMixin: миксин, позволяющий использовать UUID в качестве идентификатора пользователя
 # - FastAPIUsers: основной класс для интеграции аутентификации в FastAPI
 # - models: содержит типы и интерфейсы, используемые в fastapi_users
-from fastapi_users import BaseUserManager, FastAPIUsers, UUIDIDMixin, models
+from fastapi_users import BaseUserManager, FastAPIUsers, UUIDIDMixin, exceptions, models, schemas
 
 # Импорт классов для настройки аутентификации:
 # - AuthenticationBackend: объединяет транспорт и стратегию аутентификации
@@ -30,6 +31,12 @@ from fastapi_users.db import SQLAlchemyUserDatabase
 # Импорт модели пользователя (User) и функции для получения объекта базы данных пользователей
 from auth.db import User, get_user_db
 
+# JWT-стратегия с кэшем проверенных токенов и сброс этого кэша
+from auth.principals import CachedJWTStrategy, invalidate_principal
+
+# Пул потоков для хэширования паролей, чтобы не блокировать цикл событий
+from auth.passwords import password_hasher
+
 # Константа для секретного ключа, используемая для подписи JWT и генерации токенов для верификации
 from config import SECRET
 
@@ -39,6 +46,68 @@ class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
     # - verification_token_secret используется при запросе верификации аккаунта
     verification_token_secret = SECRET
 
+    # create, authenticate и _update повторяют BaseUserManager, но хэш пароля
+    # считают в password_hasher: argon2/bcrypt занимают сотни миллисекунд,
+    # и в обработчике запроса они останавливали бы весь воркер
+    async def release_connection(self) -> None:
+        # Пока хэш считается (и ждёт очереди), соединение с БД не нужно:
+        # возвращаем его в пул, иначе волна логинов занимает весь пул.
+        # Загруженный пользователь остаётся доступен (объекты при close не истекают)
+        await self.user_db.session.close()
+
+    async def create(
+        self, user_create: schemas.UC, safe: bool = False, request: Optional[Request] = None
+    ) -> User:
+        await self.validate_password(user_create.password, user_create)
+
+        existing_user = await self.user_db.get_by_email(user_create.email)
+        if existing_user is not None:
+            raise exceptions.UserAlreadyExists()
+
+        user_dict = (
+            user_create.create_update_dict()
+            if safe
+            else user_create.create_update_dict_superuser()
+        )
+        password = user_dict.pop("password")
+        await self.release_connection()
+        user_dict["hashed_password"] = await password_hasher.hash(password)
+
+        created_user = await self.user_db.create(user_dict)
+
+        await self.on_after_register(created_user, request)
+
+        return created_user
+
+    async def authenticate(self, credentials: OAuth2PasswordRequestForm) -> Optional[User]:
+        try:
+            user = await self.get_by_email(credentials.username)
+        except exceptions.UserNotExists:
+            # Хэшируем впустую, чтобы по времени ответа нельзя было понять, есть ли пользователь
+            await self.release_connection()
+            await password_hasher.hash(credentials.password)
+            return None
+
+        await self.release_connection()
+        verified, updated_password_hash = await password_hasher.verify_and_update(
+            credentials.password, user.hashed_password
+        )
+        if not verified:
+            return None
+        # Обновляем хэш, если он посчитан устаревшим алгоритмом
+        if updated_password_hash is not None:
+            await self.user_db.update(user, {"hashed_password": updated_password_hash})
+
+        return user
+
+    async def _update(self, user: User, update_dict: Dict[str, Any]) -> User:
+        password = update_dict.get("password")
+        if password is not None:
+            await self.validate_password(password, user)
+            update_dict = {key: value for key, value in update_dict.items() if key != "password"}
+            update_dict["hashed_password"] = await password_hasher.hash(password)
+        return await super()._update(user, update_dict)
+
     # Асинхронный метод, вызываемый после успешной регистрации пользователя.
     async def on_after_register(self, user: User, request: Optional[Request] = None):
         print(f"User {user.id} has registered.")
@@ -50,6 +119,16 @@ class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
     ):
         print(f"Verification requested for user {user.id}. Verification token: {token}")
 
+    # После изменения (в том числе деактивации) и удаления пользователя
+    # его токены не должны отвечать из кэша стратегии JWT
+    async def on_after_update(
+        self, user: User, update_dict: Dict[str, Any], request: Optional[Request] = None
+    ):
+        await invalidate_principal(user.id)
+
+    async def on_after_delete(self, user: User, request: Optional[Request] = None):
+        await invalidate_principal(user.id)
+
 # Функция-генератор для получения экземпляра UserManager.
 # Используется Depends для получения объекта базы данных пользователей (SQLAlchemyUserDatabase).
 async def get_user_manager(user_db: SQLAlchemyUserDatabase = Depends(get_user_db)):
@@ -61,8 +140,9 @@ bearer_transport = BearerTransport(tokenUrl="auth/jwt/login")
 
 # Функция для создания и возвращения экземпляра стратегии JWT.
 # Здесь задаются секретный ключ и время жизни токена (3600 секунд).
+# Проверенные токены кэшируются, чтобы не читать пользователя из БД на каждый запрос.
 def get_jwt_strategy() -> JWTStrategy[models.UP, models.ID]:
-    return JWTStrategy(secret=SECRET, lifetime_seconds=3600)
+    return CachedJWTStrategy(secret=SECRET, lifetime_seconds=3600)
 
 # Создание backend-а для аутентификации:
 # - name: имя метода аутентификации ("jwt")
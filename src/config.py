@@ -10,4 +10,133 @@ DB_PORT = os.getenv("DB_PORT")
 DB_NAME = os.getenv("DB_NAME")
 SECRET = os.getenv("SECRET")
 
+# Отложенная запись счётчика переходов: как часто сбрасывать буфер в БД (сек.)
+# и при каком числе накопленных ссылок сбрасывать его досрочно
+CLICK_FLUSH_INTERVAL = float(os.getenv("CLICK_FLUSH_INTERVAL", "5"))
+CLICK_BUFFER_MAX_LINKS = int(os.getenv("CLICK_BUFFER_MAX_LINKS", "10000"))
 
+# memory:// - работать без Redis, с кэшем в памяти процесса (для одного воркера)
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+# Локальный (L1) кэш записей о ссылках внутри каждого воркера
+L1_CACHE_MAX_SIZE = int(os.getenv("L1_CACHE_MAX_SIZE", "10000"))
+L1_CACHE_TTL = float(os.getenv("L1_CACHE_TTL", "30"))
+# Быстрый путь редиректа (links/fastpath.py): попадания в кэш отдаются на
+# уровне ASGI, без зависимостей FastAPI и сессии БД
+REDIRECT_FAST_PATH = os.getenv("REDIRECT_FAST_PATH", "true").lower() in ("1", "true", "yes")
+# Время жизни записей в Redis-кэше (сек.): записи о ссылке без срока действия,
+# отсутствующей или истёкшей ссылки и статистики. Запись о ссылке со сроком
+# действия живёт не дольше, чем сама ссылка
+LINK_CACHE_TTL = int(os.getenv("LINK_CACHE_TTL", "86400"))
+LINK_CACHE_MISS_TTL = int(os.getenv("LINK_CACHE_MISS_TTL", "60"))
+STATS_CACHE_TTL = int(os.getenv("STATS_CACHE_TTL", "60"))
+# Время жизни кэша поиска по длинной ссылке (сек.)
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "30"))
+# Защита от одновременного промаха по горячему ключу (записи о ссылках,
+# статистика, поиск): сколько секунд после истечения отдавать старое значение,
+# пока его обновляет один запрос, коэффициент раннего обновления (XFetch,
+# 0 - не обновлять заранее), время жизни блокировки обновления в Redis (сек.)
+# и сколько ждать, пока ключ загрузит другой воркер (сек.)
+CACHE_STALE_TTL = int(os.getenv("CACHE_STALE_TTL", "60"))
+CACHE_EARLY_REFRESH_BETA = float(os.getenv("CACHE_EARLY_REFRESH_BETA", "1"))
+CACHE_LOCK_TTL = float(os.getenv("CACHE_LOCK_TTL", "5"))
+CACHE_LOCK_WAIT = float(os.getenv("CACHE_LOCK_WAIT", "1"))
+# Прогрев кэша записей о ссылках при старте воркера: сколько самых популярных
+# ссылок загрузить (0 - не прогревать), среди использованных за сколько дней
+# (0 - среди всех), за сколько секунд максимум и по сколько ссылок в одном
+# конвейере Redis
+CACHE_WARMUP_LINKS = int(os.getenv("CACHE_WARMUP_LINKS", "10000"))
+CACHE_WARMUP_RECENT_DAYS = float(os.getenv("CACHE_WARMUP_RECENT_DAYS", "7"))
+CACHE_WARMUP_BUDGET = float(os.getenv("CACHE_WARMUP_BUDGET", "10"))
+CACHE_WARMUP_BATCH_SIZE = int(os.getenv("CACHE_WARMUP_BATCH_SIZE", "1000"))
+# Счётчики переходов в Redis для статистики: сколько хранить хэш ссылки без
+# переходов (сек.) и как часто сверять его с links.num в БД (сек.)
+LIVE_STATS_TTL = int(os.getenv("LIVE_STATS_TTL", "86400"))
+LIVE_STATS_RECONCILE_INTERVAL = float(os.getenv("LIVE_STATS_RECONCILE_INTERVAL", "600"))
+
+# Генерация коротких кодов: длина, алфавит и источник блоков идентификаторов
+# ("sequence" - последовательность Postgres, "redis" - INCR в Redis)
+SHORT_CODE_LENGTH = int(os.getenv("SHORT_CODE_LENGTH", "8"))
+SHORT_CODE_ALPHABET = os.getenv(
+    "SHORT_CODE_ALPHABET", "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+)
+SHORT_CODE_ALLOCATOR = os.getenv("SHORT_CODE_ALLOCATOR", "sequence")
+SHORT_CODE_BLOCK_SIZE = int(os.getenv("SHORT_CODE_BLOCK_SIZE", "1000"))
+
+# Пакетное создание ссылок: максимум элементов в запросе и размер порции,
+# которая вставляется одним INSERT
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "10000"))
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "500"))
+
+# Удаление истёкших ссылок периодической задачей Celery beat: период запуска (сек.),
+# размер одной порции DELETE и максимум порций за запуск
+EXPIRY_SWEEP_INTERVAL = float(os.getenv("EXPIRY_SWEEP_INTERVAL", "60"))
+EXPIRY_SWEEP_BATCH_SIZE = int(os.getenv("EXPIRY_SWEEP_BATCH_SIZE", "1000"))
+EXPIRY_SWEEP_MAX_BATCHES = int(os.getenv("EXPIRY_SWEEP_MAX_BATCHES", "50"))
+# Ограничение времени одного DELETE порции ссылок в задачах Celery (сек.)
+DELETE_STATEMENT_TIMEOUT = float(os.getenv("DELETE_STATEMENT_TIMEOUT", "30"))
+
+# Список истёкших ссылок: размер страницы по умолчанию и максимальный,
+# сколько строк за раз читать из серверного курсора в потоковом режиме
+EXPIRED_PAGE_SIZE = int(os.getenv("EXPIRED_PAGE_SIZE", "100"))
+EXPIRED_PAGE_MAX = int(os.getenv("EXPIRED_PAGE_MAX", "1000"))
+EXPIRED_STREAM_BATCH = int(os.getenv("EXPIRED_STREAM_BATCH", "1000"))
+
+# Поиск ссылок по подстроке и домену (/links/find): размер страницы по
+# умолчанию и максимальный, минимальная длина подстроки (триграммы - от 3 символов)
+LINK_FIND_PAGE_SIZE = int(os.getenv("LINK_FIND_PAGE_SIZE", "100"))
+LINK_FIND_PAGE_MAX = int(os.getenv("LINK_FIND_PAGE_MAX", "1000"))
+LINK_FIND_MIN_CONTAINS = int(os.getenv("LINK_FIND_MIN_CONTAINS", "3"))
+
+# Список своих ссылок (/links/mine): размер страницы по умолчанию и максимальный
+MY_LINKS_PAGE_SIZE = int(os.getenv("MY_LINKS_PAGE_SIZE", "100"))
+MY_LINKS_PAGE_MAX = int(os.getenv("MY_LINKS_PAGE_MAX", "1000"))
+
+# История переходов: размер очереди событий (при переполнении события
+# отбрасываются, редирект не ждёт), период сброса (сек.) и размер пачки COPY
+# (не больше 10000: агрегаты пачки обновляются одним INSERT)
+CLICK_EVENTS_QUEUE_SIZE = int(os.getenv("CLICK_EVENTS_QUEUE_SIZE", "100000"))
+CLICK_EVENTS_FLUSH_INTERVAL = float(os.getenv("CLICK_EVENTS_FLUSH_INTERVAL", "5"))
+CLICK_EVENTS_BATCH_SIZE = int(os.getenv("CLICK_EVENTS_BATCH_SIZE", "5000"))
+
+# Пул соединений с БД (на каждый процесс воркера): размер, переполнение сверх
+# размера, ожидание свободного соединения (сек.), пересоздание соединений
+# старше DB_POOL_RECYCLE сек. (-1 - не пересоздавать), проверка соединения
+# перед выдачей и размер кэша подготовленных запросов asyncpg (0 для PgBouncer
+# в режиме transaction)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() in ("1", "true", "yes")
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+
+# Порт HTTP-сервера метрик Prometheus воркера Celery (у API метрики на /metrics)
+CELERY_METRICS_PORT = int(os.getenv("CELERY_METRICS_PORT", "9808"))
+
+# Кэш проверенных JWT внутри воркера: сколько токенов держать и сколько
+# секунд (не дольше срока действия токена). Меньше TTL - быстрее доходит
+# изменение пользователя, сделанное в обход UserManager
+AUTH_PRINCIPAL_CACHE_SIZE = int(os.getenv("AUTH_PRINCIPAL_CACHE_SIZE", "10000"))
+AUTH_PRINCIPAL_CACHE_TTL = float(os.getenv("AUTH_PRINCIPAL_CACHE_TTL", "300"))
+
+# Хэширование паролей (регистрация, логин): потоков в пуле на воркер,
+# сколько операций может ждать и выполняться одновременно (сверх этого - 503)
+# и насколько понижен приоритет потоков хэширования (nice, 0 - не понижать)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+PASSWORD_HASH_NICE = int(os.getenv("PASSWORD_HASH_NICE", "10"))
+
+# Ограничение частоты запросов (token bucket в Redis) по пользователю или IP:
+# скорость пополнения (запросов в секунду, 0 - без ограничения) и ёмкость
+# корзины (сколько запросов можно сделать подряд) для создания ссылок и редиректа
+RATE_LIMIT_SHORTEN_RATE = float(os.getenv("RATE_LIMIT_SHORTEN_RATE", "5"))
+RATE_LIMIT_SHORTEN_BURST = int(os.getenv("RATE_LIMIT_SHORTEN_BURST", "50"))
+RATE_LIMIT_REDIRECT_RATE = float(os.getenv("RATE_LIMIT_REDIRECT_RATE", "50"))
+RATE_LIMIT_REDIRECT_BURST = int(os.getenv("RATE_LIMIT_REDIRECT_BURST", "200"))
+
+# Сброс нагрузки (503 до начала обработки): задержка цикла событий (сек.) и
+# число запросов, ждущих соединение из пула БД, при которых воркер перестаёт
+# принимать запросы (0 - не проверять), и период замера задержки цикла (сек.)
+SHED_LOOP_LAG = float(os.getenv("SHED_LOOP_LAG", "0.5"))
+SHED_POOL_WAITERS = int(os.getenv("SHED_POOL_WAITERS", "20"))
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))
@@ -1,17 +1,128 @@
+import time
 from typing import AsyncGenerator
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
-from config import DB_HOST, DB_NAME, DB_PASS, DB_PORT, DB_USER
-from sqlalchemy import create_engine
+from config import (
+    DB_HOST, DB_NAME, DB_PASS, DB_PORT, DB_USER,
+    DB_MAX_OVERFLOW, DB_POOL_PRE_PING, DB_POOL_RECYCLE, DB_POOL_SIZE, DB_POOL_TIMEOUT,
+    DB_STATEMENT_CACHE_SIZE,
+)
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from metrics import (
+    DB_POOL_CAPACITY, DB_POOL_CHECKED_OUT, DB_POOL_CONNECTIONS, DB_POOL_OVERFLOW, DB_POOL_TIMEOUTS, DB_POOL_WAIT, DB_POOL_WAITING,
+)
 # Ссылка на нашу БД
 DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
 
+class PoolStats:
+    """Телеметрия пула соединений одного движка в текущем процессе.
+
+    Время ожидания соединения, таймауты при исчерпании пула, оборот
+    соединений (открыты, закрыты, признаны негодными), размер пула,
+    выданные соединения и переполнение пишутся в метрики Prometheus db_pool_* с меткой engine;
+    при нескольких воркерах они суммируются по процессам (см. metrics.py).
+    waiting - сколько запросов прямо сейчас ждут соединение в этом процессе
+    (по нему сбрасывается нагрузка, см. links/limits.py).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.pool = None
+        self.waiting = 0
+        self.wait = DB_POOL_WAIT.labels(name)
+        self.waiting_gauge = DB_POOL_WAITING.labels(name)
+        self.timeouts = DB_POOL_TIMEOUTS.labels(name)
+        self.size = DB_POOL_CAPACITY.labels(name)
+        self.overflow = DB_POOL_OVERFLOW.labels(name)
+        self.checked_out = DB_POOL_CHECKED_OUT.labels(name)
+
+    def attach(self, pool) -> None:
+        # При первой выдаче соединения: размер учитывается только у пулов,
+        # которыми процесс пользуется (синхронный движок в воркерах API простаивает)
+        self.pool = pool
+        self.size.set(pool.size())
+        self.refresh()
+
+    def refresh(self) -> None:
+        # overflow() отрицательный, пока открыто меньше pool_size соединений
+        if self.pool is not None:
+            self.overflow.set(max(self.pool.overflow(), 0))
+
+    def connection_event(self, name: str) -> None:
+        DB_POOL_CONNECTIONS.labels(self.name, name).inc()
+
+
+def instrumented_pool(base, stats: PoolStats):
+    # Подкласс пула, замеряющий ожидание соединения и переполнение после выдачи
+    # и возврата соединения. Класс, а не экземпляр, держит stats: при dispose()
+    # пул пересоздаётся тем же классом
+    def connect(self):
+        if stats.pool is not self:
+            stats.attach(self)
+        stats.waiting += 1
+        stats.waiting_gauge.inc()
+        started = time.perf_counter()
+        try:
+            return base.connect(self)
+        except PoolTimeoutError:
+            stats.timeouts.inc()
+            raise
+        finally:
+            stats.waiting -= 1
+            stats.waiting_gauge.dec()
+            stats.wait.observe(time.perf_counter() - started)
+            stats.refresh()
+
+    def do_return_conn(self, record):
+        try:
+            base._do_return_conn(self, record)
+        finally:
+            stats.refresh()
+
+    return type(
+        f"Instrumented{base.__name__}", (base,),
+        {"connect": connect, "_do_return_conn": do_return_conn, "stats": stats}
+    )
+
+
+def track_pool_events(engine, stats: PoolStats) -> None:
+    event.listen(engine, "checkout", lambda *args: stats.checked_out.inc())
+    event.listen(engine, "checkin", lambda *args: stats.checked_out.dec())
+    event.listen(engine, "connect", lambda *args: stats.connection_event("connect"))
+    event.listen(engine, "close", lambda *args: stats.connection_event("close"))
+    event.listen(engine, "close_detached", lambda *args: stats.connection_event("close"))
+    event.listen(engine, "invalidate", lambda *args: stats.connection_event("invalidate"))
+
+
+pool_options = dict(
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+)
+sync_pool_stats = PoolStats("sync")
+async_pool_stats = PoolStats("async")
 
 # Используем синхронный движок
-sync_engine = create_engine(f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}") 
-# Инициализируем ассинхроный драйвер для подключения к БД
-engine = create_async_engine(DATABASE_URL)
+sync_engine = create_engine(
+    f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}",
+    poolclass=instrumented_pool(QueuePool, sync_pool_stats),
+    **pool_options
+)
+# Инициализируем ассинхроный драйвер для подключения к БД.
+# Кэш подготовленных запросов есть и у asyncpg, и у диалекта SQLAlchemy
+engine = create_async_engine(
+    f"{DATABASE_URL}?prepared_statement_cache_size={DB_STATEMENT_CACHE_SIZE}",
+    poolclass=instrumented_pool(AsyncAdaptedQueuePool, async_pool_stats),
+    connect_args={"statement_cache_size": DB_STATEMENT_CACHE_SIZE},
+    **pool_options
+)
+track_pool_events(sync_engine, sync_pool_stats)
+track_pool_events(engine.sync_engine, async_pool_stats)
 
 # Задаем фабрику сессий, после фиксации транзакции, объекты не будут сразу же истекать
 async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
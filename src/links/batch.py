@@ -0,0 +1,176 @@
+import json
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List
+
+from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from config import BATCH_CHUNK_SIZE
+from database import async_session_maker
+from .cache import invalidate_link_cache_many
+from .models import links, owner_condition
+from .schemas import LinkCreateRequest, LinkResponse
+from .shortcodes import SHORT_CODE_MAX_ATTEMPTS, short_code_allocator
+from .urls import link_host, long_link_digest
+
+DUPLICATE_DETAIL = "Ссылка уже существует."
+ALIAS_DETAIL = "Custom alias уже используется. Пожалуйста, выберите другой."
+
+
+def parse_batch_body(body: bytes, content_type: str) -> List:
+    # NDJSON: по объекту на строку, иначе ожидаем JSON-массив
+    if "ndjson" in content_type:
+        items = []
+        for line in body.decode().splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                items.append(e)
+        return items
+    items = json.loads(body)
+    if not isinstance(items, list):
+        raise ValueError("Ожидается JSON-массив")
+    return items
+
+
+def _error(index: int, status_code: int, detail) -> dict:
+    return {"index": index, "status_code": status_code, "detail": detail}
+
+
+async def _process_chunk(session, chunk: List[tuple], user_id, seen_links: set, seen_aliases: set) -> Dict[int, dict]:
+    results: Dict[int, dict] = {}
+
+    # Дубли внутри самого запроса (по дайджестам канонической записи ссылки).
+    # seen_* - то, что создали прошлые порции: пополняются только после коммита,
+    # иначе после отката порции её ссылки и alias считались бы занятыми
+    pending = []
+    digests = {}
+    chunk_links, chunk_aliases = set(), set()
+    for index, req in chunk:
+        digest = long_link_digest(req.long_link)
+        if digest in seen_links or digest in chunk_links:
+            results[index] = _error(index, 400, DUPLICATE_DETAIL)
+        elif req.custom_alias and (req.custom_alias in seen_aliases or req.custom_alias in chunk_aliases):
+            results[index] = _error(index, 400, ALIAS_DETAIL)
+        else:
+            chunk_links.add(digest)
+            digests[index] = digest
+            if req.custom_alias:
+                chunk_aliases.add(req.custom_alias)
+            pending.append((index, req))
+    if not pending:
+        return results
+
+    now = datetime.now(timezone.utc)
+    generated = [item for item in pending if not item[1].custom_alias]
+    codes = iter(await short_code_allocator.allocate_many(len(generated), session))
+    rows = {}
+    for index, req in pending:
+        short_link = req.custom_alias
+        if not short_link:
+            short_link = next(codes)
+            # Код, совпавший с alias из этой же порции, вытеснил бы его при вставке
+            while short_link in chunk_aliases:
+                short_link = await short_code_allocator.allocate(session)
+        rows[index] = {
+            "long_link": req.long_link,
+            "long_link_digest": digests[index],
+            "host": link_host(req.long_link),
+            "short_link": short_link,
+            "auth": user_id is not None,
+            "user_id": user_id,
+            "start_date": now,
+            "last_date": now,
+            "num": 0,
+            "expires_at": req.expires_at.replace(tzinfo=timezone.utc) if req.expires_at else None,
+        }
+
+    # Все строки порции одним INSERT ... ON CONFLICT DO NOTHING RETURNING *.
+    # Дубли ссылок и занятые alias отсекают уникальные индексы; сгенерированным
+    # кодам, совпавшим с чужим alias, даём ещё попытку.
+    requests = dict(pending)
+    created: Dict[int, dict] = {}
+    for _ in range(SHORT_CODE_MAX_ATTEMPTS):
+        if not rows:
+            break
+        stmt = insert(links).values(list(rows.values())).on_conflict_do_nothing().returning(links)
+        # Строку порции узнаём по паре (код, дайджест): по одному коду её можно
+        # спутать с другой строкой порции, вставленной вместо неё
+        inserted = {
+            (row["short_link"], row["long_link_digest"]): dict(row)
+            for row in (await session.execute(stmt)).mappings()
+        }
+        skipped = {}
+        for index, row in rows.items():
+            key = (row["short_link"], row["long_link_digest"])
+            if key in inserted:
+                created[index] = inserted[key]
+            else:
+                skipped[index] = row
+        duplicates = await _existing_digests(session, [row["long_link_digest"] for row in skipped.values()], user_id)
+        retry = {}
+        for index, row in skipped.items():
+            if row["long_link_digest"] in duplicates:
+                results[index] = _error(index, 400, DUPLICATE_DETAIL)
+            elif requests[index].custom_alias:
+                results[index] = _error(index, 400, ALIAS_DETAIL)
+            else:
+                row["short_link"] = await short_code_allocator.allocate(session)
+                retry[index] = row
+        rows = retry
+    for index in rows:
+        results[index] = _error(index, 500, "Ошибка генерации уникального alias. Попробуйте снова.")
+    await session.commit()
+    for row in created.values():
+        seen_links.add(row["long_link_digest"])
+        seen_aliases.add(row["short_link"])
+
+    await invalidate_link_cache_many(
+        [row["short_link"] for row in created.values()], [row["long_link"] for row in created.values()]
+    )
+    for index, row in created.items():
+        results[index] = {
+            "index": index,
+            "status_code": 200,
+            "link": LinkResponse.model_validate(row).model_dump(mode="json"),
+        }
+    return results
+
+
+async def _existing_digests(session, digests: List[bytes], user_id) -> set:
+    # Какие из не вставленных ссылок уже есть у владельца (только при конфликтах)
+    if not digests:
+        return set()
+    stmt = select(links.c.long_link_digest).where(links.c.long_link_digest.in_(digests) & owner_condition(user_id))
+    return set((await session.execute(stmt)).scalars())
+
+
+async def shorten_batch(items: List, user_id=None, chunk_size: int = BATCH_CHUNK_SIZE) -> AsyncIterator[str]:
+    """Создаёт ссылки порциями и отдаёт результат по каждому элементу строкой NDJSON."""
+    seen_links: set = set()
+    seen_aliases: set = set()
+    # Сессия своя: зависимость get_async_session закрывается до начала стриминга
+    async with async_session_maker() as session:
+        for start in range(0, len(items), chunk_size):
+            results: Dict[int, dict] = {}
+            chunk = []
+            for index, item in enumerate(items[start:start + chunk_size], start=start):
+                if isinstance(item, Exception):
+                    results[index] = _error(index, 400, f"Некорректный JSON: {item}")
+                    continue
+                try:
+                    chunk.append((index, LinkCreateRequest.model_validate(item)))
+                except ValidationError as e:
+                    results[index] = _error(index, 422, json.loads(e.json(include_url=False)))
+            try:
+                results.update(await _process_chunk(session, chunk, user_id, seen_links, seen_aliases))
+            except Exception as e:
+                await session.rollback()
+                print(f"Ошибка пакетного создания ссылок: {e}")
+                for index, _ in chunk:
+                    results.setdefault(index, _error(index, 500, "Ошибка создания ссылки."))
+            for index in sorted(results):
+                yield json.dumps(results[index], ensure_ascii=False) + "\n"
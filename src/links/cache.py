@@ -0,0 +1,576 @@
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.redis import RedisBackend
+
+from config import (
+    CACHE_EARLY_REFRESH_BETA,
+    CACHE_LOCK_TTL,
+    CACHE_LOCK_WAIT,
+    CACHE_STALE_TTL,
+    L1_CACHE_MAX_SIZE,
+    L1_CACHE_TTL,
+    LINK_CACHE_MISS_TTL,
+    LINK_CACHE_TTL,
+    STATS_CACHE_TTL,
+)
+from database import async_session_maker
+from metrics import CACHE_REFRESHES, record_cache
+from .urls import long_link_digest
+
+# Канал Redis, через который воркеры сообщают друг другу об изменённых ссылках
+INVALIDATION_CHANNEL = "links:invalidate"
+
+
+class LocalCache:
+    """Ограниченный LRU-кэш с TTL внутри процесса воркера.
+
+    Стоит перед Redis и отвечает на самые частые запросы без сетевого
+    обращения. Считает попадания, промахи, вытеснения и устаревшие записи.
+    """
+
+    def __init__(self, maxsize: int = L1_CACHE_MAX_SIZE, ttl: float = L1_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (момент устаревания по time.monotonic(), значение)
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        return self.lookup(key)[0]
+
+    def lookup(self, key: str) -> Tuple[Optional[Any], str]:
+        """Значение и результат обращения: "hit", "miss" или "stale"."""
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None, "miss"
+        expires, value = item
+        if expires <= time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return None, "stale"
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value, "hit"
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    def pop_where(self, predicate: Callable[[Any], bool]) -> int:
+        # Полный проход по кэшу: для редких инвалидаций не по ключу
+        keys = [key for key, (_, value) in self._data.items() if predicate(value)]
+        for key in keys:
+            del self._data[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+link_l1 = LocalCache()
+# Клиент Redis для рассылки инвалидаций, задаётся в lifespan приложения
+_redis = None
+
+
+def init_link_cache(redis) -> None:
+    global _redis
+    _redis = redis
+
+
+def link_cache_key(short_link: str) -> str:
+    return f"long_link:{short_link}"
+
+
+def link_search_key(long_link: str) -> str:
+    # По дайджесту канонической записи, как и сам поиск
+    return f"search:{long_link_digest(long_link).hex()}"
+
+
+def live_stats_key(short_link: str) -> str:
+    # Хэш live-счётчиков переходов (см. links/live_stats.py)
+    return f"live:{short_link}"
+
+
+def link_stats_key(short_link: str) -> str:
+    return f"stats:{short_link}"
+
+
+def link_record_ttl(record: dict, now: Optional[float] = None) -> float:
+    """Сколько секунд можно хранить запись о ссылке в кэше.
+
+    Запись о ссылке со сроком действия удаляется из кэша в момент истечения,
+    без срока действия - хранится LINK_CACHE_TTL. Отсутствующая или уже
+    истёкшая ссылка кэшируется ненадолго, пока её не удалит sweep_expired_links.
+    """
+    if not record["active"]:
+        return LINK_CACHE_MISS_TTL
+    if record["expires_at"] is None:
+        return LINK_CACHE_TTL
+    remaining = record["expires_at"] - (time.time() if now is None else now)
+    if remaining <= 0:
+        return LINK_CACHE_MISS_TTL
+    return min(LINK_CACHE_TTL, remaining)
+
+
+def stats_ttl(expires_at: Optional[float], now: Optional[float] = None, live: bool = False) -> float:
+    # С live-счётчиками в кэше только неизменная часть статистики, её можно
+    # хранить как запись о ссылке; без них счётчик в кэше устаревает
+    ttl = LINK_CACHE_TTL if live else STATS_CACHE_TTL
+    if expires_at is None:
+        return ttl
+    return min(ttl, expires_at - (time.time() if now is None else now))
+
+
+async def cache_get(key: str) -> Optional[Any]:
+    try:
+        raw = await FastAPICache.get_backend().get(key)
+    except Exception as e:
+        print(f"Ошибка чтения кэша {key}: {e}")
+        return None
+    return json.loads(raw) if raw is not None else None
+
+
+async def cache_set(key: str, value: Any, ttl: float) -> None:
+    # Redis принимает целые секунды; округляем вниз, чтобы не пережить срок ссылки
+    expire = int(ttl)
+    if expire <= 0:
+        return
+    try:
+        await FastAPICache.get_backend().set(key, json.dumps(value), expire=expire)
+    except Exception as e:
+        print(f"Ошибка записи кэша {key}: {e}")
+
+
+# Поколение ключа кэша: инвалидация увеличивает gen:{key} до удаления самого
+# ключа, а загрузка записывает значение, только если поколение не сменилось с
+# момента перед чтением из БД. Иначе загрузка, начатая до изменения ссылки,
+# вернула бы в кэш старое значение уже после инвалидации. Счётчик хранится
+# GENERATION_TTL секунд - дольше любой загрузки
+GENERATION_TTL = 86400
+# Без Redis (memory://) поколение одно на процесс: любая инвалидация
+# отменяет запись всех начатых загрузок, они просто повторятся
+_memory_generation = 0
+
+
+def generation_key(key: str) -> str:
+    return f"gen:{key}"
+
+
+def queue_invalidation(pipe, keys: List[str]) -> None:
+    # Команды инвалидации в конвейер Redis (синхронный или асинхронный):
+    # сначала поколения, затем сами ключи
+    for key in keys:
+        pipe.incr(generation_key(key))
+        pipe.expire(generation_key(key), GENERATION_TTL)
+    pipe.delete(*keys)
+
+
+def bump_memory_generation() -> None:
+    global _memory_generation
+    _memory_generation += 1
+
+
+async def read_generation(key: str) -> Optional[str]:
+    """Текущее поколение ключа; None, если его не удалось прочитать."""
+    backend = FastAPICache.get_backend()
+    if not isinstance(backend, RedisBackend):
+        return str(_memory_generation)
+    try:
+        generation = await backend.redis.get(generation_key(key))
+    except Exception as e:
+        print(f"Ошибка чтения поколения {key}: {e}")
+        return None
+    if isinstance(generation, bytes):
+        generation = generation.decode()
+    return generation or "0"
+
+
+# Запись значения, только если поколение ключа не изменилось
+STORE_IF_GENERATION_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+
+async def cache_set_if_generation(key: str, value: Any, ttl: float, generation: Optional[str]) -> bool:
+    expire = int(ttl)
+    if expire <= 0 or generation is None:
+        return False
+    backend = FastAPICache.get_backend()
+    if not isinstance(backend, RedisBackend):
+        if generation != str(_memory_generation):
+            return False
+        await cache_set(key, value, ttl)
+        return True
+    try:
+        return bool(await backend.redis.eval(
+            STORE_IF_GENERATION_SCRIPT, 2, key, generation_key(key), generation, json.dumps(value), expire
+        ))
+    except Exception as e:
+        print(f"Ошибка записи кэша {key}: {e}")
+        return False
+
+
+# Снятие блокировки обновления, только если она всё ещё наша
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class CoalescingCache:
+    """Кэш в Redis, при котором ключ загружает из БД один запрос, а не все сразу.
+
+    Запись хранится вместе с моментом устаревания (exp) и временем своей
+    загрузки (delta). Протухшая запись живёт ещё stale_ttl секунд: её
+    отдают как есть, а обновляет фоновая задача (stale-while-revalidate).
+    Незадолго до exp запись обновляется заранее с вероятностью, растущей
+    к exp и пропорциональной delta (XFetch): у горячего ключа обновление
+    обычно успевает до истечения, и промаха нет совсем. При промахе
+    одновременные запросы воркера ждут загрузку первого (single-flight),
+    а между воркерами загрузку разделяет короткая блокировка в Redis:
+    не получивший её воркер ждёт появления записи до lock_wait секунд.
+
+    loader(session) возвращает значение (None - тоже значение, например
+    «ссылки нет»), ttl(value) - сколько секунд оно свежее, deadline(value) -
+    unix-время, дольше которого запись не хранится даже устаревшей.
+    Значение, полученное ожидающими загрузку, общее - его нельзя менять.
+    """
+
+    def __init__(self, name: str, ttl: Callable[[Any], float],
+                 deadline: Optional[Callable[[Any], Optional[float]]] = None,
+                 stale_ttl: float = CACHE_STALE_TTL, beta: float = CACHE_EARLY_REFRESH_BETA,
+                 lock_ttl: float = CACHE_LOCK_TTL, lock_wait: float = CACHE_LOCK_WAIT,
+                 session_factory=async_session_maker):
+        self.name = name
+        self.ttl = ttl
+        self.deadline = deadline
+        self.stale_ttl = stale_ttl
+        self.beta = beta
+        self.lock_ttl = lock_ttl
+        self.lock_wait = lock_wait
+        self.session_factory = session_factory
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._refreshing: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def get(self, key: str, loader: Callable[[Any], Awaitable[Any]], session) -> Any:
+        entry = await self.read(key)
+        if entry is not None:
+            self._serve(key, entry, loader)
+            return entry["v"]
+        return await self._load(key, loader, session)
+
+    async def peek(self, key: str, loader: Callable[[Any], Awaitable[Any]]) -> Optional[Any]:
+        """Значение из кэша (возможно, устаревшее) без загрузки; None при промахе.
+
+        Для значений, которые сами не бывают None. Промах не учитывается
+        в метриках: его учтёт get(), который вызовут следом.
+        """
+        entry = await self.read(key)
+        if entry is None:
+            return None
+        self._serve(key, entry, loader)
+        return entry["v"]
+
+    async def read(self, key: str) -> Optional[dict]:
+        entry = await cache_get(key)
+        # Запись старого формата (без exp) считаем промахом
+        if not isinstance(entry, dict) or "exp" not in entry:
+            return None
+        return entry
+
+    def entry(self, value: Any, delta: float = 0.0) -> Tuple[dict, float]:
+        """Запись для кэша и сколько секунд её хранить (с учётом stale_ttl и deadline)."""
+        now = time.time()
+        ttl = self.ttl(value)
+        expire = ttl + self.stale_ttl
+        deadline = self.deadline(value) if self.deadline is not None else None
+        if deadline is not None:
+            expire = min(expire, deadline - now)
+        return {"v": value, "exp": now + ttl, "delta": delta}, expire
+
+    async def store(self, key: str, value: Any, delta: float = 0.0, generation: Optional[str] = None) -> None:
+        # С generation (read_generation до загрузки) значение не записывается,
+        # если ключ за это время инвалидировали
+        if generation is None:
+            await cache_set(key, *self.entry(value, delta))
+        else:
+            await cache_set_if_generation(key, *self.entry(value, delta), generation)
+
+    def _serve(self, key: str, entry: dict, loader) -> None:
+        now = time.time()
+        if now >= entry["exp"]:
+            record_cache(self.name, "stale")
+            self._refresh_in_background(key, loader, "stale")
+            return
+        record_cache(self.name, "hit")
+        # XFetch: -log(U) при U из (0, 1] - экспоненциальная случайная величина
+        if self.beta > 0 and now - entry["delta"] * self.beta * math.log(1.0 - random.random()) >= entry["exp"]:
+            self._refresh_in_background(key, loader, "early")
+
+    async def _load(self, key: str, loader, session) -> Any:
+        flight = self._inflight.get(key)
+        if flight is not None:
+            record_cache(self.name, "coalesced")
+            return await asyncio.shield(flight)
+        record_cache(self.name, "miss")
+        flight = asyncio.get_running_loop().create_future()
+        # Если никто не ждал, исключение не должно попасть в лог как необработанное
+        flight.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = flight
+        try:
+            value = await self._load_shared(key, loader, session)
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except Exception as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        flight.set_result(value)
+        return value
+
+    async def _load_shared(self, key: str, loader, session) -> Any:
+        lock = await self._lock(key)
+        if lock is None:
+            # Ключ уже загружает другой воркер - ждём его запись
+            entry = await self._wait_for(key)
+            if entry is not None:
+                return entry["v"]
+        try:
+            return await self._compute(key, loader, session)
+        finally:
+            await self._unlock(key, lock)
+
+    async def _compute(self, key: str, loader, session) -> Any:
+        # Поколение читается до запроса к БД: инвалидация после него отменит запись
+        generation = await read_generation(key)
+        started = time.perf_counter()
+        value = await loader(session)
+        if generation is not None:
+            await self.store(key, value, time.perf_counter() - started, generation)
+        return value
+
+    def _refresh_in_background(self, key: str, loader, reason: str) -> None:
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+        task = asyncio.create_task(self._refresh(key, loader, reason))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refresh(self, key: str, loader, reason: str) -> None:
+        try:
+            lock = await self._lock(key)
+            if lock is None:
+                return  # обновляет другой воркер
+            try:
+                # Сессия запроса к этому времени может быть уже закрыта
+                async with self.session_factory() as session:
+                    await self._compute(key, loader, session)
+                CACHE_REFRESHES.labels(self.name, reason).inc()
+            finally:
+                await self._unlock(key, lock)
+        except Exception as e:
+            print(f"Не удалось обновить кэш {key}: {e}")
+        finally:
+            self._refreshing.discard(key)
+
+    async def _lock(self, key: str) -> Optional[str]:
+        # Токен блокировки; "" без Redis (блокировать нечем), None - занята
+        if _redis is None:
+            return ""
+        token = uuid.uuid4().hex
+        try:
+            acquired = await _redis.set(f"lock:{key}", token, nx=True, px=int(self.lock_ttl * 1000))
+        except Exception as e:
+            print(f"Не удалось взять блокировку {key}: {e}")
+            return ""
+        return token if acquired else None
+
+    async def _unlock(self, key: str, token: Optional[str]) -> None:
+        if not token or _redis is None:
+            return
+        try:
+            await _redis.eval(RELEASE_LOCK_SCRIPT, 1, f"lock:{key}", token)
+        except Exception as e:
+            print(f"Не удалось снять блокировку {key}: {e}")
+
+    async def _wait_for(self, key: str, poll: float = 0.02) -> Optional[dict]:
+        deadline = time.monotonic() + self.lock_wait
+        while time.monotonic() < deadline:
+            await asyncio.sleep(poll)
+            entry = await self.read(key)
+            if entry is not None:
+                return entry
+        return None
+
+
+def link_cache_keys(short_links: List[str], deleted: bool = False) -> List[str]:
+    # Ключи Redis, которые зависят от записи о ссылке. Live-счётчик переходов
+    # сбрасывается только при удалении: смена адреса переходы не меняет, а
+    # без хэша ещё не сброшенные переходы из буферов воркеров потерялись бы
+    keys = []
+    for short_link in short_links:
+        keys += [link_cache_key(short_link), link_stats_key(short_link)]
+        if deleted:
+            keys.append(live_stats_key(short_link))
+    return keys
+
+
+async def invalidate_stats_cache(short_links: List[str]) -> None:
+    # Статистика хранится только в Redis, рассылать инвалидацию не нужно
+    if not short_links:
+        return
+    backend = FastAPICache.get_backend()
+    keys = [link_stats_key(short_link) for short_link in short_links]
+    try:
+        if isinstance(backend, RedisBackend):
+            pipe = backend.redis.pipeline(transaction=False)
+            queue_invalidation(pipe, keys)
+            await pipe.execute()
+            return
+        bump_memory_generation()
+        for key in keys:
+            try:
+                await backend.clear(key=key)
+            except KeyError:
+                pass
+    except Exception as e:
+        print(f"Не удалось сбросить кэш статистики {short_links[:5]}: {e}")
+
+
+async def invalidate_link_cache(short_link: str, *long_links: str, deleted: bool = False) -> None:
+    await invalidate_link_cache_many([short_link], list(long_links), deleted)
+
+
+async def invalidate_link_cache_many(short_links: List[str], long_links: Sequence[str] = (),
+                                     deleted: bool = False) -> None:
+    # long_links - адреса, поиск по которым (/links/search) мог измениться:
+    # результат поиска, в том числе «не найдено», тоже лежит в кэше
+    if not short_links:
+        return
+    for short_link in short_links:
+        link_l1.pop(link_cache_key(short_link))
+    keys = link_cache_keys(short_links, deleted) + [link_search_key(long_link) for long_link in long_links]
+    backend = FastAPICache.get_backend()
+    if isinstance(backend, RedisBackend):
+        # Удаляем ключи и рассылаем инвалидации за одно обращение к Redis
+        pipe = backend.redis.pipeline(transaction=False)
+        queue_invalidation(pipe, keys)
+        for short_link in short_links:
+            pipe.publish(INVALIDATION_CHANNEL, short_link)
+        try:
+            await pipe.execute()
+        except Exception as e:
+            print(f"Не удалось сбросить кэш ссылок {short_links[:5]}: {e}")
+        return
+    bump_memory_generation()
+    for key in keys:
+        try:
+            await backend.clear(key=key)
+        except KeyError:
+            # InMemoryBackend бросает KeyError, если ключа нет
+            pass
+    # Остальные воркеры удалят запись из своего L1 по сообщению из канала
+    if _redis is not None:
+        try:
+            pipe = _redis.pipeline(transaction=False)
+            for short_link in short_links:
+                pipe.publish(INVALIDATION_CHANNEL, short_link)
+            await pipe.execute()
+        except Exception as e:
+            print(f"Не удалось разослать инвалидацию {short_links[:5]}: {e}")
+
+
+# Канал -> (обработчик сообщения, сброс всего локального кэша)
+invalidation_handlers: Dict[str, Tuple[Callable[[str], None], Callable[[], None]]] = {
+    INVALIDATION_CHANNEL: (lambda short_link: link_l1.pop(link_cache_key(short_link)), link_l1.clear),
+}
+
+
+def register_invalidation_handler(channel: str, on_message: Callable[[str], None],
+                                  on_reset: Callable[[], None]) -> None:
+    # Другие локальные кэши воркера (например, auth/principals.py) слушают
+    # свои каналы через то же соединение
+    invalidation_handlers[channel] = (on_message, on_reset)
+
+
+def _reset_local_caches() -> None:
+    for _, on_reset in invalidation_handlers.values():
+        on_reset()
+
+
+async def run_invalidation_listener(redis, max_backoff: float = 30) -> None:
+    backoff = 1
+    while True:
+        pubsub = redis.pubsub()
+        try:
+            await pubsub.subscribe(*invalidation_handlers)
+            # Пока подписки не было, сообщения могли потеряться
+            _reset_local_caches()
+            backoff = 1
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                channel, data = message["channel"], message["data"]
+                if isinstance(channel, bytes):
+                    channel = channel.decode()
+                if isinstance(data, bytes):
+                    data = data.decode()
+                handler = invalidation_handlers.get(channel)
+                if handler is not None:
+                    handler[0](data)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Потеряно соединение с каналом инвалидации: {e}")
+            _reset_local_caches()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, max_backoff)
+        finally:
+            try:
+                await pubsub.close()
+            except Exception:
+                pass
@@ -0,0 +1,166 @@
+import asyncio
+import ipaddress
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy.dialects.postgresql import insert
+
+from config import CLICK_EVENTS_BATCH_SIZE, CLICK_EVENTS_FLUSH_INTERVAL, CLICK_EVENTS_QUEUE_SIZE
+from database import engine
+from .models import link_clicks, link_clicks_daily, link_clicks_hourly
+
+# Ограничения длины заголовков, которые сохраняем в истории
+MAX_REFERRER_LENGTH = 2048
+MAX_USER_AGENT_LENGTH = 512
+
+
+class ClickEvent(NamedTuple):
+    link_id: int
+    clicked_at: datetime
+    referrer: Optional[str]
+    user_agent: Optional[str]
+    ip_prefix: Optional[str]
+
+
+def ip_prefix(host: Optional[str]) -> Optional[str]:
+    # Полный адрес не храним: только сеть /24 (IPv4) или /48 (IPv6)
+    if not host:
+        return None
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return None
+    prefix = 24 if address.version == 4 else 48
+    return str(ipaddress.ip_network(f"{address}/{prefix}", strict=False))
+
+
+def rollup(events: List[ClickEvent]) -> Tuple[Dict[tuple, int], Dict[tuple, int]]:
+    """Считает переходы пачки по (link_id, час) и (link_id, день) в UTC."""
+    hourly: Counter = Counter()
+    daily: Counter = Counter()
+    for event in events:
+        clicked_at = event.clicked_at.astimezone(timezone.utc)
+        hourly[(event.link_id, clicked_at.replace(minute=0, second=0, microsecond=0))] += 1
+        daily[(event.link_id, clicked_at.date())] += 1
+    return hourly, daily
+
+
+def build_rollup_upsert(table, counts: Dict[tuple, int]):
+    # Строки VALUES вставляются по порядку: сортировка по (link_id, bucket)
+    # задаёт один порядок блокировок для всех воркеров, иначе параллельные
+    # сбросы с общими ссылками могут заблокировать друг друга
+    rows = [
+        {"link_id": link_id, "bucket": bucket, "clicks": clicks}
+        for (link_id, bucket), clicks in sorted(counts.items())
+    ]
+    stmt = insert(table).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.link_id, table.c.bucket],
+        set_={"clicks": table.c.clicks + stmt.excluded.clicks}
+    )
+
+
+class ClickEventQueue:
+    """Очередь событий переходов для истории и агрегатов.
+
+    Редирект только кладёт событие в ограниченную очередь и не ждёт БД.
+    Фоновая задача забирает события пачками, дописывает их в link_clicks
+    через COPY и в той же транзакции увеличивает почасовые и посуточные
+    агрегаты. Если очередь заполнена, событие отбрасывается и учитывается
+    в dropped: история переходов не должна замедлять редирект.
+    """
+
+    def __init__(self, maxsize: int = CLICK_EVENTS_QUEUE_SIZE, batch_size: int = CLICK_EVENTS_BATCH_SIZE):
+        self.batch_size = batch_size
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._batch_ready = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self.dropped = 0
+        self.written = 0
+
+    def record(self, link_id: int, referrer: Optional[str] = None, user_agent: Optional[str] = None,
+               host: Optional[str] = None, clicked_at: Optional[datetime] = None) -> None:
+        event = ClickEvent(
+            link_id,
+            clicked_at or datetime.now(timezone.utc),
+            referrer[:MAX_REFERRER_LENGTH] if referrer else None,
+            user_agent[:MAX_USER_AGENT_LENGTH] if user_agent else None,
+            ip_prefix(host)
+        )
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return
+        if self._queue.qsize() >= self.batch_size:
+            self._batch_ready.set()
+
+    def __len__(self) -> int:
+        return self._queue.qsize()
+
+    async def wait_batch(self) -> None:
+        await self._batch_ready.wait()
+
+    def _take(self) -> List[ClickEvent]:
+        events = []
+        while len(events) < self.batch_size and not self._queue.empty():
+            events.append(self._queue.get_nowait())
+        return events
+
+    async def flush(self) -> int:
+        # Пишем только то, что было в очереди на момент вызова
+        async with self._flush_lock:
+            self._batch_ready.clear()
+            written = 0
+            remaining = self._queue.qsize()
+            while remaining > 0:
+                events = self._take()
+                remaining -= len(events)
+                try:
+                    await write_click_events(events)
+                except BaseException:
+                    # Возвращаем пачку в очередь, сколько поместится
+                    for event in events:
+                        try:
+                            self._queue.put_nowait(event)
+                        except asyncio.QueueFull:
+                            self.dropped += 1
+                    raise
+                written += len(events)
+            self.written += written
+            return written
+
+
+async def write_click_events(events: List[ClickEvent]) -> None:
+    if not events:
+        return
+    hourly, daily = rollup(events)
+    async with engine.begin() as conn:
+        # Агрегаты первыми: первый execute открывает транзакцию, в которой пойдёт COPY
+        await conn.execute(build_rollup_upsert(link_clicks_hourly, hourly))
+        await conn.execute(build_rollup_upsert(link_clicks_daily, daily))
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            link_clicks.name,
+            records=events,
+            columns=list(ClickEvent._fields)
+        )
+
+
+async def run_click_event_flusher(queue: ClickEventQueue, interval: float = CLICK_EVENTS_FLUSH_INTERVAL) -> None:
+    while True:
+        try:
+            await asyncio.wait_for(queue.wait_batch(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+        try:
+            await queue.flush()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Ошибка записи истории переходов: {e}")
+            await asyncio.sleep(interval)
+
+
+click_events = ClickEventQueue()
@@ -0,0 +1,170 @@
+import asyncio
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import DateTime, Integer, String, column, func, select, update, values
+
+from config import CLICK_BUFFER_MAX_LINKS, CLICK_FLUSH_INTERVAL
+from database import engine
+from .cache import invalidate_stats_cache
+from .live_stats import live_clicks
+from .models import links
+
+# Сколько ссылок отправляем в одном UPDATE ... FROM (VALUES ...).
+# У asyncpg ограничение в 32767 параметров на запрос, на строку уходит 3.
+FLUSH_CHUNK_SIZE = 5000
+
+
+class ClickBuffer:
+    """Буфер переходов по ссылкам (write-behind).
+
+    Редирект только увеличивает счётчик в памяти воркера, а периодический
+    сброс применяет накопленные приращения num/last_date одним пакетным
+    UPDATE. При штатной остановке буфер сбрасывается целиком, при падении
+    теряются не более чем переходы за один интервал сброса.
+    """
+
+    def __init__(self, max_links: int = CLICK_BUFFER_MAX_LINKS):
+        self.max_links = max_links
+        # short_link -> [количество переходов, время последнего перехода]
+        self._pending: Dict[str, List] = {}
+        self._flush_lock = asyncio.Lock()
+        self._overflow = asyncio.Event()
+
+    def record(self, short_link: str, clicked_at: Optional[datetime] = None) -> None:
+        clicked_at = clicked_at or datetime.now(timezone.utc)
+        entry = self._pending.get(short_link)
+        if entry is None:
+            self._pending[short_link] = [1, clicked_at]
+            if len(self._pending) >= self.max_links:
+                self._overflow.set()
+        else:
+            entry[0] += 1
+            if clicked_at > entry[1]:
+                entry[1] = clicked_at
+
+    def pending(self, short_link: str) -> int:
+        entry = self._pending.get(short_link)
+        return entry[0] if entry else 0
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    async def wait_overflow(self) -> None:
+        await self._overflow.wait()
+
+    async def flush(self) -> int:
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            self._overflow.clear()
+            await self._before_apply(batch)
+            applied: Dict[str, List] = {}
+            try:
+                await self._apply(batch, applied)
+            except BaseException:
+                # Возвращаем непримененные приращения обратно (в том числе при
+                # отмене задачи), чтобы не потерять их до следующей попытки.
+                # Порции, уже зафиксированные в БД, повторно не применяются
+                failed = {short_link: entry for short_link, entry in batch.items() if short_link not in applied}
+                self._merge(failed)
+                await self._abort_apply(failed)
+                if applied:
+                    await self._after_apply(applied)
+                raise
+            await self._after_apply(batch)
+            return sum(count for count, _ in batch.values())
+
+    async def _before_apply(self, batch: Dict[str, List]) -> None:
+        # Отмечаем сброс в live-счётчиках до транзакции: после её фиксации
+        # links.num уже включает переходы, которые ещё числятся в pending,
+        # и сверять с ним счётчик до _after_apply нельзя
+        try:
+            await live_clicks.begin_flush(list(batch))
+        except Exception as e:
+            print(f"Не удалось отметить сброс счётчиков переходов: {e}")
+
+    async def _abort_apply(self, batch: Dict[str, List]) -> None:
+        try:
+            await live_clicks.abort_flush(list(batch))
+        except Exception as e:
+            print(f"Не удалось снять отметку сброса счётчиков переходов: {e}")
+
+    async def _after_apply(self, batch: Dict[str, List]) -> None:
+        # Переходы уже в БД: переносим их из pending в num live-счётчиков,
+        # а без Redis сбрасываем кэш статистики, где счётчик без них
+        try:
+            if live_clicks.enabled:
+                await live_clicks.apply_flush({short_link: count for short_link, (count, _) in batch.items()})
+            else:
+                await invalidate_stats_cache(list(batch))
+        except Exception as e:
+            print(f"Не удалось обновить счётчики статистики после сброса: {e}")
+
+    def _merge(self, batch: Dict[str, List]) -> None:
+        for short_link, (count, clicked_at) in batch.items():
+            entry = self._pending.setdefault(short_link, [0, clicked_at])
+            entry[0] += count
+            if clicked_at > entry[1]:
+                entry[1] = clicked_at
+
+    async def _apply(self, batch: Dict[str, List], applied: Dict[str, List]) -> None:
+        # Каждая порция - своя транзакция: строки одной порции блокируются в
+        # порядке id (build_flush_statement), и воркеры, сбрасывающие одни и те
+        # же популярные ссылки, не берут блокировки навстречу друг другу.
+        # Зафиксированные порции переносятся в applied
+        rows = sorted((short_link, count, clicked_at) for short_link, (count, clicked_at) in batch.items())
+        for start in range(0, len(rows), FLUSH_CHUNK_SIZE):
+            chunk = rows[start:start + FLUSH_CHUNK_SIZE]
+            async with engine.begin() as conn:
+                await conn.execute(build_flush_statement(chunk))
+            for short_link, _, _ in chunk:
+                applied[short_link] = batch[short_link]
+
+
+def build_flush_statement(rows: List[tuple]):
+    # WITH locked AS MATERIALIZED (SELECT ... FROM links JOIN (VALUES ...) AS d
+    #     ON links.short_link = d.short_link ORDER BY links.id FOR UPDATE OF links)
+    # UPDATE links SET num = num + locked.clicks, last_date = GREATEST(last_date, locked.clicked_at)
+    # FROM locked WHERE links.id = locked.id
+    # Порядок соединения в UPDATE ... FROM не определён, поэтому строки сначала
+    # блокируются в порядке id: два сброса с общими ссылками не дают взаимоблокировки
+    deltas = values(
+        column("short_link", String),
+        column("clicks", Integer),
+        column("clicked_at", DateTime(timezone=True)),
+        name="deltas",
+    ).data(rows)
+    locked = (
+        select(links.c.id, deltas.c.clicks, deltas.c.clicked_at)
+        .join_from(links, deltas, links.c.short_link == deltas.c.short_link)
+        .order_by(links.c.id)
+        .with_for_update(of=links)
+        .cte("locked")
+        .prefix_with("MATERIALIZED")
+    )
+    return (
+        update(links)
+        .where(links.c.id == locked.c.id)
+        .values(
+            num=links.c.num + locked.c.clicks,
+            last_date=func.greatest(links.c.last_date, locked.c.clicked_at),
+        )
+    )
+
+
+async def run_click_flusher(buffer: ClickBuffer, interval: float = CLICK_FLUSH_INTERVAL) -> None:
+    # Сбрасываем буфер раз в interval секунд или досрочно, если он переполнился
+    while True:
+        try:
+            await asyncio.wait_for(buffer.wait_overflow(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+        try:
+            await buffer.flush()
+        except Exception as e:
+            print(f"Ошибка сброса счётчиков переходов: {e}")
+
+
+click_buffer = ClickBuffer()
@@ -0,0 +1,103 @@
+import time
+from functools import lru_cache
+from urllib.parse import parse_qs, quote
+
+from fastapi import HTTPException
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+from config import L1_CACHE_MAX_SIZE
+from metrics import REQUEST_LATENCY, REQUESTS_IN_PROGRESS, record_cache
+from .cache import link_cache_key, link_l1, link_record_ttl
+from .limits import REDIRECT_POLICY, check_rate_limit, client_identity, load_shedder
+from .router import count_click, link_record_error, link_record_loader, link_records
+from .urls import redirect_url
+
+# Путь маршрута редиректа get_long_link (префикс роутера + "/")
+REDIRECT_PATH = "/links/"
+
+
+@lru_cache(maxsize=L1_CACHE_MAX_SIZE)
+def redirect_headers(long_link: str) -> list:
+    # Заголовки ответа собираются один раз на ссылку; Location экранируется как в RedirectResponse
+    location = quote(redirect_url(long_link), safe=":/%#?=@[]!$&'()*+,;")
+    return [(b"content-length", b"0"), (b"location", location.encode("latin-1"))]
+
+
+def header(scope, name: bytes):
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+class RedirectFastPath:
+    """ASGI middleware: редирект по записи из кэша без FastAPI.
+
+    GET /links/?short_link=... с записью в локальном кэше воркера или в
+    Redis обслуживается здесь: без разбора параметров pydantic, без
+    зависимостей (сессия БД не открывается) и без RedirectResponse -
+    заголовки ответа готовы заранее. Ограничение частоты и учёт перехода
+    те же, что у маршрута. Всё остальное - промах кэша, перегрузка воркера
+    (503 отдаёт маршрут), другие пути и методы - уходит в приложение как
+    обычно; при промахе маршрут повторяет поиск в кэше и читает БД.
+    Метрики задержки обслуженных здесь запросов пишутся сами, так как
+    PrometheusMiddleware их не видит.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET" or scope["path"] != REDIRECT_PATH:
+            await self.app(scope, receive, send)
+            return
+        short_links = parse_qs(scope["query_string"].decode("latin-1")).get("short_link")
+        if not short_links or load_shedder.overload_reason() is not None:
+            await self.app(scope, receive, send)
+            return
+        short_link = short_links[-1]
+
+        started = time.perf_counter()
+        key = link_cache_key(short_link)
+        record, l1_result = link_l1.lookup(key)
+        if record is None:
+            # Устаревшая запись тоже годится: её обновит фоновая задача
+            record = await link_records.peek(key, link_record_loader(short_link))
+            if record is None:
+                # Маршрут повторит поиск и сам учтёт промах
+                await self.app(scope, receive, send)
+                return
+            record_cache("link_l1", l1_result)
+            link_l1.set(key, record, link_record_ttl(record))
+        else:
+            record_cache("link_l1", l1_result)
+
+        in_progress = REQUESTS_IN_PROGRESS.labels("GET", REDIRECT_PATH)
+        in_progress.inc()
+        try:
+            status = await self.respond(scope, receive, send, short_link, record)
+        finally:
+            in_progress.dec()
+        REQUEST_LATENCY.labels("GET", REDIRECT_PATH, str(status)).observe(time.perf_counter() - started)
+
+    async def respond(self, scope, receive, send, short_link: str, record: dict) -> int:
+        try:
+            await check_rate_limit(REDIRECT_POLICY, client_identity(Request(scope)))
+        except HTTPException as e:
+            await JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=e.headers)(scope, receive, send)
+            return e.status_code
+        error = link_record_error(record)
+        if error is not None:
+            await JSONResponse({"detail": error}, status_code=404)(scope, receive, send)
+            return 404
+        client = scope.get("client")
+        await count_click(
+            short_link, record,
+            referrer=header(scope, b"referer"),
+            user_agent=header(scope, b"user-agent"),
+            host=client[0] if client else None
+        )
+        await send({"type": "http.response.start", "status": 307, "headers": redirect_headers(record["long_link"])})
+        await send({"type": "http.response.body", "body": b""})
+        return 307
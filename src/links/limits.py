@@ -0,0 +1,181 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Callable, List, NamedTuple, Optional
+
+from fastapi import Depends, HTTPException, Request, status
+
+from config import (
+    LOOP_LAG_INTERVAL, RATE_LIMIT_REDIRECT_BURST, RATE_LIMIT_REDIRECT_RATE,
+    RATE_LIMIT_SHORTEN_BURST, RATE_LIMIT_SHORTEN_RATE, SHED_LOOP_LAG, SHED_POOL_WAITERS,
+)
+from database import PoolStats, async_pool_stats
+from metrics import EVENT_LOOP_LAG, RATE_LIMITED, REQUESTS_SHED
+
+# Корзина токенов ratelimit:{policy}:{identity} - хэш tokens (сколько осталось)
+# и ts (время последнего списания). Время берётся у Redis, а не у воркеров,
+# чтобы расхождение часов между машинами не влияло на пополнение.
+# Пополнение считается при обращении; при отказе ключ не меняется.
+# Возвращает {1, ""} или {0, через сколько секунд хватит токенов}
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(now - ts, 0) * rate)
+if tokens < cost then
+    return {0, tostring((cost - tokens) / rate)}
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens - cost), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {1, ''}
+"""
+
+
+class RateLimitPolicy(NamedTuple):
+    name: str
+    # Пополнение корзины, запросов в секунду (0 - без ограничения)
+    rate: float
+    # Ёмкость корзины: сколько запросов подряд можно сделать после паузы
+    burst: int
+
+
+SHORTEN_POLICY = RateLimitPolicy("shorten", RATE_LIMIT_SHORTEN_RATE, RATE_LIMIT_SHORTEN_BURST)
+REDIRECT_POLICY = RateLimitPolicy("redirect", RATE_LIMIT_REDIRECT_RATE, RATE_LIMIT_REDIRECT_BURST)
+
+
+def rate_limit_key(policy: str, identity: str) -> str:
+    return f"ratelimit:{policy}:{identity}"
+
+
+class RateLimiter:
+    """Ограничение частоты запросов token bucket'ом в Redis.
+
+    Списание токенов - один вызов Lua-скрипта, поэтому лимит общий для
+    всех воркеров и не обходится параллельными запросами. Без клиента
+    Redis (memory://) и при ошибках Redis запросы не ограничиваются:
+    лимит на воркер при нескольких воркерах ничего не гарантирует.
+    """
+
+    def __init__(self):
+        self.redis = None
+
+    def init(self, redis) -> None:
+        self.redis = redis
+        if redis is not None:
+            self._acquire = redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def acquire(self, policy: RateLimitPolicy, identity: str, cost: int = 1) -> Optional[float]:
+        """Списывает cost токенов; None, если можно, иначе через сколько секунд повторить.
+
+        cost больше ёмкости корзины урезается до ёмкости, иначе такой
+        запрос не прошёл бы никогда.
+        """
+        if self.redis is None or policy.rate <= 0:
+            return None
+        try:
+            allowed, retry_after = await self._acquire(
+                keys=[rate_limit_key(policy.name, identity)],
+                args=[policy.rate, policy.burst, min(cost, policy.burst)]
+            )
+        except Exception as e:
+            print(f"Не удалось проверить ограничение частоты {policy.name}: {e}")
+            return None
+        if allowed:
+            return None
+        return float(retry_after)
+
+
+class LoadShedder:
+    """Признаки перегрузки воркера: задержка цикла событий и очередь к пулу БД.
+
+    Задержку цикла замеряет фоновая задача run_lag_monitor: насколько позже
+    заказанного просыпается asyncio.sleep. Пока задержка или число ждущих
+    соединение из пула выше порога, новые запросы сразу получают 503:
+    поставленные в очередь они всё равно не успели бы, а удлинили бы
+    ожидание остальных. По задержке сброс включается, только если выше
+    порога два замера подряд: одиночная пауза (сборка мусора, долгий
+    синхронный вызов) уже прошла, и отказывать после неё незачем.
+    """
+
+    def __init__(self, max_loop_lag: float = SHED_LOOP_LAG, max_pool_waiters: int = SHED_POOL_WAITERS,
+                 pool_stats: PoolStats = async_pool_stats, interval: float = LOOP_LAG_INTERVAL):
+        self.max_loop_lag = max_loop_lag
+        self.max_pool_waiters = max_pool_waiters
+        self.pool_stats = pool_stats
+        self.interval = interval
+        self.lag_samples = deque([0.0, 0.0], maxlen=2)
+
+    @property
+    def loop_lag(self) -> float:
+        return min(self.lag_samples)
+
+    def record_lag(self, lag: float) -> None:
+        self.lag_samples.append(lag)
+        EVENT_LOOP_LAG.set(lag)
+
+    def overload_reason(self) -> Optional[str]:
+        if self.max_loop_lag > 0 and self.loop_lag >= self.max_loop_lag:
+            return "loop_lag"
+        if self.max_pool_waiters > 0 and self.pool_stats.waiting >= self.max_pool_waiters:
+            return "pool_wait"
+        return None
+
+    async def run_lag_monitor(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.record_lag(max(time.perf_counter() - started - self.interval, 0.0))
+
+
+rate_limiter = RateLimiter()
+load_shedder = LoadShedder()
+
+
+def client_identity(request: Request) -> str:
+    # Адрес клиента; за прокси - из X-Forwarded-For (uvicorn --proxy-headers)
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+def shed_load(policy: RateLimitPolicy) -> Callable:
+    async def dependency() -> None:
+        reason = load_shedder.overload_reason()
+        if reason is not None:
+            REQUESTS_SHED.labels(policy.name, reason).inc()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Сервис перегружен, повторите позже.",
+                headers={"Retry-After": "1"}
+            )
+    return dependency
+
+
+async def check_rate_limit(policy: RateLimitPolicy, identity: str, cost: int = 1) -> None:
+    retry_after = await rate_limiter.acquire(policy, identity, cost)
+    if retry_after is not None:
+        RATE_LIMITED.labels(policy.name).inc()
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Слишком много запросов, повторите позже.",
+            headers={"Retry-After": str(max(math.ceil(retry_after), 1))}
+        )
+
+
+def rate_limit(policy: RateLimitPolicy, identity: Callable = client_identity) -> Callable:
+    async def dependency(key: str = Depends(identity)) -> None:
+        await check_rate_limit(policy, key)
+    return dependency
+
+
+def request_guards(policy: RateLimitPolicy, identity: Callable = client_identity) -> List:
+    """Зависимости маршрута: сначала сброс нагрузки, затем лимит частоты.
+
+    Для dependencies=... в декораторе маршрута: они выполняются до
+    параметров обработчика, то есть до открытия сессии БД.
+    """
+    return [Depends(shed_load(policy)), Depends(rate_limit(policy, identity))]
@@ -0,0 +1,185 @@
+import time
+from typing import Dict, List, Optional
+
+from config import LIVE_STATS_RECONCILE_INTERVAL, LIVE_STATS_TTL
+from .cache import live_stats_key
+
+# Сколько секунд сверка ждёт завершения начатого сброса буфера
+FLUSH_LEASE = 60
+
+# Хэш live:{short_link}:
+#   pending   - переходы, которые ещё лежат в буферах воркеров (ClickBuffer)
+#   num       - счётчик links.num, как он есть в БД
+#   v         - номер версии num, растёт при каждом сбросе буфера
+#   inflight  - сколько сбросов буфера с переходами этой ссылки сейчас идёт
+#   inflight_until - до какого времени (unix time) ждать их завершения
+#   synced_at - когда num последний раз сверялся с БД
+#   last_used - время последнего перехода (unix time)
+# Актуальное число переходов = num + pending.
+
+# Переход: pending + 1, last_used не уменьшается, TTL продлевается
+RECORD_SCRIPT = """
+redis.call('HINCRBY', KEYS[1], 'pending', 1)
+local last = tonumber(redis.call('HGET', KEYS[1], 'last_used') or '0')
+if tonumber(ARGV[1]) > last then
+    redis.call('HSET', KEYS[1], 'last_used', ARGV[1])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+"""
+
+# Перед транзакцией сброса буфера: пока она не завершилась и переходы не
+# перенесены из pending в num, сверка с БД не записывается - links.num уже
+# может включать переходы, которые ещё лежат в pending. Если воркер упал
+# посреди сброса, отметка перестаёт действовать после inflight_until
+BEGIN_FLUSH_SCRIPT = """
+local deadline = tonumber(ARGV[1])
+for i, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('HINCRBY', key, 'inflight', 1)
+        if deadline > tonumber(redis.call('HGET', key, 'inflight_until') or '0') then
+            redis.call('HSET', key, 'inflight_until', ARGV[1])
+        end
+    end
+end
+"""
+
+# Сброс не удался: снимаем отметку, pending и num не меняются
+ABORT_FLUSH_SCRIPT = """
+for i, key in ipairs(KEYS) do
+    if tonumber(redis.call('HGET', key, 'inflight') or '0') > 0 then
+        redis.call('HINCRBY', key, 'inflight', -1)
+    end
+end
+"""
+
+# Сброс буфера в БД: переходы переезжают из pending в num, сумма не меняется.
+# pending не уходит в минус, если хэш терялся, пока переходы были в буфере
+FLUSH_SCRIPT = """
+for i, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        local n = tonumber(ARGV[i])
+        local pending = tonumber(redis.call('HGET', key, 'pending') or '0')
+        redis.call('HSET', key, 'pending', math.max(pending - n, 0))
+        if redis.call('HEXISTS', key, 'num') == 1 then
+            redis.call('HINCRBY', key, 'num', n)
+        end
+        redis.call('HINCRBY', key, 'v', 1)
+        if tonumber(redis.call('HGET', key, 'inflight') or '0') > 0 then
+            redis.call('HINCRBY', key, 'inflight', -1)
+        end
+    end
+end
+"""
+
+# Сверка с БД: num записывается, только если с момента чтения версии
+# не было сброса буфера (иначе прочитанное из БД значение уже устарело)
+# и сейчас ни один сброс не идёт (иначе в БД могут быть переходы из pending)
+RECONCILE_SCRIPT = """
+if (redis.call('HGET', KEYS[1], 'v') or '0') ~= ARGV[1] then
+    return 0
+end
+if tonumber(redis.call('HGET', KEYS[1], 'inflight') or '0') > 0
+        and tonumber(redis.call('HGET', KEYS[1], 'inflight_until') or '0') > tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'num', ARGV[2], 'synced_at', ARGV[3])
+local last = tonumber(redis.call('HGET', KEYS[1], 'last_used') or '0')
+if tonumber(ARGV[4]) > last then
+    redis.call('HSET', KEYS[1], 'last_used', ARGV[4])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return 1
+"""
+
+
+class LiveClickCounters:
+    """Счётчики переходов по ссылкам в Redis для статистики в реальном времени.
+
+    Редирект увеличивает pending, сброс ClickBuffer переносит переходы из
+    pending в num. num берётся из БД при первом чтении и затем сверяется
+    с БД не реже раза в LIVE_STATS_RECONCILE_INTERVAL секунд, поэтому
+    содержимое Redis можно потерять: оно восстановится из Postgres.
+    Без клиента Redis все методы ничего не делают.
+    """
+
+    def __init__(self, ttl: int = LIVE_STATS_TTL, reconcile_interval: float = LIVE_STATS_RECONCILE_INTERVAL):
+        self.ttl = ttl
+        self.reconcile_interval = reconcile_interval
+        self.redis = None
+
+    def init(self, redis) -> None:
+        self.redis = redis
+        if redis is not None:
+            self._record = redis.register_script(RECORD_SCRIPT)
+            self._begin_flush = redis.register_script(BEGIN_FLUSH_SCRIPT)
+            self._abort_flush = redis.register_script(ABORT_FLUSH_SCRIPT)
+            self._flush = redis.register_script(FLUSH_SCRIPT)
+            self._reconcile = redis.register_script(RECONCILE_SCRIPT)
+
+    @property
+    def enabled(self) -> bool:
+        return self.redis is not None
+
+    async def record(self, short_link: str, clicked_at: Optional[float] = None) -> None:
+        if self.redis is None:
+            return
+        try:
+            await self._record(keys=[live_stats_key(short_link)], args=[clicked_at or time.time(), self.ttl])
+        except Exception as e:
+            print(f"Не удалось учесть переход в live-статистике {short_link}: {e}")
+
+    async def begin_flush(self, short_links: List[str]) -> None:
+        # До транзакции сброса буфера в БД (см. BEGIN_FLUSH_SCRIPT)
+        if self.redis is None or not short_links:
+            return
+        await self._begin_flush(
+            keys=[live_stats_key(short_link) for short_link in short_links],
+            args=[time.time() + FLUSH_LEASE]
+        )
+
+    async def abort_flush(self, short_links: List[str]) -> None:
+        if self.redis is None or not short_links:
+            return
+        await self._abort_flush(keys=[live_stats_key(short_link) for short_link in short_links])
+
+    async def apply_flush(self, counts: Dict[str, int]) -> None:
+        if self.redis is None or not counts:
+            return
+        keys = [live_stats_key(short_link) for short_link in counts]
+        await self._flush(keys=keys, args=list(counts.values()))
+
+    async def read(self, short_link: str) -> Optional[dict]:
+        """Текущее состояние счётчика; None, если Redis недоступен."""
+        if self.redis is None:
+            return None
+        try:
+            num, pending, v, synced_at, last_used = await self.redis.hmget(
+                live_stats_key(short_link), "num", "pending", "v", "synced_at", "last_used"
+            )
+        except Exception as e:
+            print(f"Не удалось прочитать live-статистику {short_link}: {e}")
+            return None
+        return {
+            "num": int(num) if num is not None else None,
+            "pending": int(pending or 0),
+            "v": v.decode() if isinstance(v, bytes) else (v or "0"),
+            "synced_at": float(synced_at) if synced_at is not None else None,
+            "last_used": float(last_used) if last_used is not None else None,
+        }
+
+    def needs_reconcile(self, state: dict) -> bool:
+        return state["num"] is None or state["synced_at"] is None or \
+            time.time() - state["synced_at"] >= self.reconcile_interval
+
+    async def reconcile(self, short_link: str, version: str, num: int, last_used: float) -> bool:
+        try:
+            return bool(await self._reconcile(
+                keys=[live_stats_key(short_link)],
+                args=[version, num, time.time(), last_used, self.ttl]
+            ))
+        except Exception as e:
+            print(f"Не удалось сверить live-статистику {short_link}: {e}")
+            return False
+
+
+live_clicks = LiveClickCounters()
@@ -1,4 +1,4 @@
-from sqlalchemy import Table, Column, Integer, MetaData, String,Boolean,DateTime
+from sqlalchemy import Table, Column, Integer, BigInteger, MetaData, String,Boolean,DateTime, Date, Index, LargeBinary, Sequence, DDL, event, text
 
 from sqlalchemy.dialects.postgresql import UUID
 metadata = MetaData()
@@ -8,6 +8,10 @@ links = Table(
     metadata,
     Column("id", Integer, primary_key=True),
     Column("long_link", String),
+    # SHA-256 канонической записи long_link, первые 16 байт (см. links/urls.py)
+    Column("long_link_digest", LargeBinary, nullable=False),
+    # Хост long_link в нижнем регистре, без порта (для поиска по домену)
+    Column("host", String),
     Column("short_link", String),
     Column("auth", Boolean),
     Column("user_id", UUID(as_uuid=True)),  # изменили тип на UUID
@@ -15,4 +19,105 @@ links = Table(
     Column("last_date", DateTime(timezone=True)),
     Column("num", Integer),
     Column("expires_at", DateTime(timezone=True))
-)
\ No newline at end of file
+)
+
+# Индексы под запросы роутера: редирект/статистика/удаление по short_link,
+# проверки владельца по (user_id, short_link) и выборка истёкших ссылок.
+Index("ix_links_short_link", links.c.short_link, unique=True)
+Index("ix_links_user_id_short_link", links.c.user_id, links.c.short_link)
+# Одна и та же длинная ссылка не может быть сокращена дважды одним владельцем
+# (анонимные ссылки считаются одним владельцем). В индексе дайджест, а не URL:
+# размер записи фиксирован при любой длине ссылки. Дайджест первым, чтобы
+# тот же индекс обслуживал поиск по ссылке без владельца (/links/search).
+Index(
+    "ux_links_long_link_digest_user_id",
+    links.c.long_link_digest,
+    links.c.user_id,
+    unique=True,
+    postgresql_nulls_not_distinct=True
+)
+# Список своих ссылок (/links/mine) с keyset-пагинацией по id. id страницы
+# выбираются index-only scan: колонки фильтров (срок действия, дата создания)
+# в INCLUDE. Из таблицы читаются только строки страницы - long_link в индекс не
+# помещается (запись B-tree ограничена ~2.7 КБ). Индекса с num нет намеренно:
+# сброс счётчиков переходов переписывает num, и с таким индексом эти
+# обновления перестали бы быть HOT. Сортировка по переходам читает все ссылки
+# пользователя по этому индексу.
+Index(
+    "ix_links_user_id_id",
+    links.c.user_id,
+    links.c.id,
+    postgresql_include=["start_date", "expires_at"]
+)
+# Поиск по домену с keyset-пагинацией по id: ровно limit строк из индекса
+Index("ix_links_host_id", links.c.host, links.c.id)
+Index(
+    "ix_links_expires_at",
+    links.c.expires_at,
+    postgresql_where=links.c.expires_at.isnot(None)
+)
+
+
+def trigram_available(ddl, target, bind, **kw) -> bool:
+    # pg_trgm входит в contrib, но не во всякую сборку Postgres. Без него
+    # триграммный индекс не создаётся, поиск по подстроке работает без индекса
+    if bind is None:
+        return True
+    return bind.execute(text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).first() is not None
+
+
+event.listen(
+    metadata, "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(callable_=trigram_available)
+)
+# Поиск по подстроке long_link (ILIKE '%...%') по триграммам
+Index(
+    "ix_links_long_link_trgm",
+    links.c.long_link,
+    postgresql_using="gin",
+    postgresql_ops={"long_link": "gin_trgm_ops"}
+).ddl_if(callable_=trigram_available)
+
+# Последовательность номеров блоков для генератора коротких кодов:
+# каждый воркер забирает номер блока и сам раздаёт идентификаторы из него
+short_code_block_seq = Sequence("links_short_code_block_seq", metadata=metadata)
+
+# История переходов: только дописывается пачками через COPY (см. links/click_events.py).
+# Внешнего ключа на links нет, чтобы удаление ссылок не трогало историю.
+link_clicks = Table(
+    "link_clicks",
+    metadata,
+    Column("id", BigInteger, primary_key=True),
+    Column("link_id", Integer, nullable=False),
+    Column("clicked_at", DateTime(timezone=True), nullable=False),
+    Column("referrer", String),
+    Column("user_agent", String),
+    Column("ip_prefix", String)  # сеть /24 для IPv4 и /48 для IPv6, без полного адреса
+)
+# Строки идут по времени, BRIN почти ничего не стоит на вставке
+Index("ix_link_clicks_clicked_at", link_clicks.c.clicked_at, postgresql_using="brin")
+
+# Агрегаты переходов по часам и по дням (UTC), обновляются при каждом сбросе событий
+link_clicks_hourly = Table(
+    "link_clicks_hourly",
+    metadata,
+    Column("link_id", Integer, primary_key=True),
+    Column("bucket", DateTime(timezone=True), primary_key=True),
+    Column("clicks", BigInteger, nullable=False)
+)
+link_clicks_daily = Table(
+    "link_clicks_daily",
+    metadata,
+    Column("link_id", Integer, primary_key=True),
+    Column("bucket", Date, primary_key=True),
+    Column("clicks", BigInteger, nullable=False)
+)
+
+
+def owner_condition(user_id):
+    return links.c.user_id == user_id if user_id is not None else links.c.user_id.is_(None)
+
+
+def owner_link_condition(digest: bytes, user_id):
+    # Условие по ux_links_long_link_digest_user_id
+    return (links.c.long_link_digest == digest) & owner_condition(user_id)
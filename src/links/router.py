@@ -1,75 +1,82 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.responses import RedirectResponse
-from sqlalchemy import select, insert, update, delete
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import RedirectResponse, StreamingResponse
+from sqlalchemy import select, update, delete, exists, or_, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timezone
-import hashlib
-from typing import Optional, List
-from database import get_async_session
-from .models import links
+import base64
+import json
+import time
+from typing import Literal, Optional, List
+from database import async_session_maker, get_async_session
+from config import (
+    BATCH_MAX_ITEMS, LINK_CACHE_MISS_TTL, SEARCH_CACHE_TTL, EXPIRED_PAGE_MAX, EXPIRED_PAGE_SIZE, EXPIRED_STREAM_BATCH,
+    LINK_FIND_MIN_CONTAINS, LINK_FIND_PAGE_MAX, LINK_FIND_PAGE_SIZE, MY_LINKS_PAGE_MAX, MY_LINKS_PAGE_SIZE,
+)
+from metrics import record_cache
+from .models import links, link_clicks_daily, link_clicks_hourly, owner_link_condition
 from .schemas import LinkResponse, LinkCreateRequest, LinkStats, LinkNewCreateRequest
 from auth.users import current_active_user
 from auth.db import User
 from auth.users import fastapi_users
-from fastapi_cache.decorator import cache
-from fastapi_cache import FastAPICache
-from tasks.tasks import delete_expired_link
+from .clicks import click_buffer
+from .click_events import click_events
+from .live_stats import live_clicks
+from .shortcodes import SHORT_CODE_MAX_ATTEMPTS, short_code_allocator
+from .urls import link_host, long_link_digest, redirect_url
+from .batch import parse_batch_body, shorten_batch
+from .limits import (
+    REDIRECT_POLICY, SHORTEN_POLICY, check_rate_limit, client_identity, request_guards, shed_load,
+)
+from .cache import (
+    CoalescingCache,
+    invalidate_link_cache,
+    link_cache_key,
+    link_l1,
+    link_record_ttl,
+    link_search_key,
+    link_stats_key,
+    stats_ttl,
+)
 
 router = APIRouter(
     prefix="/links",
     tags=["links"]
 )
 
-def generate_short_link(long_link: str) -> str:
-    return hashlib.md5(long_link.encode()).hexdigest()[:8]
-
 optional_current_user = fastapi_users.current_user(optional=True)
 
-@router.post("/shorten", response_model=LinkResponse)
+# Кэши с защитой от одновременного промаха (см. CoalescingCache). Запись
+# о ссылке и статистика не хранятся дольше срока действия ссылки
+link_records = CoalescingCache("link_redis", ttl=link_record_ttl, deadline=lambda record: record["expires_at"])
+stats_cache = CoalescingCache(
+    "stats",
+    ttl=lambda stats: LINK_CACHE_MISS_TTL if stats is None else stats_ttl(stats["expires_at"], live=live_clicks.enabled),
+    deadline=lambda stats: None if stats is None else stats["expires_at"],
+)
+search_cache = CoalescingCache("search", ttl=lambda short_link: SEARCH_CACHE_TTL)
+
+
+async def user_identity(request: Request, current_user: Optional[User] = Depends(optional_current_user)) -> str:
+    # Лимиты создания ссылок - на пользователя, для анонимов - на IP
+    return f"user:{current_user.id}" if current_user else client_identity(request)
+
+def duplicate_link_query(digest: bytes, user_id):
+    # Есть ли у владельца ссылка на тот же адрес (по ux_links_long_link_digest_user_id)
+    return select(exists().where(owner_link_condition(digest, user_id)))
+
+@router.post("/shorten", response_model=LinkResponse, dependencies=request_guards(SHORTEN_POLICY, user_identity))
 async def shorten_link(
     link_req: LinkCreateRequest,
     session: AsyncSession = Depends(get_async_session),
     current_user: Optional[User] = Depends(optional_current_user)
 ):
-    if current_user:
-        stmt = select(links).where(
-            (links.c.long_link == link_req.long_link) &
-            (links.c.user_id == current_user.id)
-        )
-    else:
-        stmt = select(links).where(links.c.long_link == link_req.long_link)
-
-    result = await session.execute(stmt)
-    existing_link = result.scalar_one_or_none()
-    if existing_link:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Ссылка уже существует."
-        )
-
-    if link_req.custom_alias:
-        stmt = select(links).where(links.c.short_link == link_req.custom_alias)
-        result = await session.execute(stmt)
-        existing = result.scalar_one_or_none()
-        if existing:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Custom alias уже используется. Пожалуйста, выберите другой."
-            )
-        short_link = link_req.custom_alias
-    else:
-        short_link = generate_short_link(link_req.long_link)
-        stmt = select(links).where(links.c.short_link == short_link)
-        result = await session.execute(stmt)
-        if result.scalar_one_or_none():
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Ошибка генерации уникального alias. Попробуйте снова."
-            )
-
     link_data = {
         "long_link": link_req.long_link,
-        "short_link": short_link,
+        "long_link_digest": long_link_digest(link_req.long_link),
+        "host": link_host(link_req.long_link),
+        "short_link": link_req.custom_alias,
         "auth": bool(current_user),
         "user_id": current_user.id if current_user else None,
         "start_date": datetime.now(timezone.utc),
@@ -81,99 +88,274 @@ async def shorten_link(
         )
     }
 
-    statement = insert(links).values(**link_data).returning(links.c.id)
-    result = await session.execute(statement)
+    # Один INSERT ... ON CONFLICT DO NOTHING RETURNING *: дубль ссылки и занятый
+    # alias ловят уникальные индексы. Сгенерированный код может совпасть
+    # с чьим-то custom alias - тогда просто берём следующий код.
+    for _ in range(SHORT_CODE_MAX_ATTEMPTS):
+        if not link_req.custom_alias:
+            link_data["short_link"] = await short_code_allocator.allocate(session)
+        result = await session.execute(
+            pg_insert(links).values(**link_data).on_conflict_do_nothing().returning(links)
+        )
+        new_link = result.mappings().first()
+        if new_link is not None:
+            break
+        # Вставка не прошла - выясняем, какой из индексов сработал
+        duplicate = await session.scalar(duplicate_link_query(link_data["long_link_digest"], link_data["user_id"]))
+        if duplicate:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Ссылка уже существует."
+            )
+        if link_req.custom_alias:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Custom alias уже используется. Пожалуйста, выберите другой."
+            )
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Ошибка генерации уникального alias. Попробуйте снова."
+        )
     await session.commit()
 
-    new_id = result.scalar_one()
+    # Код и поиск по адресу могли быть закэшированы как несуществующие
+    await invalidate_link_cache(new_link["short_link"], new_link["long_link"])
+
+    # Истёкшие ссылки удаляет периодическая задача sweep_expired_links
 
-    if link_req.expires_at:
-        delete_expired_link.apply_async(
-            args=[new_id],
-            eta=link_req.expires_at,
-            queue='celery'
+    return dict(new_link)
+
+@router.post("/shorten/batch", dependencies=[Depends(shed_load(SHORTEN_POLICY))])
+async def shorten_links_batch(
+    request: Request,
+    identity: str = Depends(user_identity),
+    current_user: Optional[User] = Depends(optional_current_user)
+):
+    # Тело - JSON-массив LinkCreateRequest или NDJSON (application/x-ndjson).
+    # Ответ - NDJSON с результатом по каждому элементу в порядке запроса.
+    try:
+        items = parse_batch_body(await request.body(), request.headers.get("content-type", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Не больше {BATCH_MAX_ITEMS} ссылок за запрос."
         )
+    # Пакет списывает из той же корзины, что и /shorten, по токену на ссылку
+    await check_rate_limit(SHORTEN_POLICY, identity, len(items))
+    return StreamingResponse(
+        shorten_batch(items, current_user.id if current_user else None),
+        media_type="application/x-ndjson"
+    )
 
-    stmt = select(links).where(links.c.id == new_id)
-    query_result = await session.execute(stmt)
-    new_link = query_result.fetchone()
-    return new_link
+# Компактная запись о ссылке для редиректа. Кэшируется и отсутствие ссылки
+# (active=False), поэтому при создании ссылки ключ нужно сбрасывать.
+def link_record(row) -> dict:
+    # row - строка с колонками id, long_link, expires_at
+    return {
+        "id": row.id,
+        "long_link": row.long_link,
+        "expires_at": row.expires_at.timestamp() if row.expires_at else None,
+        "active": True
+    }
+
+def link_record_query(short_link: str):
+    return select(
+        links.c.id,
+        links.c.long_link,
+        links.c.expires_at
+    ).where(links.c.short_link == short_link)
 
-def short_link_key_builder(function, *args, **kwargs) -> str:
-    short_link = args[0]  
-    return f"long_link:{short_link}"
+async def load_link_record(short_link: str, session: AsyncSession) -> dict:
+    result = await session.execute(link_record_query(short_link))
+    row = result.first()
+    if row is None:
+        return {"id": None, "long_link": None, "expires_at": None, "active": False}
+    return link_record(row)
 
-@cache(expire=60, key_builder=short_link_key_builder)
-async def get_cached_long_link(short_link: str, session: AsyncSession) -> str:
-    stmt = select(links.c.long_link).where(links.c.short_link == short_link)
-    result = await session.execute(stmt)
-    long_link = result.scalar()
-    if not long_link:
-        raise HTTPException(status_code=404, detail="Ссылка не найдена")
-    return long_link
+def link_record_loader(short_link: str):
+    return lambda session: load_link_record(short_link, session)
 
-@router.get("/")
+async def get_link_record(short_link: str, session: AsyncSession) -> dict:
+    # Сначала локальный кэш воркера, затем Redis и только потом БД.
+    # TTL записи считается от expires_at: в момент истечения она пропадает из кэша
+    key = link_cache_key(short_link)
+    record, result = link_l1.lookup(key)
+    record_cache("link_l1", result)
+    if record is not None:
+        return record
+    record = await link_records.get(key, link_record_loader(short_link), session)
+    link_l1.set(key, record, link_record_ttl(record))
+    return record
+
+def link_record_error(record: dict) -> Optional[str]:
+    # Почему по записи нельзя сделать редирект (текст ответа 404); None, если можно
+    if not record["active"]:
+        return "Ссылка не найдена"
+    if record["expires_at"] is not None and record["expires_at"] < time.time():
+        return "Ссылка истекла"
+    return None
+
+async def count_click(short_link: str, record: dict, referrer: Optional[str],
+                      user_agent: Optional[str], host: Optional[str]) -> None:
+    # Переход учитываем в live-счётчике Redis до буфера: сброс буфера переносит
+    # из pending в num только то, что там уже учтено
+    await live_clicks.record(short_link)
+    # В БД переход попадёт при очередном сбросе буфера
+    click_buffer.record(short_link)
+    # Событие для истории переходов пишется фоновой задачей пачками
+    click_events.record(record["id"], referrer=referrer, user_agent=user_agent, host=host)
+
+@router.get("/", dependencies=request_guards(REDIRECT_POLICY))
 async def get_long_link(
     short_link: str,
+    request: Request,
     session: AsyncSession = Depends(get_async_session)
 ):
-    try:
-        long_link = await get_cached_long_link(short_link, session)
-    except HTTPException as e:
-        raise e
-    stmt = select(links.c.expires_at).where(links.c.short_link == short_link)
-    result = await session.execute(stmt)
-    expires_at = result.scalar()
-    if expires_at and expires_at < datetime.now(timezone.utc):
-        raise HTTPException(status_code=404, detail="Ссылка истекла")
-    await session.execute(
-        update(links)
-        .where(links.c.short_link == short_link)
-        .values(num=links.c.num + 1, last_date=datetime.now(timezone.utc))
+    # При попадании в кэш решение принимается только по записи, без запросов в БД.
+    # Попадания в кэш обычно отдаёт links/fastpath.py, не доходя до этого маршрута
+    record = await get_link_record(short_link, session)
+    error = link_record_error(record)
+    if error is not None:
+        raise HTTPException(status_code=404, detail=error)
+    await count_click(
+        short_link, record,
+        referrer=request.headers.get("referer"),
+        user_agent=request.headers.get("user-agent"),
+        host=request.client.host if request.client else None
     )
-    await session.commit()
-    if not long_link.startswith(("http://", "https://")):
-        long_link = "http://" + long_link
-
-    return RedirectResponse(url=long_link)
+    return RedirectResponse(url=redirect_url(record["long_link"]))
 
 @router.get("/{short_code}/stats", response_model=LinkStats)
-@cache(expire=60)
 async def get_link_stats(
     short_code: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    granularity: Literal["hour", "day"] = "day",
     session: AsyncSession = Depends(get_async_session)
 ):
-    stmt = select(
+    # Постоянная часть статистики кэшируется надолго, счётчики берутся из Redis.
+    # Значение из кэша может быть общим с другими запросами - меняем копию
+    stats = await stats_cache.get(link_stats_key(short_code), lambda s: load_link_stats(short_code, s), session)
+    if stats is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Ссылка не найдена"
+        )
+    stats = dict(stats)
+
+    state = await live_clicks.read(short_code)
+    if state is None:
+        # Без Redis: счётчик из БД плюс переходы в буфере этого воркера
+        stats["clicks_count"] += click_buffer.pending(short_code)
+    else:
+        if live_clicks.needs_reconcile(state):
+            state = await reconcile_live_stats(session, short_code, state)
+        stats["clicks_count"] = state["num"] + state["pending"]
+        if state["last_used"] is not None:
+            last_used = datetime.fromtimestamp(state["last_used"], timezone.utc)
+            if last_used > datetime.fromisoformat(stats["last_used"]):
+                stats["last_used"] = last_used
+    if start is not None or end is not None:
+        stats["timeline"] = await get_click_timeline(session, short_code, start, end, granularity)
+    return stats
+
+def link_stats_query(short_code: str):
+    return select(
         links.c.long_link,
         links.c.start_date,
         links.c.num,
-        links.c.last_date
+        links.c.last_date,
+        links.c.expires_at
     ).where(links.c.short_link == short_code)
 
-    result = await session.execute(stmt)
+async def load_link_stats(short_code: str, session: AsyncSession) -> Optional[dict]:
+    # Отсутствие ссылки кэшируется как None; при создании ссылки ключ сбрасывается
+    result = await session.execute(link_stats_query(short_code))
     row = result.fetchone()
     if not row:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Ссылка не найдена"
-        )
-
-    return LinkStats(
+        return None
+    stats = LinkStats(
         long_link=row.long_link,
         created_at=row.start_date,
         clicks_count=row.num,
         last_used=row.last_date
+    ).model_dump(mode="json")
+    # Для TTL записи; в ответ не попадает (response_model=LinkStats)
+    stats["expires_at"] = row.expires_at.timestamp() if row.expires_at else None
+    return stats
+
+async def reconcile_live_stats(session: AsyncSession, short_code: str, state: dict, attempts: int = 3) -> dict:
+    # Сверяем live-счётчик с links.num. Если между чтением версии и записью
+    # буфер успел сброситься, значение из БД устарело - читаем заново
+    for _ in range(attempts):
+        result = await session.execute(
+            select(links.c.num, links.c.last_date).where(links.c.short_link == short_code)
+        )
+        row = result.first()
+        if row is None:
+            break
+        if await live_clicks.reconcile(short_code, state["v"], row.num, row.last_date.timestamp()):
+            return await live_clicks.read(short_code) or state
+        state = await live_clicks.read(short_code) or state
+    # Сверить не удалось: отдаём то, что есть, без записи в Redis
+    if state["num"] is None:
+        state = dict(state, num=row.num if row is not None else 0)
+    return state
+
+async def get_click_timeline(session: AsyncSession, short_code: str, start: Optional[datetime],
+                             end: Optional[datetime], granularity: str) -> List[dict]:
+    # Переходы из агрегатов по периодам от содержащего start до содержащего end,
+    # сырые события не читаются. События из очереди ещё не учтены
+    table = link_clicks_hourly if granularity == "hour" else link_clicks_daily
+    stmt = (
+        select(table.c.bucket, table.c.clicks)
+        .join(links, links.c.id == table.c.link_id)
+        .where(links.c.short_link == short_code)
+        .order_by(table.c.bucket)
     )
+    if start is not None:
+        stmt = stmt.where(table.c.bucket >= click_bucket(start, granularity))
+    if end is not None:
+        stmt = stmt.where(table.c.bucket <= click_bucket(end, granularity))
+    result = await session.execute(stmt)
+    timeline = []
+    for row in result:
+        period_start = row.bucket
+        if granularity == "day":
+            period_start = datetime.combine(period_start, datetime.min.time(), tzinfo=timezone.utc)
+        timeline.append({"period_start": period_start, "clicks": row.clicks})
+    return timeline
+
+def click_bucket(moment: datetime, granularity: str):
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    moment = moment.astimezone(timezone.utc)
+    if granularity == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.date()
+
+def search_query(long_link: str):
+    # Поиск по дайджесту канонической записи: индекс фиксированного размера
+    # при любой длине ссылки, http://Example.com и http://example.com/ - одно и то же
+    return select(links.c.short_link).where(links.c.long_link_digest == long_link_digest(long_link)).limit(1)
+
+async def load_search_result(long_link: str, session: AsyncSession) -> Optional[str]:
+    result = await session.execute(search_query(long_link))
+    return result.scalar()
 
 @router.get("/search")
-@cache(expire=30)
 async def search_short_link(
     long_link: str,
     session: AsyncSession = Depends(get_async_session)
 ):
-    stmt = select(links.c.short_link).where(links.c.long_link == long_link)
-    result = await session.execute(stmt)
-    short_link = result.scalar()
+    # Результат, в том числе «не найдено», кэшируется на SEARCH_CACHE_TTL секунд;
+    # создание, изменение и удаление ссылки сбрасывают запись по её адресу
+    short_link = await search_cache.get(
+        link_search_key(long_link), lambda s: load_search_result(long_link, s), session
+    )
     if not short_link:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -181,34 +363,167 @@ async def search_short_link(
         )
     return short_link
 
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def find_links_query(contains: Optional[str], host: Optional[str], user_id, after_id: int):
+    # Домен - равенство по ix_links_host_id, подстрока - ILIKE по триграммному
+    # индексу ix_links_long_link_trgm. Keyset-пагинация по id, как у /expired
+    stmt = select(links).where(links.c.id > after_id)
+    if host is not None:
+        stmt = stmt.where(links.c.host == host)
+    if contains is not None:
+        stmt = stmt.where(links.c.long_link.ilike(f"%{escape_like(contains)}%", escape="\\"))
+    if user_id is not None:
+        stmt = stmt.where(links.c.user_id == user_id)
+    return stmt.order_by(links.c.id)
+
+@router.get("/find", response_model=List[LinkResponse])
+async def find_links(
+    response: Response,
+    contains: Optional[str] = Query(None, min_length=LINK_FIND_MIN_CONTAINS),
+    domain: Optional[str] = None,
+    mine: bool = False,
+    after_id: int = Query(0, ge=0),
+    limit: int = Query(LINK_FIND_PAGE_SIZE, ge=1, le=LINK_FIND_PAGE_MAX),
+    session: AsyncSession = Depends(get_async_session),
+    current_user: Optional[User] = Depends(optional_current_user)
+):
+    # Ссылки, содержащие подстроку contains и/или ведущие на хост domain
+    # (точное совпадение, поддомены - отдельным запросом); mine=true - только свои
+    if contains is None and domain is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Нужен хотя бы один из параметров contains, domain."
+        )
+    if mine and current_user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
+    host = None
+    if domain is not None:
+        host = link_host(domain)
+        if host is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Некорректный домен.")
+    stmt = find_links_query(contains, host, current_user.id if mine else None, after_id).limit(limit)
+    found = (await session.execute(stmt)).mappings().all()
+    if len(found) == limit:
+        response.headers["X-Next-After-Id"] = str(found[-1]["id"])
+    return found
+
+def encode_cursor(row, sort: str) -> str:
+    position = {"num": row["num"], "id": row["id"]} if sort == "clicks" else {"id": row["id"]}
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+def decode_cursor(cursor: str, sort: str) -> dict:
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        keys = ("num", "id") if sort == "clicks" else ("id",)
+        if not isinstance(position, dict) or not all(isinstance(position.get(key), int) for key in keys):
+            raise ValueError
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Некорректный cursor.")
+    return position
+
+def user_links_query(user_id, now: datetime, limit: int, state: str = "all",
+                     created_after: Optional[datetime] = None, sort: str = "id", position: Optional[dict] = None):
+    # sort=id: страница выбирается index-only scan по ix_links_user_id_id,
+    # фильтры проверяются по INCLUDE-колонкам, keyset-условие - по ключу индекса.
+    # Из таблицы читаются только limit строк страницы (long_link в индексе нет).
+    # sort=clicks: индекса по num нет (см. links/models.py), ссылки пользователя
+    # читаются по тому же индексу, и из них top-N сортировкой берётся страница
+    page = select(links.c.id).where(links.c.user_id == user_id)
+    if state == "active":
+        page = page.where(or_(links.c.expires_at.is_(None), links.c.expires_at > now))
+    elif state == "expired":
+        page = page.where(links.c.expires_at <= now)
+    if created_after is not None:
+        page = page.where(links.c.start_date > created_after)
+    if sort == "clicks":
+        order = (links.c.num.desc(), links.c.id.desc())
+        if position is not None:
+            page = page.where(tuple_(links.c.num, links.c.id) < tuple_(position["num"], position["id"]))
+    else:
+        order = (links.c.id,)
+        if position is not None:
+            page = page.where(links.c.id > position["id"])
+    page = page.order_by(*order).limit(limit).subquery()
+    return select(links).join(page, links.c.id == page.c.id).order_by(*order)
+
+@router.get("/mine", response_model=List[LinkResponse])
+async def get_my_links(
+    response: Response,
+    state: Literal["all", "active", "expired"] = "all",
+    created_after: Optional[datetime] = None,
+    sort: Literal["id", "clicks"] = "id",
+    cursor: Optional[str] = None,
+    limit: int = Query(MY_LINKS_PAGE_SIZE, ge=1, le=MY_LINKS_PAGE_MAX),
+    session: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(current_active_user)
+):
+    # Ссылки текущего пользователя. Следующая страница - по cursor из заголовка
+    # X-Next-Cursor (он есть, если страница заполнена целиком)
+    position = decode_cursor(cursor, sort) if cursor else None
+    if created_after is not None and created_after.tzinfo is None:
+        created_after = created_after.replace(tzinfo=timezone.utc)
+    stmt = user_links_query(current_user.id, datetime.now(timezone.utc), limit, state, created_after, sort, position)
+    page = (await session.execute(stmt)).mappings().all()
+    if len(page) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(page[-1], sort)
+    return page
+
+def delete_link_query(short_code: str, user_id):
+    # Проверка владельца - часть условия DELETE, отдельный SELECT не нужен
+    return (
+        delete(links)
+        .where(
+            (links.c.short_link == short_code) &
+            (links.c.user_id == user_id)
+        )
+        .returning(links.c.id, links.c.long_link)
+    )
+
 @router.delete("/{short_code}")
 async def delete_link(
     short_code: str,
     session: AsyncSession = Depends(get_async_session),
     current_user: User = Depends(current_active_user)
 ):
-    stmt = select(links).where(
-        (links.c.short_link == short_code) &
-        (links.c.user_id == current_user.id)
-    )
-    result = await session.execute(stmt)
-    link_record = result.scalar_one_or_none()
-    if not link_record:
+    result = await session.execute(delete_link_query(short_code, current_user.id))
+    deleted_link = result.first()
+    if deleted_link is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Ссылка не найдена или доступ запрещён."
         )
-
-    delete_stmt = delete(links).where(links.c.short_link == short_code)
-    await session.execute(delete_stmt)
     await session.commit()
 
-    cache_key = f"long_link:{short_code}"
-    backend = FastAPICache.get_backend()
-    await backend.clear(cache_key)
+    await invalidate_link_cache(short_code, deleted_link.long_link, deleted=True)
 
     return {"detail": "Ссылка успешно удалена."}
 
+def update_link_query(short_code: str, user_id, new_long_link: str, now: datetime):
+    # Владелец проверяется в самом запросе. Прежний адрес берём из той же
+    # строки (RETURNING видит только новые значения): по нему сбрасывается кэш поиска
+    old = (
+        select(links.c.id, links.c.long_link)
+        .where(
+            (links.c.short_link == short_code) &
+            (links.c.user_id == user_id)
+        )
+        .with_for_update()
+        .subquery("old")
+    )
+    return (
+        update(links)
+        .where(links.c.id == old.c.id)
+        .values(
+            long_link=new_long_link,
+            long_link_digest=long_link_digest(new_long_link),
+            host=link_host(new_long_link),
+            last_date=now
+        )
+        .returning(links, old.c.long_link.label("old_long_link"))
+    )
+
 @router.put("/{short_code}", response_model=LinkResponse)
 async def update_link(
     short_code: str,
@@ -216,51 +531,69 @@ async def update_link(
     session: AsyncSession = Depends(get_async_session),
     current_user: User = Depends(current_active_user)
 ):
-    stmt = select(links).where(
-        (links.c.short_link == short_code) &
-        (links.c.user_id == current_user.id)
+    update_stmt = update_link_query(
+        short_code, current_user.id, link_update.new_long_link, datetime.now(timezone.utc)
     )
-    result = await session.execute(stmt)
-    link_record = result.scalar_one_or_none()
-    if not link_record:
+    try:
+        result = await session.execute(update_stmt)
+    except IntegrityError:
+        # У пользователя уже есть ссылка на этот адрес
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Ссылка уже существует."
+        )
+    updated_link = result.mappings().first()
+    if updated_link is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Ссылка не найдена или доступ запрещён."
         )
-
-    update_stmt = (
-        update(links)
-        .where(links.c.short_link == short_code)
-        .values(
-            long_link=link_update.new_long_link,
-            last_date=datetime.now(timezone.utc)
-        )
-        .returning(links)
-    )
-    result = await session.execute(update_stmt)
     await session.commit()
 
-    updated_link = result.mappings().all()
-    if updated_link:
-        updated_link = dict(updated_link[0])
+    # Инвалидируем кэш по short_code и поиск по прежнему и новому адресу
+    await invalidate_link_cache(short_code, updated_link["old_long_link"], updated_link["long_link"])
 
-    # Инвалидируем кэш по short_code
-    cache_key = f"long_link:{short_code}"
-    backend = FastAPICache.get_backend()
-    await backend.clear(cache_key)
+    return dict(updated_link)
+
+def expired_links_query(now: datetime, after_id: int):
+    # Keyset-пагинация по id: страница не зависит от того, сколько строк перед ней
+    return (
+        select(links)
+        .where(
+            links.c.expires_at != None,
+            links.c.expires_at < now,
+            links.c.id > after_id
+        )
+        .order_by(links.c.id)
+    )
 
-    return updated_link
+async def stream_expired_links(now: datetime, after_id: int):
+    # Сессия своя: зависимость get_async_session закрывается до начала стриминга.
+    # Строки читаются серверным курсором порциями, память не растёт с их числом
+    async with async_session_maker() as session:
+        stmt = expired_links_query(now, after_id).execution_options(yield_per=EXPIRED_STREAM_BATCH)
+        result = await session.stream(stmt)
+        async for rows in result.mappings().partitions():
+            yield "".join(LinkResponse.model_validate(row).model_dump_json() + "\n" for row in rows)
 
 @router.get("/expired", response_model=List[LinkResponse])
-@cache(expire=60)
 async def get_expired_links(
+    request: Request,
+    response: Response,
+    after_id: int = Query(0, ge=0),
+    limit: int = Query(EXPIRED_PAGE_SIZE, ge=1, le=EXPIRED_PAGE_MAX),
     session: AsyncSession = Depends(get_async_session)
 ):
     now = datetime.now(timezone.utc)
-    stmt = select(links).where(
-        links.c.expires_at != None,
-        links.c.expires_at < now
-    )
-    result = await session.execute(stmt)
+    # С Accept: application/x-ndjson отдаём все истёкшие ссылки после after_id потоком
+    if "application/x-ndjson" in request.headers.get("accept", ""):
+        return StreamingResponse(
+            stream_expired_links(now, after_id),
+            media_type="application/x-ndjson"
+        )
+    result = await session.execute(expired_links_query(now, after_id).limit(limit))
     expired_links = result.mappings().all()
+    # Курсор следующей страницы, если эта заполнена целиком
+    if len(expired_links) == limit:
+        response.headers["X-Next-After-Id"] = str(expired_links[-1]["id"])
     return expired_links
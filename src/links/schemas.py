@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
 from uuid import UUID
 
@@ -24,8 +24,15 @@ class LinkResponse(BaseModel):
     expires_at: Optional[datetime]
 
 
+class ClickBucket(BaseModel):
+    period_start: datetime
+    clicks: int
+
+
 class LinkStats(BaseModel):
     long_link: str
     created_at: datetime
     clicks_count: int
-    last_used: datetime
\ No newline at end of file
+    last_used: datetime
+    # Переходы по часам или дням, если в запросе задан интервал
+    timeline: Optional[List[ClickBucket]] = None
\ No newline at end of file
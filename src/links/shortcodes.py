@@ -0,0 +1,133 @@
+import asyncio
+from math import gcd
+from typing import List
+
+from config import (
+    SHORT_CODE_ALLOCATOR,
+    SHORT_CODE_ALPHABET,
+    SHORT_CODE_BLOCK_SIZE,
+    SHORT_CODE_LENGTH,
+)
+from database import engine
+from .models import short_code_block_seq
+
+# Множитель перестановки: соседние идентификаторы дают непохожие коды
+PERMUTATION_MULTIPLIER = 0x5DEECE66D
+PERMUTATION_OFFSET = 0xB
+# Сколько раз пробуем вставить ссылку с новым сгенерированным кодом, если он
+# совпал с чьим-то custom alias
+SHORT_CODE_MAX_ATTEMPTS = 5
+
+
+class ShortCodeCodec:
+    """Взаимно однозначно переводит номер в код фиксированной длины.
+
+    Номер сначала переставляется аффинным преобразованием по модулю
+    len(alphabet) ** length, затем записывается в системе счисления алфавита.
+    Разные номера всегда дают разные коды, поэтому проверять код в БД
+    перед вставкой не нужно. Смена длины или алфавита меняет отображение,
+    и новые коды могут совпасть со старыми.
+    """
+
+    def __init__(self, alphabet: str = SHORT_CODE_ALPHABET, length: int = SHORT_CODE_LENGTH):
+        if len(set(alphabet)) != len(alphabet) or len(alphabet) < 2:
+            raise ValueError("Алфавит должен состоять минимум из двух различных символов")
+        self.alphabet = alphabet
+        self.length = length
+        self.capacity = len(alphabet) ** length
+        multiplier = PERMUTATION_MULTIPLIER % self.capacity
+        while gcd(multiplier, self.capacity) != 1:
+            multiplier += 1
+        self.multiplier = multiplier
+
+    def encode(self, number: int) -> str:
+        if not 0 <= number < self.capacity:
+            raise ValueError("Пространство коротких кодов исчерпано")
+        value = (number * self.multiplier + PERMUTATION_OFFSET) % self.capacity
+        base = len(self.alphabet)
+        chars = []
+        for _ in range(self.length):
+            value, rem = divmod(value, base)
+            chars.append(self.alphabet[rem])
+        return "".join(reversed(chars))
+
+
+class SequenceBlockSource:
+    """Номера блоков из последовательности Postgres.
+
+    Если передана сессия запроса, nextval выполняется через её соединение:
+    так запрос не занимает второе соединение из пула. Откат транзакции
+    nextval не отменяет, поэтому блок не выдаётся повторно.
+    """
+
+    async def next_block(self, session=None) -> int:
+        if session is not None:
+            return await session.scalar(short_code_block_seq.next_value())
+        async with engine.connect() as conn:
+            return await conn.scalar(short_code_block_seq.next_value())
+
+
+class RedisBlockSource:
+    """Номера блоков из счётчика Redis (INCR).
+
+    Нумерация блоков общая с последовательностью Postgres: при переходе
+    с "sequence" на "redis" ключ нужно заранее выставить не ниже текущего
+    значения links_short_code_block_seq.
+    """
+
+    def __init__(self, redis, key: str = "links:short_code_block"):
+        self.redis = redis
+        self.key = key
+
+    async def next_block(self, session=None) -> int:
+        return await self.redis.incr(self.key)
+
+
+class ShortCodeAllocator:
+    """Раздаёт уникальные короткие коды без чтения из БД.
+
+    Воркер арендует блок из block_size номеров у источника (последовательность
+    Postgres или Redis) и выдаёт номера из него локально. Обращение к
+    источнику нужно один раз на block_size кодов.
+    """
+
+    def __init__(self, source, codec: ShortCodeCodec = None, block_size: int = SHORT_CODE_BLOCK_SIZE):
+        self.source = source
+        self.codec = codec or ShortCodeCodec()
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._lock = asyncio.Lock()
+
+    async def _lease(self, session=None) -> None:
+        block = await self.source.next_block(session)
+        self._next = block * self.block_size
+        self._end = self._next + self.block_size
+
+    async def allocate(self, session=None) -> str:
+        if self._next >= self._end:
+            async with self._lock:
+                if self._next >= self._end:
+                    await self._lease(session)
+        number = self._next
+        self._next += 1
+        return self.codec.encode(number)
+
+    async def allocate_many(self, count: int, session=None) -> List[str]:
+        return [await self.allocate(session) for _ in range(count)]
+
+
+def configure_allocator(redis=None, kind: str = SHORT_CODE_ALLOCATOR) -> None:
+    if kind == "redis":
+        if redis is None:
+            raise ValueError("Для SHORT_CODE_ALLOCATOR=redis нужен клиент Redis")
+        short_code_allocator.source = RedisBlockSource(redis)
+    elif kind == "sequence":
+        short_code_allocator.source = SequenceBlockSource()
+    else:
+        raise ValueError(f"Неизвестный SHORT_CODE_ALLOCATOR: {kind}")
+    # Блок, арендованный у прежнего источника, больше не используем
+    short_code_allocator._next = short_code_allocator._end = 0
+
+
+short_code_allocator = ShortCodeAllocator(SequenceBlockSource())
@@ -0,0 +1,68 @@
+import hashlib
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit
+
+# Длина дайджеста длинной ссылки в байтах (первые байты SHA-256)
+DIGEST_SIZE = 16
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str) -> str:
+    """Каноническая запись URL для сравнения ссылок.
+
+    Схема и хост приводятся к нижнему регистру, порт по умолчанию
+    отбрасывается, пустой путь заменяется на "/". Путь, параметры и
+    фрагмент не трогаем: от них может зависеть, куда ведёт ссылка.
+    Уже каноническая запись не меняется.
+    """
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    if not parts.scheme or not parts.netloc:
+        return url
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if ":" in host:
+        host = f"[{host}]"
+    netloc = host
+    if port is not None and DEFAULT_PORTS.get(scheme) != port:
+        netloc = f"{host}:{port}"
+    userinfo, _, _ = parts.netloc.rpartition("@")
+    if userinfo:
+        netloc = f"{userinfo}@{netloc}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, parts.fragment))
+
+
+def long_link_digest(url: str) -> bytes:
+    # Фиксированные 16 байт на строку вместо самого URL в индексе.
+    # В SQL то же для канонической записи: substring(sha256(convert_to(url, 'UTF8')) from 1 for 16)
+    return hashlib.sha256(normalize_url(url).encode()).digest()[:DIGEST_SIZE]
+
+
+def link_host(url: str) -> Optional[str]:
+    """Хост ссылки в нижнем регистре без порта; None, если хоста нет.
+
+    Ссылка без схемы разбирается как http://..., так же как при редиректе.
+    """
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        if not parts.netloc:
+            parts = urlsplit("http://" + url)
+        host = parts.hostname
+    except ValueError:
+        return None
+    if not host or any(char.isspace() for char in host):
+        return None
+    return host
+
+
+def redirect_url(long_link: str) -> str:
+    # Ссылка без схемы открывается по http://
+    if not long_link.startswith(("http://", "https://")):
+        return "http://" + long_link
+    return long_link
@@ -0,0 +1,158 @@
+import asyncio
+import json
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.redis import RedisBackend
+from sqlalchemy import or_, select
+
+from config import CACHE_WARMUP_BATCH_SIZE, CACHE_WARMUP_BUDGET, CACHE_WARMUP_LINKS, CACHE_WARMUP_RECENT_DAYS
+from database import engine
+from metrics import CACHE_WARMUP_DURATION, CACHE_WARMUP_PROGRESS, CACHE_WARMUP_RECORDS
+from .cache import RELEASE_LOCK_SCRIPT, cache_get, cache_set, generation_key, link_cache_key
+from .models import links
+from .router import link_record, link_records
+
+# Прогревает один воркер, остальные ждут, пока блокировка не исчезнет
+WARMUP_LOCK_KEY = "cache-warmup:lock"
+
+# SET NX, если ключ не инвалидировали: поколение появляется при первой
+# инвалидации, и строка, прочитанная до неё, могла устареть
+WARM_IF_UNCHANGED_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return 0
+end
+if redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2], 'NX') then
+    return 1
+end
+return 0
+"""
+
+
+def warmup_query(limit: int, recent_days: float, now: datetime):
+    # Полный проход по таблице с top-N сортировкой: индексов с num в схеме
+    # нет намеренно (см. links/models.py), а запрос выполняется раз при старте воркера
+    stmt = (
+        select(links.c.id, links.c.short_link, links.c.long_link, links.c.expires_at)
+        .where(or_(links.c.expires_at.is_(None), links.c.expires_at > now))
+        .order_by(links.c.num.desc(), links.c.last_date.desc())
+        .limit(limit)
+    )
+    if recent_days > 0:
+        stmt = stmt.where(links.c.last_date >= now - timedelta(days=recent_days))
+    return stmt
+
+
+async def write_batch(rows: List) -> Tuple[int, int]:
+    """Кладёт записи о ссылках в кэш; (записано, пропущено)."""
+    entries = []
+    for row in rows:
+        entry, expire = link_records.entry(link_record(row))
+        if int(expire) > 0:
+            entries.append((link_cache_key(row.short_link), entry, int(expire)))
+    skipped = len(rows) - len(entries)
+    backend = FastAPICache.get_backend()
+    if isinstance(backend, RedisBackend):
+        # Одна порция - один конвейер. NX: то, что уже положили запросы, не старше прогрева;
+        # ключи, инвалидированные после чтения порции, не перезаписываются старой строкой
+        pipe = backend.redis.pipeline(transaction=False)
+        for key, entry, expire in entries:
+            pipe.eval(WARM_IF_UNCHANGED_SCRIPT, 2, key, generation_key(key), json.dumps(entry), expire)
+        written = sum(1 for result in await pipe.execute() if result)
+        return written, skipped + len(entries) - written
+    # Без Redis кэш у воркера свой, а прогрев идёт до приёма запросов - инвалидировать нечему
+    written = 0
+    for key, entry, expire in entries:
+        if await cache_get(key) is None:
+            await cache_set(key, entry, expire)
+            written += 1
+    return written, skipped + len(entries) - written
+
+
+async def _lock(redis, budget: float) -> Optional[str]:
+    # Токен блокировки; "" без Redis, None - прогревает другой воркер
+    if redis is None:
+        return ""
+    token = uuid.uuid4().hex
+    try:
+        acquired = await redis.set(WARMUP_LOCK_KEY, token, nx=True, px=int(budget * 1000))
+    except Exception as e:
+        print(f"Не удалось взять блокировку прогрева кэша: {e}")
+        return ""
+    return token if acquired else None
+
+
+async def _unlock(redis, token: str) -> None:
+    if not token:
+        return
+    try:
+        await redis.eval(RELEASE_LOCK_SCRIPT, 1, WARMUP_LOCK_KEY, token)
+    except Exception as e:
+        print(f"Не удалось снять блокировку прогрева кэша: {e}")
+
+
+async def _wait_for_other(redis, budget: float, poll: float = 0.1) -> None:
+    deadline = time.monotonic() + budget
+    while time.monotonic() < deadline:
+        try:
+            if not await redis.exists(WARMUP_LOCK_KEY):
+                return
+        except Exception:
+            return
+        await asyncio.sleep(poll)
+
+
+async def _warm(bind, limit: int, recent_days: float, batch_size: int, progress: dict) -> None:
+    stmt = warmup_query(limit, recent_days, datetime.now(timezone.utc))
+    async with bind.connect() as conn:
+        # Серверный курсор: в памяти не больше одной порции строк
+        result = await conn.stream(stmt.execution_options(yield_per=batch_size))
+        async for rows in result.partitions(batch_size):
+            written, skipped = await write_batch(rows)
+            CACHE_WARMUP_RECORDS.labels("written").inc(written)
+            CACHE_WARMUP_RECORDS.labels("skipped").inc(skipped)
+            progress["written"] += written
+            progress["processed"] += len(rows)
+            CACHE_WARMUP_PROGRESS.set(progress["processed"] / limit)
+
+
+async def warm_link_cache(redis, limit: int = CACHE_WARMUP_LINKS, budget: float = CACHE_WARMUP_BUDGET,
+                          recent_days: float = CACHE_WARMUP_RECENT_DAYS,
+                          batch_size: int = CACHE_WARMUP_BATCH_SIZE, bind=engine) -> dict:
+    """Загружает в кэш записи о самых популярных ссылках до того, как воркер начнёт принимать запросы.
+
+    Берутся limit ссылок с наибольшим числом переходов среди использованных
+    за последние recent_days дней, порциями по batch_size: строки читаются
+    из серверного курсора, каждая порция пишется одним конвейером Redis.
+    Прогрев прерывается через budget секунд - старт воркера не задерживается
+    дольше. С Redis прогревает один воркер, остальные ждут его не дольше
+    budget. Ошибки прогрева не мешают старту.
+    """
+    progress = {"processed": 0, "written": 0}
+    if limit <= 0:
+        return progress
+    started = time.perf_counter()
+    CACHE_WARMUP_PROGRESS.set(0)
+    token = await _lock(redis, budget)
+    if token is None:
+        await _wait_for_other(redis, budget)
+        CACHE_WARMUP_PROGRESS.set(1)
+        return progress
+    try:
+        await asyncio.wait_for(_warm(bind, limit, recent_days, batch_size, progress), budget)
+        CACHE_WARMUP_PROGRESS.set(1)
+    except asyncio.TimeoutError:
+        print(f"Прогрев кэша прерван через {budget} с")
+    except Exception as e:
+        print(f"Ошибка прогрева кэша: {e}")
+    finally:
+        await _unlock(redis, token)
+        CACHE_WARMUP_DURATION.set(time.perf_counter() - started)
+    print(
+        f"Прогрев кэша: {progress['processed']} ссылок, записано {progress['written']}, "
+        f"{time.perf_counter() - started:.2f} с"
+    )
+    return progress
@@ -1,4 +1,5 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi.responses import JSONResponse
 from collections.abc import AsyncIterator
 from auth.users import auth_backend, current_active_user, fastapi_users
 from auth.schemas import UserCreate, UserRead
@@ -10,17 +11,83 @@ from links.router import router as link_router
 from redis import asyncio as aioredis
 from fastapi_cache import FastAPICache
 from fastapi_cache.backends.redis import RedisBackend
-from contextlib import asynccontextmanager
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from contextlib import asynccontextmanager, suppress
+import asyncio
+
+from links.clicks import click_buffer, run_click_flusher
+from links.click_events import click_events, run_click_event_flusher
+from links.cache import init_link_cache, run_invalidation_listener
+from auth.principals import init_principal_cache
+from auth.passwords import PasswordHashBusy, password_hasher
+from links.shortcodes import configure_allocator
+from links.live_stats import live_clicks
+from links.limits import load_shedder, rate_limiter
+from links.fastpath import RedirectFastPath
+from links.warmup import warm_link_cache
+from config import REDIRECT_FAST_PATH, REDIS_URL
+from database import engine
+from metrics import PrometheusMiddleware, instrument_engine, metrics_endpoint
 
 @asynccontextmanager
 async def lifespan(_: FastAPI) -> AsyncIterator[None]:
-    redis = aioredis.from_url("redis://redis:6379/0")
-    FastAPICache.init(RedisBackend(redis), prefix="fastapi-cache")
+    if REDIS_URL == "memory://":
+        # Без Redis (бенчмарки, локальный запуск): кэш в памяти процесса,
+        # live-счётчики и рассылка инвалидаций отключены
+        redis = None
+        FastAPICache.init(InMemoryBackend(), prefix="fastapi-cache")
+    else:
+        redis = aioredis.from_url(REDIS_URL)
+        FastAPICache.init(RedisBackend(redis), prefix="fastapi-cache")
+    init_link_cache(redis)
+    init_principal_cache(redis)
+    live_clicks.init(redis)
+    configure_allocator(redis)
+    rate_limiter.init(redis)
+    # Популярные ссылки - в кэш до начала приёма запросов (не дольше CACHE_WARMUP_BUDGET)
+    await warm_link_cache(redis)
+    # Фоновый сброс накопленных переходов в БД и замер задержки цикла событий
+    background = [
+        asyncio.create_task(run_click_flusher(click_buffer)),
+        asyncio.create_task(run_click_event_flusher(click_events)),
+        asyncio.create_task(load_shedder.run_lag_monitor()),
+    ]
+    # Подписка на инвалидации локальных кэшей (ссылки, токены) от других воркеров
+    if redis is not None:
+        background.append(asyncio.create_task(run_invalidation_listener(redis)))
     yield
+    for task in background:
+        task.cancel()
+    for task in background:
+        with suppress(asyncio.CancelledError):
+            await task
+    # При штатной остановке воркера дописываем всё, что осталось в буфере
+    await click_buffer.flush()
+    await click_events.flush()
+    password_hasher.shutdown()
 
 
 app = FastAPI(lifespan=lifespan)
 
+# Метрики Prometheus: задержки по маршрутам, попадания в кэш, время SQL-запросов
+app.add_middleware(PrometheusMiddleware, fastapi_app=app)
+instrument_engine(engine.sync_engine, "async")
+app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+# Попадания в кэш редиректа отдаются до всей обработки FastAPI (и до
+# PrometheusMiddleware: добавленный последним middleware - внешний)
+if REDIRECT_FAST_PATH:
+    app.add_middleware(RedirectFastPath)
+
+
+@app.exception_handler(PasswordHashBusy)
+async def password_hash_busy_handler(request: Request, exc: PasswordHashBusy) -> JSONResponse:
+    # Волна логинов: отказываем сразу, а не копим очередь к пулу хэширования
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Сервис аутентификации перегружен, повторите позже."},
+        headers={"Retry-After": "1"},
+    )
+
 
 # Добавление маршрутов аутентификации с использованием fastapi_users
 # Роутер для аутентификации с использованием JWT токенов.
@@ -36,3 +103,4 @@ app.include_router(
 )
 #Добавили роутер для создания ссылок
 app.include_router(link_router)
+
@@ -0,0 +1,246 @@
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+from starlette.responses import Response
+from starlette.routing import Match
+
+# Метрики Prometheus. При нескольких процессах (воркеры gunicorn, prefork
+# Celery) каждый пишет значения в файлы в PROMETHEUS_MULTIPROC_DIR, а при
+# выгрузке они суммируются по всем процессам. Каталог должен быть задан
+# до импорта prometheus_client и очищаться при старте (см. docker/*.sh).
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Время обработки HTTP-запроса",
+    ["method", "route", "status"],
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "HTTP-запросы в обработке",
+    ["method", "route"],
+    multiprocess_mode="livesum",
+)
+CACHE_REQUESTS = Counter(
+    "cache_requests_total",
+    "Обращения к кэшам: hit, miss, stale (запись найдена, но устарела) или "
+    "coalesced (промах, ожидание загрузки, начатой другим запросом)",
+    ["cache", "result"],
+)
+CACHE_REFRESHES = Counter(
+    "cache_refreshes_total",
+    "Фоновые обновления записей кэша: early (заранее, до истечения) или stale (после истечения)",
+    ["cache", "reason"],
+)
+DB_STATEMENT_LATENCY = Histogram(
+    "db_statement_duration_seconds",
+    "Время выполнения SQL-запроса",
+    ["engine", "operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+# Пулы соединений с БД (см. PoolStats в database.py). Размер, переполнение и
+# ожидающие суммируются по процессам: видно, хватает ли пулов всех воркеров
+DB_POOL_CAPACITY = Gauge(
+    "db_pool_size_connections",
+    "Постоянные соединения пула (pool_size)",
+    ["engine"],
+    multiprocess_mode="livesum",
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out_connections",
+    "Соединения, выданные из пула",
+    ["engine"],
+    multiprocess_mode="livesum",
+)
+DB_POOL_OVERFLOW = Gauge(
+    "db_pool_overflow_connections",
+    "Соединения, открытые сверх pool_size",
+    ["engine"],
+    multiprocess_mode="livesum",
+)
+DB_POOL_WAITING = Gauge(
+    "db_pool_waiting_requests",
+    "Запросы, ждущие соединение из пула",
+    ["engine"],
+    multiprocess_mode="livesum",
+)
+DB_POOL_WAIT = Histogram(
+    "db_pool_wait_seconds",
+    "Время ожидания соединения из пула (включая неудачные попытки)",
+    ["engine"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+DB_POOL_TIMEOUTS = Counter(
+    "db_pool_timeouts_total",
+    "Таймауты ожидания соединения при исчерпании пула",
+    ["engine"],
+)
+DB_POOL_CONNECTIONS = Counter(
+    "db_pool_connection_events_total",
+    "Оборот соединений пула: connect, close или invalidate (соединение признано негодным)",
+    ["engine", "event"],
+)
+CELERY_TASKS = Counter(
+    "celery_tasks_total",
+    "Завершённые задачи Celery",
+    ["task", "result"],
+)
+CELERY_TASK_LAG = Histogram(
+    "celery_task_lag_seconds",
+    "Насколько позже назначенного времени запущена задача Celery",
+    ["task"],
+    buckets=(0.1, 0.5, 1, 5, 15, 30, 60, 120, 300, 900, 3600),
+)
+EXPIRED_LINK_DELETE_LAG = Histogram(
+    "expired_link_delete_lag_seconds",
+    "Сколько истёкшая ссылка пролежала в БД до удаления",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 900, 3600, 21600, 86400),
+)
+LINK_DELETE_BATCH_DURATION = Histogram(
+    "link_delete_batch_duration_seconds",
+    "Время удаления порции ссылок: DELETE в БД (db) и сброс кэша в Redis (cache)",
+    ["task", "stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+PASSWORD_HASH_PENDING = Gauge(
+    "password_hash_pending",
+    "Операции хэширования паролей в очереди и в работе",
+    multiprocess_mode="livesum",
+)
+PASSWORD_HASH_REJECTED = Counter(
+    "password_hash_rejected_total",
+    "Операции хэширования паролей, отклонённые из-за переполнения очереди",
+)
+CACHE_WARMUP_RECORDS = Counter(
+    "cache_warmup_records_total",
+    "Записи о ссылках, загруженные прогревом кэша: written или skipped (ключ уже был в кэше)",
+    ["result"],
+)
+CACHE_WARMUP_PROGRESS = Gauge(
+    "cache_warmup_progress_ratio",
+    "Доля ссылок, обработанных прогревом кэша при старте воркера (1 - прогрев завершён)",
+    multiprocess_mode="livemax",
+)
+CACHE_WARMUP_DURATION = Gauge(
+    "cache_warmup_duration_seconds",
+    "Длительность последнего прогрева кэша",
+    multiprocess_mode="livemax",
+)
+RATE_LIMITED = Counter(
+    "rate_limited_requests_total",
+    "Запросы, отклонённые ограничением частоты (429)",
+    ["policy"],
+)
+REQUESTS_SHED = Counter(
+    "shed_requests_total",
+    "Запросы, отклонённые при перегрузке воркера (503): loop_lag или pool_wait",
+    ["policy", "reason"],
+)
+EVENT_LOOP_LAG = Gauge(
+    "event_loop_lag_seconds",
+    "Последняя измеренная задержка цикла событий воркера",
+    multiprocess_mode="livemax",
+)
+
+SQL_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "COPY"}
+
+
+def record_cache(cache: str, result: str) -> None:
+    CACHE_REQUESTS.labels(cache, result).inc()
+
+
+def instrument_engine(engine, name: str) -> None:
+    """Замер времени SQL-запросов (синхронный движок или engine.sync_engine
+    асинхронного). Метрики пула пишет PoolStats в database.py."""
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_started = time.perf_counter()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_metrics_started", None)
+        if started is None:
+            return
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        if operation not in SQL_OPERATIONS:
+            operation = "OTHER"
+        DB_STATEMENT_LATENCY.labels(name, operation).observe(time.perf_counter() - started)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+def route_template(app, scope) -> str:
+    # Шаблон пути ("/links/{short_code}/stats"), а не сам путь: иначе
+    # у метрик будет по серии на каждую ссылку
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", "unmatched")
+    return "unmatched"
+
+
+class PrometheusMiddleware:
+    """ASGI middleware: задержка и число запросов в обработке по маршрутам.
+
+    Обращения к кэшам считает record_cache там, где кэш читается
+    (links/cache.py), с меткой имени кэша, а не маршрута.
+    """
+
+    def __init__(self, app, fastapi_app=None):
+        self.app = app
+        self.fastapi_app = fastapi_app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        route = route_template(self.fastapi_app, scope)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        in_progress = REQUESTS_IN_PROGRESS.labels(method, route)
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_progress.dec()
+            REQUEST_LATENCY.labels(method, route, str(status["code"])).observe(time.perf_counter() - started)
+
+
+def metrics_registry():
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    from prometheus_client import REGISTRY
+    return REGISTRY
+
+
+async def metrics_endpoint(request) -> Response:
+    return Response(generate_latest(metrics_registry()), media_type=CONTENT_TYPE_LATEST)
+
+
+def start_metrics_server(port: int) -> None:
+    # Отдельный HTTP-сервер метрик для процессов без FastAPI (воркер Celery)
+    from prometheus_client import start_http_server
+    start_http_server(port, registry=metrics_registry())
+
+
+def mark_process_dead(pid: int) -> None:
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
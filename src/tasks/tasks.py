@@ -1,24 +1,189 @@
-from sqlalchemy import delete
-from sqlalchemy.orm import sessionmaker
-from datetime import datetime
-from database import sync_engine 
-from links.models import links  
+
+from sqlalchemy import delete, func, select, text
+from datetime import datetime, timezone
+import time
+from database import sync_engine
+from links.models import links
+from links.cache import INVALIDATION_CHANNEL, link_cache_keys, link_search_key, queue_invalidation
+from config import (
+    REDIS_URL, EXPIRY_SWEEP_INTERVAL, EXPIRY_SWEEP_BATCH_SIZE, EXPIRY_SWEEP_MAX_BATCHES, CELERY_METRICS_PORT,
+    DELETE_STATEMENT_TIMEOUT
+)
+from metrics import (
+    CELERY_TASK_LAG, CELERY_TASKS, EXPIRED_LINK_DELETE_LAG, LINK_DELETE_BATCH_DURATION,
+    instrument_engine, mark_process_dead, start_metrics_server
+)
 from celery import Celery
+from celery.signals import (
+    task_failure, task_prerun, task_success, worker_init, worker_process_init, worker_process_shutdown
+)
+import os
+import redis
 
 celery_app = Celery('tasks', broker="redis://redis:6379/0")
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=sync_engine)
+instrument_engine(sync_engine, "sync")
 
-@celery_app.task() 
-def delete_expired_link(link_id: int):
-    session = SessionLocal()
+
+# Метрики воркера: свой HTTP-сервер, значения процессов prefork суммируются
+@worker_init.connect
+def start_worker_metrics(**_):
+    start_metrics_server(CELERY_METRICS_PORT)
+
+
+@worker_process_init.connect
+def reset_inherited_pool(**_):
+    # Дочерний процесс prefork получил копию пула родителя: соединения
+    # не закрываем (они принадлежат родителю), а открываем свои. Дальше
+    # задачи процесса берут соединения из его пула, а не открывают новые
+    sync_engine.dispose(close=False)
+
+
+@worker_process_shutdown.connect
+def forget_worker_process(**_):
+    mark_process_dead(os.getpid())
+
+
+@task_prerun.connect
+def observe_task_lag(task=None, **_):
+    # Только для задач с ETA: насколько позже назначенного они стартовали
+    eta = task.request.eta if task is not None else None
+    if eta:
+        eta = datetime.fromisoformat(eta) if isinstance(eta, str) else eta
+        now = datetime.now(eta.tzinfo) if eta.tzinfo else datetime.utcnow()
+        CELERY_TASK_LAG.labels(task.name).observe(max((now - eta).total_seconds(), 0))
+
+
+@task_success.connect
+def count_task_success(sender=None, **_):
+    CELERY_TASKS.labels(sender.name, "success").inc()
+
+
+@task_failure.connect
+def count_task_failure(sender=None, **_):
+    CELERY_TASKS.labels(sender.name, "failure").inc()
+
+def build_delete_statement(link_ids: list):
+    return (
+        delete(links)
+        .where(links.c.id.in_(link_ids))
+        .returning(links.c.short_link, links.c.long_link, links.c.expires_at)
+    )
+
+
+def build_sweep_statement(batch_size: int):
+    # Порция самых давно истёкших ссылок по индексу ix_links_expires_at.
+    # SKIP LOCKED не даёт двум запускам ждать друг друга на одних строках
+    due = (
+        select(links.c.id)
+        .where(links.c.expires_at != None, links.c.expires_at < func.now())
+        .order_by(links.c.expires_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    return (
+        delete(links)
+        .where(links.c.id.in_(due.scalar_subquery()))
+        .returning(links.c.short_link, links.c.long_link, links.c.expires_at)
+    )
+
+
+_redis_client = None
+
+
+def purge_link_cache(short_links: list, long_links: list = ()):
+    # Удаляем записи из Redis-кэша (и поиск по адресам long_links) и сообщаем
+    # воркерам API сбросить их L1
+    global _redis_client
+    if not short_links:
+        return
     try:
-        stmt = delete(links).where(links.c.id == link_id)
-        session.execute(stmt)
-        session.commit()
-        print(f"Ссылка с id {link_id} удалена в {datetime.utcnow()}")
+        if _redis_client is None:
+            _redis_client = redis.Redis.from_url(REDIS_URL)
+        pipe = _redis_client.pipeline(transaction=False)
+        queue_invalidation(
+            pipe, link_cache_keys(short_links, deleted=True) + [link_search_key(long_link) for long_link in long_links]
+        )
+        for short_link in short_links:
+            pipe.publish(INVALIDATION_CHANNEL, short_link)
+        pipe.execute()
     except Exception as e:
-        session.rollback()
-        print(f"Ошибка удаления ссылки с id {link_id}: {e}")
-        raise e
-    finally:
-        session.close()
\ No newline at end of file
+        print(f"Не удалось сбросить кэш удалённых ссылок {short_links[:5]}: {e}")
+
+
+def delete_batch(task_name: str, stmt) -> list:
+    """Удаляет порцию ссылок одним DELETE ... RETURNING и сбрасывает их кэш.
+
+    Соединение берётся из пула процесса и возвращается после коммита.
+    statement_timeout ограничивает время одного DELETE: медленный запрос
+    падает с ошибкой, а не занимает воркер. Время запроса к БД и сброса
+    кэша пишется в метрику и в лог.
+    """
+    started = time.perf_counter()
+    try:
+        with sync_engine.begin() as conn:
+            conn.execute(text(f"SET LOCAL statement_timeout = {int(DELETE_STATEMENT_TIMEOUT * 1000)}"))
+            deleted = conn.execute(stmt).all()
+    except Exception as e:
+        print(f"Ошибка удаления ссылок ({task_name}): {e}")
+        raise
+    db_seconds = time.perf_counter() - started
+
+    short_links = [row.short_link for row in deleted]
+    started = time.perf_counter()
+    purge_link_cache(short_links, [row.long_link for row in deleted])
+    cache_seconds = time.perf_counter() - started
+
+    LINK_DELETE_BATCH_DURATION.labels(task_name, "db").observe(db_seconds)
+    LINK_DELETE_BATCH_DURATION.labels(task_name, "cache").observe(cache_seconds)
+    if deleted:
+        print(
+            f"{task_name}: удалено {len(deleted)} ссылок, "
+            f"БД {db_seconds * 1000:.1f} мс, кэш {cache_seconds * 1000:.1f} мс"
+        )
+    return deleted
+
+
+# Удаление ссылок по списку id: порциями по batch_size, каждая - один DELETE
+# и один конвейер Redis, а не задача и транзакция на каждую ссылку
+@celery_app.task()
+def delete_links(link_ids: list, batch_size: int = EXPIRY_SWEEP_BATCH_SIZE):
+    total = 0
+    for start in range(0, len(link_ids), batch_size):
+        batch = link_ids[start:start + batch_size]
+        total += len(delete_batch("delete_links", build_delete_statement(batch)))
+    return total
+
+
+# Старая схема: задача с ETA на каждую ссылку. Новые задачи не ставятся,
+# оставлено, чтобы воркер доработал уже поставленные в очередь
+@celery_app.task()
+def delete_expired_link(link_id: int):
+    return delete_links([link_id])
+
+
+# Периодическая задача: удаляет истёкшие ссылки порциями. Очередь брокера и
+# память воркера не зависят от того, сколько ссылок имеют срок действия
+@celery_app.task()
+def sweep_expired_links(batch_size: int = EXPIRY_SWEEP_BATCH_SIZE, max_batches: int = EXPIRY_SWEEP_MAX_BATCHES):
+    total = 0
+    for _ in range(max_batches):
+        deleted = delete_batch("sweep_expired_links", build_sweep_statement(batch_size))
+        now = datetime.now(timezone.utc)
+        for row in deleted:
+            EXPIRED_LINK_DELETE_LAG.observe((now - row.expires_at).total_seconds())
+        total += len(deleted)
+        if len(deleted) < batch_size:
+            break
+    if total:
+        print(f"Удалено истёкших ссылок: {total} в {datetime.utcnow()}")
+    return total
+
+
+celery_app.conf.beat_schedule = {
+    "sweep-expired-links": {
+        "task": sweep_expired_links.name,
+        "schedule": EXPIRY_SWEEP_INTERVAL,
+        # Запуск, не взятый воркером до следующего, не нужен
+        "options": {"expires": EXPIRY_SWEEP_INTERVAL},
+    },
+}
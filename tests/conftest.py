@@ -8,6 +8,8 @@ os.environ.setdefault("DB_NAME", "test_db")
 os.environ.setdefault("DB_HOST", "localhost")
 os.environ.setdefault("DB_PORT", "5432")
 os.environ.setdefault("CELERY_BROKER_URL", "memory://")  # in-memory брокер для Celery
+os.environ.setdefault("CLICK_FLUSH_INTERVAL", "3600")  # буфер переходов сбрасываем вручную
+os.environ.setdefault("CLICK_EVENTS_FLUSH_INTERVAL", "3600")  # и очередь событий переходов тоже
 
 from fastapi_cache import FastAPICache
 from fastapi_cache.backends.inmemory import InMemoryBackend
@@ -42,12 +44,21 @@ def clean_tables_and_cache():
         loop.run_until_complete(backend.clear())  # Очищаем ВСЁ
         loop.close()
 
+    # 3) Чистим локальный кэш воркера (модуль приложения, PYTHONPATH=src)
+    from links.cache import link_l1
+    link_l1.clear()
+
     yield
 
 @pytest.fixture(scope="session")
 def client():
-    with TestClient(app) as test_client:
-        yield test_client
+    # Фикстура patch_redis срабатывает уже после старта приложения, поэтому
+    # подменяем клиент Redis здесь: без него приложение работает на InMemoryBackend
+    from unittest.mock import patch
+    import redis.asyncio as aioredis
+    with patch.object(aioredis, "from_url", lambda *args, **kwargs: None):
+        with TestClient(app) as test_client:
+            yield test_client
 
 
 @pytest.fixture(autouse=True)
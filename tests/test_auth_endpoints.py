@@ -23,3 +23,55 @@ def test_login_with_valid_and_invalid_credentials(client):
     if resp2.status_code == 400:
         detail = resp2.json().get("detail")
         assert detail == "LOGIN_BAD_CREDENTIALS"
+
+
+def _login(client, email):
+    client.post("/auth/register", json={"email": email, "password": "pass"})
+    token = client.post("/auth/jwt/login", data={"username": email, "password": "pass"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_repeated_requests_skip_user_query(client):
+    from sqlalchemy import event
+    from database import engine
+    from auth.principals import principal_cache
+
+    principal_cache.clear()
+    headers = _login(client, "principal@example.com")
+    user_selects = []
+
+    def count_user_selects(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and '"user"' in statement:
+            user_selects.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", count_user_selects)
+    try:
+        for i in range(3):
+            resp = client.post("/links/shorten", json={"long_link": f"https://principal.example/{i}"}, headers=headers)
+            assert resp.status_code == 200
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", count_user_selects)
+    assert len(user_selects) == 1, "Пользователь читается из БД только при первом запросе с токеном"
+
+
+def test_deactivated_user_token_is_dropped_from_cache(client):
+    from fastapi_users.db import SQLAlchemyUserDatabase
+    from fastapi_users.schemas import BaseUserUpdate
+    from auth.db import User
+    from auth.users import UserManager
+    from database import async_session_maker
+
+    headers = _login(client, "deactivated@example.com")
+    short_link = client.post("/links/shorten", json={"long_link": "https://deactivated.example/1"}, headers=headers).json()["short_link"]
+    # Токен попадает в кэш
+    assert client.delete("/links/unknown-code", headers=headers).status_code == 404
+
+    async def deactivate():
+        async with async_session_maker() as session:
+            manager = UserManager(SQLAlchemyUserDatabase(session, User))
+            user = await manager.get_by_email("deactivated@example.com")
+            await manager.update(BaseUserUpdate(is_active=False), user)
+
+    client.portal.call(deactivate)
+    resp = client.delete(f"/links/{short_link}", headers=headers)
+    assert resp.status_code == 401
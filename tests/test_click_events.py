@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+from sqlalchemy import text
+
+from src.database import sync_engine
+from src.links.click_events import ClickEvent, build_rollup_upsert, ip_prefix, rollup
+from src.links.models import link_clicks_daily
+
+
+def test_ip_prefix_drops_host_part():
+    assert ip_prefix("203.0.113.77") == "203.0.113.0/24"
+    assert ip_prefix("2001:db8:1234:5678::1") == "2001:db8:1234::/48"
+    assert ip_prefix("testclient") is None
+    assert ip_prefix(None) is None
+
+
+def test_rollup_groups_by_hour_and_day():
+    base = datetime(2026, 1, 1, 23, 10, tzinfo=timezone.utc)
+    events = [
+        ClickEvent(1, base, None, None, None),
+        ClickEvent(1, base + timedelta(minutes=30), None, None, None),
+        ClickEvent(1, base + timedelta(minutes=55), None, None, None),  # уже следующий день
+        ClickEvent(2, base, None, None, None),
+    ]
+    hourly, daily = rollup(events)
+    assert hourly == {
+        (1, datetime(2026, 1, 1, 23, tzinfo=timezone.utc)): 2,
+        (1, datetime(2026, 1, 2, 0, tzinfo=timezone.utc)): 1,
+        (2, datetime(2026, 1, 1, 23, tzinfo=timezone.utc)): 1,
+    }
+    assert daily == {(1, base.date()): 2, (1, base.date() + timedelta(days=1)): 1, (2, base.date()): 1}
+
+
+def test_rollup_upsert_rows_are_sorted():
+    day = datetime(2026, 1, 1).date()
+    counts = {(2, day): 1, (1, day + timedelta(days=1)): 1, (1, day): 3}
+    params = build_rollup_upsert(link_clicks_daily, counts).compile().params
+    # Параметры строк VALUES: link_id_m0, bucket_m0, ... в порядке строк
+    rows = [(params[f"link_id_m{i}"], params[f"bucket_m{i}"]) for i in range(len(counts))]
+    assert rows == sorted(counts)
+
+
+def test_redirect_events_are_copied_and_rolled_up(client):
+    # Тот же модуль, что и у приложения (PYTHONPATH=src)
+    from links.click_events import click_events
+
+    client.portal.call(click_events.flush)
+    link = client.post("/links/shorten", json={"long_link": f"http://events.com/{uuid4()}"}).json()
+    for _ in range(3):
+        client.get(
+            f"/links/?short_link={link['short_link']}",
+            headers={"Referer": "https://ref.example/page", "User-Agent": "pytest-agent"},
+            follow_redirects=False
+        )
+    assert len(click_events) == 3
+    assert client.portal.call(click_events.flush) == 3
+
+    with sync_engine.connect() as conn:
+        rows = conn.execute(
+            text("SELECT referrer, user_agent FROM link_clicks WHERE link_id = :id"), {"id": link["id"]}
+        ).all()
+        hourly = conn.execute(
+            text("SELECT sum(clicks) FROM link_clicks_hourly WHERE link_id = :id"), {"id": link["id"]}
+        ).scalar()
+    assert rows == [("https://ref.example/page", "pytest-agent")] * 3
+    assert hourly == 3
+
+    now = datetime.now(timezone.utc)
+    stats = client.get(
+        f"/links/{link['short_link']}/stats",
+        params={"start": (now - timedelta(days=1)).isoformat(), "granularity": "hour"}
+    ).json()
+    assert [bucket["clicks"] for bucket in stats["timeline"]] == [3]
+    assert datetime.fromisoformat(stats["timeline"][0]["period_start"]) == now.replace(minute=0, second=0, microsecond=0)
+
+    stats = client.get(f"/links/{link['short_link']}/stats", params={"end": now.isoformat()}).json()
+    assert stats["timeline"] == [{"period_start": f"{now.date().isoformat()}T00:00:00Z", "clicks": 3}]
+    # Без интервала агрегаты не читаются
+    assert client.get(f"/links/{link['short_link']}/stats").json()["timeline"] is None
+
+
+def test_full_queue_drops_events():
+    from src.links.click_events import ClickEventQueue
+
+    queue = ClickEventQueue(maxsize=2, batch_size=10)
+    for _ in range(5):
+        queue.record(1)
+    assert len(queue) == 2
+    assert queue.dropped == 3
@@ -0,0 +1,60 @@
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+from src.database import PoolStats, instrumented_pool, track_pool_events
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_pool_metrics_report_async_pool(client):
+    before = sample("db_pool_wait_seconds_count", engine="async")
+    client.get("/links/nonexistentcode/stats")
+    assert sample("db_pool_wait_seconds_count", engine="async") > before
+    assert sample("db_pool_size_connections", engine="async") > 0
+    assert sample("db_pool_waiting_requests", engine="async") == 0
+    assert "db_pool_wait_seconds_bucket" in client.get("/metrics").text
+    # Состояние пулов - только в /metrics, отдельного эндпоинта нет
+    assert client.get("/internal/pool").status_code == 404
+
+
+def test_pool_exhaustion_is_counted():
+    from sqlalchemy import create_engine
+    from src.database import sync_engine
+
+    stats = PoolStats("test_exhaustion")
+    engine = create_engine(
+        sync_engine.url,
+        poolclass=instrumented_pool(QueuePool, stats),
+        pool_size=1,
+        max_overflow=1,
+        pool_timeout=0.1
+    )
+    track_pool_events(engine, stats)
+    labels = {"engine": "test_exhaustion"}
+    try:
+        with engine.connect() as conn, engine.connect() as extra:
+            conn.execute(text("SELECT 1"))
+            extra.execute(text("SELECT 1"))
+            assert sample("db_pool_size_connections", **labels) == 1
+            assert sample("db_pool_overflow_connections", **labels) == 1
+            assert sample("db_pool_checked_out_connections", **labels) == 2
+            with pytest.raises(PoolTimeoutError):
+                engine.connect()
+            assert sample("db_pool_timeouts_total", **labels) == 1
+        # Соединение сверх pool_size закрывается при возврате
+        assert sample("db_pool_overflow_connections", **labels) == 0
+        assert sample("db_pool_checked_out_connections", **labels) == 0
+        engine.dispose()
+        assert sample("db_pool_connection_events_total", event="connect", **labels) == 2
+        assert sample("db_pool_connection_events_total", event="close", **labels) == 2
+        assert sample("db_pool_wait_seconds_count", **labels) == 3
+        # Ожидание при исчерпании попадает в корзину около pool_timeout
+        assert sample("db_pool_wait_seconds_bucket", le="0.05", **labels) == 2
+        assert sample("db_pool_wait_seconds_bucket", le="0.25", **labels) == 3
+    finally:
+        engine.dispose()
@@ -0,0 +1,424 @@
+import asyncio
+import time
+
+import pytest
+
+from src.links.cache import LocalCache
+
+
+def test_local_cache_lru_eviction():
+    cache = LocalCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "a" становится самым свежим
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.evictions == 1
+    assert cache.hits == 3
+    assert cache.misses == 1
+
+
+def test_local_cache_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = LocalCache(maxsize=10, ttl=5)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=60)  # TTL не может превышать ttl кэша
+    now[0] += 6
+    assert cache.get("a") is None
+    assert cache.get("b") is None
+    assert cache.expirations == 2
+
+
+def test_l1_evicted_on_update(client):
+    from links.cache import link_l1, link_cache_key
+    from uuid import uuid4
+
+    email = f"l1user_{uuid4()}@example.com"
+    client.post("/auth/register", json={"email": email, "password": "pass"})
+    token = client.post("/auth/jwt/login", data={"username": email, "password": "pass"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    short_code = client.post("/links/shorten", json={"long_link": f"http://l1.com/{uuid4()}"}, headers=headers).json()["short_link"]
+    client.get(f"/links/?short_link={short_code}", follow_redirects=False)
+    assert link_l1.get(link_cache_key(short_code)) is not None
+
+    new_url = f"http://l1-updated.com/{uuid4()}"
+    client.put(f"/links/{short_code}", json={"new_long_link": new_url}, headers=headers)
+    assert link_l1.get(link_cache_key(short_code)) is None
+    resp = client.get(f"/links/?short_link={short_code}", follow_redirects=False)
+    assert resp.headers["location"] == new_url
+
+
+def test_link_record_ttl_follows_expiry():
+    from config import LINK_CACHE_MISS_TTL, LINK_CACHE_TTL
+    from src.links.cache import link_record_ttl
+
+    now = 1000.0
+    record = {"id": 1, "long_link": "http://a.com", "expires_at": None, "active": True}
+    assert link_record_ttl(record, now) == LINK_CACHE_TTL
+    assert link_record_ttl(dict(record, expires_at=now + 5), now) == 5
+    assert link_record_ttl(dict(record, expires_at=now + 10 * LINK_CACHE_TTL), now) == LINK_CACHE_TTL
+    assert link_record_ttl(dict(record, expires_at=now - 1), now) == LINK_CACHE_MISS_TTL
+    assert link_record_ttl(dict(record, active=False), now) == LINK_CACHE_MISS_TTL
+
+
+def test_cached_link_dropped_at_expiry(client, monkeypatch):
+    from datetime import datetime, timedelta, timezone
+    from uuid import uuid4
+    from fastapi_cache import FastAPICache
+    from links.cache import link_l1, link_cache_key
+
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=3)
+    short_code = client.post(
+        "/links/shorten",
+        json={"long_link": f"http://soon.com/{uuid4()}", "expires_at": expires_at.isoformat()}
+    ).json()["short_link"]
+    assert client.get(f"/links/?short_link={short_code}", follow_redirects=False).status_code == 307
+
+    key = link_cache_key(short_code)
+    stored = FastAPICache.get_backend()._store[key]
+    # Запись в кэше не переживает ссылку
+    assert stored.ttl_ts <= expires_at.timestamp()
+    assert link_l1._data[key][0] - time.monotonic() <= 3
+
+    # По истечении записи нет ни в L1, ни в общем кэше
+    real_monotonic = time.monotonic
+    monkeypatch.setattr(time, "monotonic", lambda: real_monotonic() + 4)
+    assert link_l1.get(key) is None
+
+
+class FakeSession:
+    async def __aenter__(self):
+        return "background-session"
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def make_loader(calls, value, delay=0.05):
+    async def loader(session):
+        calls.append(session)
+        await asyncio.sleep(delay)
+        return value
+    return loader
+
+
+def test_coalescing_cache_loads_missing_key_once():
+    from uuid import uuid4
+    from links.cache import CoalescingCache
+
+    cache = CoalescingCache("test", ttl=lambda value: 60, session_factory=FakeSession)
+    key = f"coalesce:{uuid4()}"
+    calls = []
+
+    async def scenario():
+        loader = make_loader(calls, {"n": 1})
+        results = await asyncio.gather(*(cache.get(key, loader, "request-session") for _ in range(20)))
+        assert results == [{"n": 1}] * 20
+        assert await cache.get(key, loader, "request-session") == {"n": 1}
+        # Отсутствие значения - тоже значение и тоже кэшируется
+        missing = f"{key}:none"
+        assert await cache.get(missing, make_loader(calls, None), "request-session") is None
+        assert await cache.get(missing, make_loader(calls, None), "request-session") is None
+    asyncio.run(scenario())
+    assert calls == ["request-session", "request-session"]
+
+
+def test_coalescing_cache_serves_stale_while_refreshing(monkeypatch):
+    from uuid import uuid4
+    from links import cache as cache_module
+    from links.cache import CoalescingCache
+
+    now = [time.time()]
+    monkeypatch.setattr(cache_module.time, "time", lambda: now[0])
+    cache = CoalescingCache("test", ttl=lambda value: 10, stale_ttl=60, beta=0, session_factory=FakeSession)
+    key = f"coalesce:{uuid4()}"
+    calls = []
+
+    async def scenario():
+        await cache.get(key, make_loader(calls, "old"), "request-session")
+        now[0] += 11
+        # Устаревшее значение отдаётся сразу, обновление одно на все запросы
+        results = await asyncio.gather(*(cache.get(key, make_loader(calls, "new"), "request-session") for _ in range(5)))
+        assert results == ["old"] * 5
+        await asyncio.gather(*cache._tasks)
+        assert await cache.get(key, make_loader(calls, "newer"), "request-session") == "new"
+    asyncio.run(scenario())
+    assert calls == ["request-session", "background-session"]
+
+
+def test_coalescing_cache_refreshes_hot_key_early():
+    from unittest.mock import patch
+    from uuid import uuid4
+    from links import cache as cache_module
+    from links.cache import CoalescingCache
+
+    key = f"coalesce:{uuid4()}"
+    calls = []
+
+    async def scenario(beta):
+        cache = CoalescingCache("test", ttl=lambda value: 60, beta=beta, session_factory=FakeSession)
+        # Загрузка «длилась» час: при beta > 0 и медианном случайном сдвиге
+        # (-log(0.5) * 3600 сек.) обновление раньше срока
+        await cache.store(key, "value", delta=3600)
+        with patch.object(cache_module.random, "random", return_value=0.5):
+            assert await cache.get(key, make_loader(calls, "fresh"), "request-session") == "value"
+        await asyncio.gather(*cache._tasks)
+
+    asyncio.run(scenario(beta=0))
+    assert calls == []
+    asyncio.run(scenario(beta=1))
+    assert calls == ["background-session"]
+
+
+def test_coalescing_cache_lock_is_shared_between_workers():
+    import os
+    from uuid import uuid4
+    import pytest
+    import redis.asyncio as aioredis
+    from links import cache as cache_module
+    from links.cache import CoalescingCache
+
+    redis_url = os.getenv("TEST_REDIS_URL", "redis://localhost:6379/15")
+    key = f"coalesce:{uuid4()}"
+    calls = []
+
+    async def scenario():
+        redis = aioredis.Redis.from_url(redis_url)
+        try:
+            await redis.ping()
+        except Exception:
+            await redis.close()
+            pytest.skip(f"Redis недоступен: {redis_url}")
+        cache_module.init_link_cache(redis)
+        try:
+            # Два воркера: у каждого свой single-flight, общий только Redis
+            workers = [CoalescingCache("test", ttl=lambda value: 60, session_factory=FakeSession) for _ in range(2)]
+            results = await asyncio.gather(*(
+                worker.get(key, make_loader(calls, "value", delay=0.2), "request-session")
+                for worker in workers for _ in range(3)
+            ))
+            assert results == ["value"] * 6
+            assert not await redis.exists(f"lock:{key}")
+        finally:
+            cache_module.init_link_cache(None)
+            await redis.close()
+    asyncio.run(scenario())
+    assert calls == ["request-session"]
+
+
+def use_cache_backend(backend):
+    # FastAPICache.init не меняет уже заданный бэкенд (его задаёт conftest)
+    from fastapi_cache import FastAPICache
+
+    FastAPICache.reset()
+    FastAPICache.init(backend, prefix="fastapi-cache")
+
+
+@pytest.mark.parametrize("backend_name", ["memory", "redis"])
+def test_load_started_before_invalidation_is_not_cached(backend_name):
+    import os
+    from uuid import uuid4
+    import redis.asyncio as aioredis
+    from fastapi_cache import FastAPICache
+    from fastapi_cache.backends.redis import RedisBackend
+    from links.cache import CoalescingCache, invalidate_link_cache, link_cache_key
+
+    code = f"gen{uuid4().hex[:8]}"
+    key = link_cache_key(code)
+    calls = []
+
+    async def scenario():
+        cache = CoalescingCache("test", ttl=lambda value: 60, beta=0, session_factory=FakeSession)
+        # Загрузка прочитала старую строку, ссылку изменили и сбросили кэш,
+        # пока загрузка ещё шла: старое значение не должно вернуться в кэш
+        loading = asyncio.create_task(cache.get(key, make_loader(calls, "old", delay=0.2), "request-session"))
+        await asyncio.sleep(0.05)
+        await invalidate_link_cache(code)
+        assert await loading == "old"
+        assert await cache.read(key) is None
+        # Загрузка, начатая после инвалидации, записывается как обычно
+        assert await cache.get(key, make_loader(calls, "new", delay=0), "request-session") == "new"
+        assert (await cache.read(key))["v"] == "new"
+
+    if backend_name == "memory":
+        asyncio.run(scenario())
+        return
+
+    previous = FastAPICache.get_backend()
+
+    async def with_redis():
+        redis = aioredis.Redis.from_url(os.getenv("TEST_REDIS_URL", "redis://localhost:6379/15"))
+        try:
+            await redis.ping()
+        except Exception:
+            await redis.close()
+            pytest.skip("Redis недоступен")
+        use_cache_backend(RedisBackend(redis))
+        try:
+            await scenario()
+        finally:
+            await redis.delete(key, f"gen:{key}")
+            await redis.close()
+    try:
+        asyncio.run(with_redis())
+    finally:
+        use_cache_backend(previous)
+
+
+def test_warmup_loads_most_clicked_recent_links():
+    from datetime import datetime, timedelta, timezone
+    from fastapi_cache import FastAPICache
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import NullPool
+    from database import DATABASE_URL, sync_engine
+    from links.cache import cache_get, link_cache_key
+    from links.models import links
+    from links.urls import long_link_digest
+    from links.warmup import warm_link_cache
+
+    now = datetime.now(timezone.utc)
+    seeds = {
+        # short_link: (num, last_date, expires_at)
+        "warm-hot": (100, now, None),
+        "warm-mid": (50, now, now + timedelta(hours=1)),
+        "warm-cold": (1, now, None),
+        "warm-expired": (1000, now, now - timedelta(hours=1)),
+        "warm-forgotten": (500, now - timedelta(days=30), None),
+    }
+    with sync_engine.begin() as conn:
+        conn.execute(links.insert(), [
+            {
+                "long_link": f"https://warm.example/{code}", "long_link_digest": long_link_digest(f"https://warm.example/{code}"),
+                "short_link": code, "auth": False, "user_id": None, "start_date": now,
+                "last_date": last_date, "num": num, "expires_at": expires_at,
+            }
+            for code, (num, last_date, expires_at) in seeds.items()
+        ])
+
+    async def scenario():
+        # Свой движок: пул приложения привязан к циклу событий TestClient
+        bind = create_async_engine(DATABASE_URL, poolclass=NullPool)
+        try:
+            progress = await warm_link_cache(None, limit=2, budget=5, recent_days=7, batch_size=1, bind=bind)
+            again = await warm_link_cache(None, limit=2, budget=5, recent_days=7, batch_size=1, bind=bind)
+        finally:
+            await bind.dispose()
+        cached = {code: await cache_get(link_cache_key(code)) for code in seeds}
+        return progress, again, cached
+
+    progress, again, cached = asyncio.run(scenario())
+    assert progress == {"processed": 2, "written": 2}
+    # Уже закэшированное не перезаписывается
+    assert again == {"processed": 2, "written": 0}
+    assert cached["warm-hot"]["v"]["long_link"] == "https://warm.example/warm-hot"
+    assert cached["warm-mid"]["v"]["active"] is True
+    assert [code for code, entry in cached.items() if entry is not None] == ["warm-hot", "warm-mid"]
+    # Запись не переживает ссылку
+    stored = FastAPICache.get_backend()._store[link_cache_key("warm-mid")]
+    assert stored.ttl_ts <= (now + timedelta(hours=1)).timestamp()
+
+
+def test_warmup_skips_links_invalidated_after_read():
+    import os
+    from types import SimpleNamespace
+    from uuid import uuid4
+    import redis.asyncio as aioredis
+    from fastapi_cache import FastAPICache
+    from fastapi_cache.backends.redis import RedisBackend
+    from links.cache import cache_get, invalidate_link_cache, link_cache_key
+    from links.warmup import write_batch
+
+    fresh, changed = f"wf{uuid4().hex[:8]}", f"wc{uuid4().hex[:8]}"
+    rows = [
+        SimpleNamespace(id=1, short_link=fresh, long_link="https://warm.example/fresh", expires_at=None),
+        SimpleNamespace(id=2, short_link=changed, long_link="https://warm.example/old", expires_at=None),
+    ]
+    keys = [link_cache_key(code) for code in (fresh, changed)]
+    previous = FastAPICache.get_backend()
+
+    async def scenario():
+        redis = aioredis.Redis.from_url(os.getenv("TEST_REDIS_URL", "redis://localhost:6379/15"))
+        try:
+            await redis.ping()
+        except Exception:
+            await redis.close()
+            pytest.skip("Redis недоступен")
+        use_cache_backend(RedisBackend(redis))
+        try:
+            # Порцию прочитали, затем одну из ссылок изменили
+            await invalidate_link_cache(changed)
+            assert await write_batch(rows) == (1, 1)
+            assert (await cache_get(keys[0]))["v"]["long_link"] == "https://warm.example/fresh"
+            assert await cache_get(keys[1]) is None
+        finally:
+            await redis.delete(*keys, *(f"gen:{key}" for key in keys))
+            await redis.close()
+    try:
+        asyncio.run(scenario())
+    finally:
+        use_cache_backend(previous)
+
+
+def test_invalidation_listener_evicts_local_caches():
+    import os
+    from uuid import uuid4
+    import redis.asyncio as aioredis
+    from auth.principals import PRINCIPAL_INVALIDATION_CHANNEL, principal_cache
+    from links.cache import INVALIDATION_CHANNEL, link_cache_key, link_l1, run_invalidation_listener
+
+    redis_url = os.getenv("TEST_REDIS_URL", "redis://localhost:6379/15")
+    stale, evicted, kept = (f"ls{uuid4().hex[:8]}" for _ in range(3))
+    user_id, other_id = str(uuid4()), str(uuid4())
+
+    async def wait_for(condition, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while not await condition():
+            assert time.monotonic() < deadline
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        listener_redis = aioredis.Redis.from_url(redis_url)
+        publisher = aioredis.Redis.from_url(redis_url)
+        try:
+            await publisher.ping()
+        except Exception:
+            await listener_redis.close()
+            await publisher.close()
+            pytest.skip(f"Redis недоступен: {redis_url}")
+
+        async def subscribed():
+            counts = dict(await publisher.pubsub_numsub(INVALIDATION_CHANNEL, PRINCIPAL_INVALIDATION_CHANNEL))
+            return all(counts.values())
+
+        # То, что лежало в кэше до подписки, могло пропустить инвалидацию
+        link_l1.set(link_cache_key(stale), {"id": 1})
+        listener = asyncio.create_task(run_invalidation_listener(listener_redis))
+        try:
+            await wait_for(subscribed)
+            assert link_l1.get(link_cache_key(stale)) is None
+
+            link_l1.set(link_cache_key(evicted), {"id": 2})
+            link_l1.set(link_cache_key(kept), {"id": 3})
+            principal_cache.set("token-a", {"id": user_id})
+            principal_cache.set("token-b", {"id": other_id})
+            await publisher.publish(INVALIDATION_CHANNEL, evicted)
+            await publisher.publish(PRINCIPAL_INVALIDATION_CHANNEL, user_id)
+
+            async def delivered():
+                return principal_cache.get("token-a") is None and link_l1.get(link_cache_key(evicted)) is None
+            await wait_for(delivered)
+            assert link_l1.get(link_cache_key(kept)) == {"id": 3}
+            assert principal_cache.get("token-b") == {"id": other_id}
+        finally:
+            listener.cancel()
+            await asyncio.gather(listener, return_exceptions=True)
+            link_l1.clear()
+            principal_cache.clear()
+            await listener_redis.close()
+            await publisher.close()
+
+    asyncio.run(scenario())
@@ -1,7 +1,9 @@
 import pytest
 from datetime import datetime, timedelta, timezone
 from uuid import uuid4
-from unittest.mock import patch
+from unittest.mock import AsyncMock, patch
+from sqlalchemy import text
+from src.database import sync_engine
 
 def test_create_short_link_anonymous(client):
     unique_url = f"https://example.com/some/very/long/url?uid={uuid4()}"
@@ -45,6 +47,25 @@ def test_create_short_link_repeated_anonymous(client):
     detail = resp2.json()["detail"]
     assert "Ссылка уже существует" in detail
 
+def test_long_link_digest_uses_canonical_url(client):
+    from links.urls import long_link_digest, normalize_url
+
+    assert normalize_url("HTTPS://Example.COM:443") == "https://example.com/"
+    assert normalize_url("http://example.com:8080/Path?q=A#Frag") == "http://example.com:8080/Path?q=A#Frag"
+    assert normalize_url("not a url") == "not a url"
+    assert long_link_digest("HTTPS://Example.COM") == long_link_digest("https://example.com/")
+    assert len(long_link_digest("https://example.com/" + "x" * 10000)) == 16
+
+    path = uuid4()
+    resp = client.post("/links/shorten", json={"long_link": f"https://Digest-Test.com/{path}"})
+    assert resp.status_code == 200
+    # Та же ссылка в другой записи - дубль, и поиск находит её по любой записи
+    dup = client.post("/links/shorten", json={"long_link": f"HTTPS://digest-test.com:443/{path}"})
+    assert dup.status_code == 400
+    search = client.get("/links/search", params={"long_link": f"https://digest-test.com/{path}"})
+    assert search.status_code == 200
+    assert search.json() == resp.json()["short_link"]
+
 def test_create_short_link_custom_alias(client):
     custom_alias = "myalias123"
     unique_url = f"https://example.com/custom?uid={uuid4()}"
@@ -73,17 +94,20 @@ def test_redirect_without_scheme(client, url_without_scheme):
     assert location.startswith("http://")
 
 def test_create_short_link_collision(client):
-    with patch("src.links.router.generate_short_link", return_value="collision"):
-        first_url = f"https://collision-test.com/uid={uuid4()}"
-        resp1 = client.post("/links/shorten", json={"long_link": first_url})
-        assert resp1.status_code == 200
+    # Модуль приложения (PYTHONPATH=src), а не src.links.shortcodes
+    from links.shortcodes import short_code_allocator
 
-    with patch("src.links.router.generate_short_link", return_value="collision"):
+    taken = f"tk{uuid4().hex[:6]}"
+    resp1 = client.post("/links/shorten", json={"long_link": f"https://collision-test.com/uid={uuid4()}", "custom_alias": taken})
+    assert resp1.status_code == 200
+
+    fresh = f"fr{uuid4().hex[:6]}"
+    with patch.object(short_code_allocator, "allocate", AsyncMock(side_effect=[taken, fresh])):
         second_url = f"https://collision-test.com/uid={uuid4()}"
         resp2 = client.post("/links/shorten", json={"long_link": second_url})
-        assert resp2.status_code == 500
-        detail = resp2.json()["detail"]
-        assert "Ошибка генерации уникального alias" in detail
+    # Совпадение с занятым кодом не ошибка: берётся следующий код
+    assert resp2.status_code == 200
+    assert resp2.json()["short_link"] == fresh
 
 def test_redirect_and_stats_flow(client):
     unique_url = f"http://example.org/some/page?uid={uuid4()}"
@@ -106,11 +130,36 @@ def test_redirect_and_stats_flow(client):
     stats2 = stats_resp2.json()
     assert stats2["clicks_count"] == 1
 
+def test_cached_redirect_skips_session(client):
+    from database import get_async_session
+    from src.main import app
+
+    unique_url = f"https://example.org/путь с пробелом?uid={uuid4()}"
+    short_code = client.post("/links/shorten", json={"long_link": unique_url}).json()["short_link"]
+    # Промах кэша: отвечает маршрут, запись попадает в кэш
+    first = client.get(f"/links/?short_link={short_code}", follow_redirects=False)
+    client.get("/links/?short_link=missing-code")
+
+    async def no_session():
+        raise AssertionError("сессия БД не должна открываться")
+        yield
+    app.dependency_overrides[get_async_session] = no_session
+    try:
+        second = client.get(f"/links/?short_link={short_code}", follow_redirects=False)
+        missing = client.get("/links/?short_link=missing-code")
+    finally:
+        app.dependency_overrides.pop(get_async_session)
+    assert second.status_code == first.status_code == 307
+    assert second.headers["location"] == first.headers["location"]
+    assert missing.status_code == 404
+    assert missing.json()["detail"] == "Ссылка не найдена"
+    assert client.get(f"/links/{short_code}/stats").json()["clicks_count"] == 2
+
 def test_redirect_non_existing_link(client):
     resp = client.get("/links?short_link=some_random_code")
     assert resp.status_code == 404 
     detail = resp.json()["detail"]
-    assert "Not Found" in detail
+    assert "Ссылка не найдена" in detail
 
 def test_stats_non_existing_link(client):
     resp = client.get("/links/nonexistentcode/stats")
@@ -126,14 +175,18 @@ def test_search_link_and_delete(client):
     headers = {"Authorization": f"Bearer {token}"}
 
     unique_url = f"https://delete-example.com/path?uid={uuid4()}"
+    # «Не найдено» кэшируется, создание ссылки сбрасывает эту запись
+    assert client.get("/links/search", params={"long_link": unique_url}).status_code == 404
     create_resp = client.post("/links/shorten", json={"long_link": unique_url}, headers=headers)
     short_code = create_resp.json()["short_link"]
 
-    search_resp = client.get(f"/links/search?long_link={unique_url}")
+    search_resp = client.get("/links/search", params={"long_link": unique_url})
     assert search_resp.status_code == 200
+    assert search_resp.json() == short_code
 
     delete_resp = client.delete(f"/links/{short_code}", headers=headers)
     assert delete_resp.status_code == 200
+    assert client.get("/links/search", params={"long_link": unique_url}).status_code == 404
 
 def test_delete_link_of_another_user(client):
     email_a = f"userA_{uuid4()}@example.com"
@@ -156,25 +209,20 @@ def test_delete_link_of_another_user(client):
     assert resp.status_code == 404
 
 
-@patch('src.links.router.delete_expired_link.apply_async')
-def test_delete_expired_link_task(mock_celery, client):
+def test_expiring_link_does_not_schedule_task(client):
     unique_url = f"http://todelete.com?uid={uuid4()}"
     expires_at = datetime(2100, 1, 1, 0, 0, tzinfo=timezone.utc)
-    resp = client.post(
-        "/links/shorten",
-        json={
-            "long_link": unique_url,
-            "expires_at": expires_at.isoformat()
-        }
-    )
+    with patch("tasks.tasks.delete_expired_link.apply_async") as mock_celery:
+        resp = client.post(
+            "/links/shorten",
+            json={
+                "long_link": unique_url,
+                "expires_at": expires_at.isoformat()
+            }
+        )
     assert resp.status_code == 200
-    link_id = resp.json()["id"]
-
-    mock_celery.assert_called_once_with(
-        args=[link_id],
-        eta=expires_at,
-        queue='celery'
-    )
+    assert datetime.fromisoformat(resp.json()["expires_at"]) == expires_at
+    mock_celery.assert_not_called()
 
 def test_update_link(client):
     unique_email = f"updateuser_{uuid4()}@example.com"
@@ -188,9 +236,15 @@ def test_update_link(client):
     short_code = create_resp.json()["short_link"]
 
     new_url = f"http://updated.com/path?uid={uuid4()}"
+    assert client.get("/links/search", params={"long_link": original_url}).json() == short_code
+    assert client.get("/links/search", params={"long_link": new_url}).status_code == 404
     update_resp = client.put(f"/links/{short_code}", json={"new_long_link": new_url}, headers=headers)
     assert update_resp.status_code == 200
     assert update_resp.json()["long_link"] == new_url
+    assert "old_long_link" not in update_resp.json()
+    # Поиск по прежнему и по новому адресу видит изменение сразу
+    assert client.get("/links/search", params={"long_link": original_url}).status_code == 404
+    assert client.get("/links/search", params={"long_link": new_url}).json() == short_code
 
 def test_update_link_of_another_user(client):
     email_a = f"userA_{uuid4()}@example.com"
@@ -213,8 +267,7 @@ def test_update_link_of_another_user(client):
     update_resp = client.put(f"/links/{short_code}", json={"new_long_link": new_url}, headers=headers_b)
     assert update_resp.status_code == 404
 
-@patch('src.links.router.delete_expired_link.apply_async')
-def test_get_expired_links(mock_celery, client):
+def test_get_expired_links(client):
     unique_url = f"http://expired.com/path?uid={uuid4()}"
     past_time = (datetime.now(timezone.utc) - timedelta(days=1)).isoformat()
     resp = client.post("/links/shorten", json={"long_link": unique_url, "expires_at": past_time})
@@ -225,8 +278,7 @@ def test_get_expired_links(mock_celery, client):
     expired_links = expired_resp.json()
     assert any(link["long_link"] == unique_url for link in expired_links)
 
-@patch('src.links.router.delete_expired_link.apply_async')
-def test_expired_link_redirect(mock_celery, client):
+def test_expired_link_redirect(client):
     unique_url = f"http://expired-redirect.com/path?uid={uuid4()}"
     past_time = datetime.now(timezone.utc) - timedelta(days=2)
     resp = client.post("/links/shorten", json={"long_link": unique_url, "expires_at": past_time.isoformat()})
@@ -255,3 +307,361 @@ def test_cache_invalidation_on_delete(client):
     resp_get_after_del = client.get(f"/links/?short_link={short_code}")
     assert resp_get_after_del.status_code == 404
 
+
+
+def test_redirect_clicks_are_flushed_in_batch(client):
+    # Используем тот же модуль, что и приложение (PYTHONPATH=src)
+    from links.clicks import click_buffer
+
+    unique_url = f"http://write-behind.com/path?uid={uuid4()}"
+    short_code = client.post("/links/shorten", json={"long_link": unique_url}).json()["short_link"]
+
+    for _ in range(3):
+        client.get(f"/links/?short_link={short_code}", follow_redirects=False)
+
+    with sync_engine.connect() as conn:
+        num = conn.execute(text("SELECT num FROM links WHERE short_link = :c"), {"c": short_code}).scalar()
+    assert num == 0, "До сброса буфера счётчик в БД не должен меняться"
+    assert client.get(f"/links/{short_code}/stats").json()["clicks_count"] == 3
+
+    client.portal.call(click_buffer.flush)
+    assert click_buffer.pending(short_code) == 0
+    with sync_engine.connect() as conn:
+        num = conn.execute(text("SELECT num FROM links WHERE short_link = :c"), {"c": short_code}).scalar()
+    assert num == 3
+
+
+def test_click_flush_retries_only_uncommitted_chunks(client, monkeypatch):
+    from links import clicks
+
+    codes = sorted(
+        client.post("/links/shorten", json={"long_link": f"http://flush-chunks.com/{uuid4()}"}).json()["short_link"]
+        for _ in range(2)
+    )
+    buffer = clicks.ClickBuffer()
+    for code in codes:
+        buffer.record(code)
+    # Порции по одной ссылке, каждая в своей транзакции; вторая падает
+    monkeypatch.setattr(clicks, "FLUSH_CHUNK_SIZE", 1)
+    build = clicks.build_flush_statement
+
+    def fail_second(rows):
+        if rows[0][0] == codes[1]:
+            raise RuntimeError("сбой второй порции")
+        return build(rows)
+    monkeypatch.setattr(clicks, "build_flush_statement", fail_second)
+    with pytest.raises(RuntimeError):
+        client.portal.call(buffer.flush)
+    assert [buffer.pending(code) for code in codes] == [0, 1]
+
+    monkeypatch.setattr(clicks, "build_flush_statement", build)
+    assert client.portal.call(buffer.flush) == 1
+    with sync_engine.connect() as conn:
+        nums = conn.execute(
+            text("SELECT short_link, num FROM links WHERE short_link = ANY(:c)"), {"c": codes}
+        ).all()
+    assert dict(nums) == {codes[0]: 1, codes[1]: 1}
+
+
+def test_redirect_served_from_cached_record(client):
+    unique_url = f"http://cached-record.com/path?uid={uuid4()}"
+    short_code = client.post("/links/shorten", json={"long_link": unique_url}).json()["short_link"]
+    first = client.get(f"/links/?short_link={short_code}", follow_redirects=False)
+    assert first.headers["location"] == unique_url
+
+    # Повторный редирект не должен обращаться к таблице links
+    statements = []
+    from database import engine
+    from sqlalchemy import event
+
+    def on_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", on_execute)
+    try:
+        second = client.get(f"/links/?short_link={short_code}", follow_redirects=False)
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", on_execute)
+    assert second.headers["location"] == unique_url
+    assert not [s for s in statements if "links" in s]
+
+def test_redirect_unknown_code_becomes_available_after_create(client):
+    alias = f"later{uuid4().hex[:6]}"
+    assert client.get(f"/links/?short_link={alias}").status_code == 404
+    resp = client.post("/links/shorten", json={"long_link": f"http://later.com/{uuid4()}", "custom_alias": alias})
+    assert resp.status_code == 200
+    redirect_resp = client.get(f"/links/?short_link={alias}", follow_redirects=False)
+    assert redirect_resp.status_code == 307
+
+
+def test_shorten_batch_reports_per_item_results(client):
+    import json
+
+    taken = f"bt{uuid4().hex[:6]}"
+    client.post("/links/shorten", json={"long_link": f"https://batch.com/{uuid4()}", "custom_alias": taken})
+
+    url = f"https://batch.com/{uuid4()}"
+    expires = datetime(2100, 1, 1, 0, 0, 30, tzinfo=timezone.utc)
+    items = [
+        {"long_link": url},
+        {"long_link": url},
+        {"long_link": f"https://batch.com/{uuid4()}", "custom_alias": taken},
+        {"custom_alias": "no-long-link"},
+        {"long_link": f"https://batch.com/{uuid4()}", "expires_at": expires.isoformat()},
+        {"long_link": f"https://batch.com/{uuid4()}", "expires_at": expires.replace(second=45).isoformat()},
+    ]
+    resp = client.post("/links/shorten/batch", json=items)
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    results = [json.loads(line) for line in resp.text.splitlines()]
+    assert [r["index"] for r in results] == list(range(len(items)))
+    assert [r["status_code"] for r in results] == [200, 400, 400, 422, 200, 200]
+    assert results[0]["link"]["long_link"] == url
+    assert "Ссылка уже существует" in results[1]["detail"]
+    assert "Custom alias уже используется" in results[2]["detail"]
+
+    assert datetime.fromisoformat(results[4]["link"]["expires_at"]) == expires
+
+    redirect_resp = client.get(f"/links/?short_link={results[0]['link']['short_link']}", follow_redirects=False)
+    assert redirect_resp.headers["location"] == url
+
+
+def test_shorten_batch_failed_chunk_does_not_reserve_links(client):
+    import json
+    from functools import partial
+    from links import batch
+
+    url = f"https://batch-fail.com/{uuid4()}"
+    alias = f"bf{uuid4().hex[:6]}"
+    items = [
+        {"long_link": url},
+        {"long_link": f"https://batch-fail.com/{uuid4()}", "custom_alias": alias},
+        {"long_link": url},
+        {"long_link": f"https://batch-fail.com/{uuid4()}", "custom_alias": alias},
+    ]
+    calls = []
+    real_link_host = batch.link_host
+
+    def failing_host(long_link):
+        # Первая порция падает до INSERT
+        calls.append(long_link)
+        if len(calls) == 1:
+            raise RuntimeError("db is down")
+        return real_link_host(long_link)
+
+    with patch("links.router.shorten_batch", partial(batch.shorten_batch, chunk_size=2)), \
+            patch("links.batch.link_host", failing_host):
+        resp = client.post("/links/shorten/batch", json=items)
+    results = [json.loads(line) for line in resp.text.splitlines()]
+    # Ссылка и alias из откатившейся порции свободны для следующей
+    assert [r["status_code"] for r in results] == [500, 500, 200, 200]
+    assert results[3]["link"]["short_link"] == alias
+
+
+def test_shorten_batch_generated_code_does_not_take_chunk_alias(client):
+    import json
+    from links.shortcodes import short_code_allocator
+
+    alias = f"bg{uuid4().hex[:6]}"
+    items = [
+        {"long_link": f"https://batch-gen.com/{uuid4()}"},
+        {"long_link": f"https://batch-gen.com/{uuid4()}", "custom_alias": alias},
+    ]
+    # Сгенерированный код совпадает с alias соседнего элемента
+    with patch.object(short_code_allocator, "allocate_many", AsyncMock(return_value=[alias])):
+        resp = client.post("/links/shorten/batch", json=items)
+    results = [json.loads(line) for line in resp.text.splitlines()]
+    assert [r["status_code"] for r in results] == [200, 200]
+    assert results[1]["link"]["short_link"] == alias
+    assert results[0]["link"]["short_link"] != alias
+    for item, result in zip(items, results):
+        assert result["link"]["long_link"] == item["long_link"]
+        redirect_resp = client.get(f"/links/?short_link={result['link']['short_link']}", follow_redirects=False)
+        assert redirect_resp.headers["location"] == item["long_link"]
+
+
+def test_shorten_batch_ndjson_and_limit(client):
+    import json
+
+    body = "\n".join(json.dumps({"long_link": f"https://ndjson.com/{uuid4()}"}) for _ in range(3)) + "\n{broken\n"
+    resp = client.post("/links/shorten/batch", content=body, headers={"Content-Type": "application/x-ndjson"})
+    results = [json.loads(line) for line in resp.text.splitlines()]
+    assert [r["status_code"] for r in results] == [200, 200, 200, 400]
+
+    with patch("links.router.BATCH_MAX_ITEMS", 2):
+        resp = client.post("/links/shorten/batch", json=[{"long_link": "a"}, {"long_link": "b"}, {"long_link": "c"}])
+    assert resp.status_code == 413
+
+
+def count_link_statements(client, method, url, **kwargs):
+    # Считаем только запросы к таблице links: проверка токена и nextval не в счёт
+    import re
+    from database import engine
+    from sqlalchemy import event
+
+    statements = []
+
+    def on_execute(conn, cursor, statement, *args):
+        if re.search(r"\blinks\b", statement):
+            statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", on_execute)
+    try:
+        resp = client.request(method, url, **kwargs)
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", on_execute)
+    return resp, statements
+
+
+def test_write_endpoints_use_single_statement(client):
+    email = f"onestmt_{uuid4()}@example.com"
+    client.post("/auth/register", json={"email": email, "password": "pass"})
+    token = client.post("/auth/jwt/login", data={"username": email, "password": "pass"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    resp, statements = count_link_statements(
+        client, "POST", "/links/shorten", json={"long_link": f"https://one.com/{uuid4()}"}, headers=headers
+    )
+    assert resp.status_code == 200
+    assert len(statements) == 1 and statements[0].startswith("INSERT")
+    short_code = resp.json()["short_link"]
+
+    resp, statements = count_link_statements(
+        client, "PUT", f"/links/{short_code}", json={"new_long_link": f"https://one.com/{uuid4()}"}, headers=headers
+    )
+    assert resp.status_code == 200
+    assert len(statements) == 1 and statements[0].startswith("UPDATE")
+
+    resp, statements = count_link_statements(client, "DELETE", f"/links/{short_code}", headers=headers)
+    assert resp.status_code == 200
+    assert len(statements) == 1 and statements[0].startswith("DELETE")
+
+    resp, statements = count_link_statements(client, "DELETE", f"/links/{short_code}", headers=headers)
+    assert resp.status_code == 404
+    assert len(statements) == 1
+
+
+def test_update_to_existing_long_link_is_rejected(client):
+    email = f"updup_{uuid4()}@example.com"
+    client.post("/auth/register", json={"email": email, "password": "pass"})
+    token = client.post("/auth/jwt/login", data={"username": email, "password": "pass"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    first_url = f"https://updup.com/{uuid4()}"
+    client.post("/links/shorten", json={"long_link": first_url}, headers=headers)
+    second = client.post("/links/shorten", json={"long_link": f"https://updup.com/{uuid4()}"}, headers=headers).json()
+
+    resp = client.put(f"/links/{second['short_link']}", json={"new_long_link": first_url}, headers=headers)
+    assert resp.status_code == 400
+    assert "Ссылка уже существует" in resp.json()["detail"]
+
+
+def test_expired_links_keyset_pages_and_stream(client):
+    import json
+
+    past = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
+    future = (datetime.now(timezone.utc) + timedelta(days=1)).isoformat()
+    expired_ids = [
+        client.post("/links/shorten", json={"long_link": f"http://page.com/{uuid4()}", "expires_at": past}).json()["id"]
+        for _ in range(5)
+    ]
+    client.post("/links/shorten", json={"long_link": f"http://page.com/{uuid4()}", "expires_at": future})
+
+    pages, after_id = [], 0
+    while True:
+        resp = client.get("/links/expired", params={"after_id": after_id, "limit": 2})
+        assert resp.status_code == 200
+        pages.append([link["id"] for link in resp.json()])
+        if "X-Next-After-Id" not in resp.headers:
+            break
+        after_id = int(resp.headers["X-Next-After-Id"])
+    assert pages == [expired_ids[0:2], expired_ids[2:4], expired_ids[4:]]
+
+    resp = client.get("/links/expired", params={"after_id": expired_ids[1]}, headers={"Accept": "application/x-ndjson"})
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    assert [json.loads(line)["id"] for line in resp.text.splitlines()] == expired_ids[2:]
+
+    assert client.get("/links/expired", params={"limit": 100000}).status_code == 422
+
+
+def test_find_links_by_substring_and_domain(client):
+    email = f"find_{uuid4()}@example.com"
+    client.post("/auth/register", json={"email": email, "password": "pass"})
+    token = client.post("/auth/jwt/login", data={"username": email, "password": "pass"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    marker = uuid4().hex
+    mine = [
+        client.post("/links/shorten", json={"long_link": f"https://Find.Example.com/{marker}/{i}"}, headers=headers).json()
+        for i in range(3)
+    ]
+    other = client.post("/links/shorten", json={"long_link": f"https://other.example.com/{marker}%_"}).json()
+
+    resp = client.get("/links/find", params={"contains": marker.upper(), "limit": 2})
+    assert resp.status_code == 200
+    assert [link["id"] for link in resp.json()] == [mine[0]["id"], mine[1]["id"]]
+    rest = client.get("/links/find", params={"contains": marker, "after_id": resp.headers["X-Next-After-Id"]})
+    assert [link["id"] for link in rest.json()] == [mine[2]["id"], other["id"]]
+
+    # % и _ в подстроке - обычные символы, а не шаблоны LIKE
+    assert [link["id"] for link in client.get("/links/find", params={"contains": f"{marker}%_"}).json()] == [other["id"]]
+
+    by_domain = client.get("/links/find", params={"domain": "FIND.example.com"}).json()
+    assert {link["id"] for link in by_domain} == {link["id"] for link in mine}
+    scoped = client.get("/links/find", params={"contains": marker, "mine": True}, headers=headers).json()
+    assert {link["id"] for link in scoped} == {link["id"] for link in mine}
+
+    assert client.get("/links/find").status_code == 400
+    assert client.get("/links/find", params={"contains": "ab"}).status_code == 422
+    assert client.get("/links/find", params={"contains": marker, "mine": True}).status_code == 401
+
+
+def test_my_links_keyset_pages_filters_and_sort(client):
+    from datetime import datetime, timedelta, timezone
+    from sqlalchemy import text
+    from src.database import sync_engine
+
+    email = f"mine_{uuid4()}@example.com"
+    client.post("/auth/register", json={"email": email, "password": "pass"})
+    token = client.post("/auth/jwt/login", data={"username": email, "password": "pass"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    past = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
+    created = [
+        client.post("/links/shorten", json={"long_link": f"https://mine.com/{uuid4()}", "expires_at": past if i == 1 else None},
+                    headers=headers).json()
+        for i in range(5)
+    ]
+    client.post("/links/shorten", json={"long_link": f"https://mine.com/{uuid4()}"})  # чужая ссылка
+    with sync_engine.begin() as conn:
+        for link, num in zip(created, (5, 0, 9, 5, 1)):
+            conn.execute(text("UPDATE links SET num = :num WHERE id = :id"), {"num": num, "id": link["id"]})
+
+    ids = []
+    cursor = None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        resp = client.get("/links/mine", params=params, headers=headers)
+        assert resp.status_code == 200
+        ids += [link["id"] for link in resp.json()]
+        cursor = resp.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert ids == [link["id"] for link in created]
+
+    by_clicks = client.get("/links/mine", params={"sort": "clicks", "limit": 3}, headers=headers)
+    assert [link["num"] for link in by_clicks.json()] == [9, 5, 5]
+    rest = client.get("/links/mine", params={"sort": "clicks", "cursor": by_clicks.headers["X-Next-Cursor"]}, headers=headers)
+    assert [link["num"] for link in rest.json()] == [1, 0]
+    # При равном числе переходов - по убыванию id
+    assert [link["id"] for link in by_clicks.json()[1:]] == [created[3]["id"], created[0]["id"]]
+
+    expired = client.get("/links/mine", params={"state": "expired"}, headers=headers).json()
+    assert [link["id"] for link in expired] == [created[1]["id"]]
+    active = client.get("/links/mine", params={"state": "active"}, headers=headers).json()
+    assert len(active) == 4
+    recent = client.get("/links/mine", params={"created_after": created[2]["start_date"]}, headers=headers).json()
+    assert [link["id"] for link in recent] == [created[3]["id"], created[4]["id"]]
+
+    assert client.get("/links/mine", params={"cursor": "garbage"}, headers=headers).status_code == 400
+    assert client.get("/links/mine").status_code == 401
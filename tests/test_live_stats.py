@@ -0,0 +1,125 @@
+import asyncio
+import os
+from uuid import uuid4
+
+import pytest
+import redis.asyncio as aioredis
+
+from src.links import clicks
+from src.links.cache import link_cache_keys, live_stats_key
+from src.links.live_stats import LiveClickCounters
+
+# Нужен настоящий Redis (например, из docker-compose); без него тест пропускается
+LIVE_REDIS_URL = os.getenv("TEST_REDIS_URL", "redis://localhost:6379/15")
+
+
+def run_with_redis(scenario):
+    async def main():
+        redis = aioredis.Redis.from_url(LIVE_REDIS_URL)
+        try:
+            await redis.ping()
+        except Exception:
+            await redis.close()
+            pytest.skip(f"Redis недоступен: {LIVE_REDIS_URL}")
+        counters = LiveClickCounters(ttl=60, reconcile_interval=600)
+        counters.init(redis)
+        try:
+            await scenario(counters, redis)
+        finally:
+            await redis.close()
+    asyncio.run(main())
+
+
+def test_live_counters_merge_pending_with_db_baseline():
+    async def scenario(counters, redis):
+        code = f"live{uuid4().hex[:8]}"
+        for at in (100.0, 300.0, 200.0):
+            await counters.record(code, clicked_at=at)
+        state = await counters.read(code)
+        assert (state["num"], state["pending"], state["last_used"]) == (None, 3, 300.0)
+        assert counters.needs_reconcile(state)
+
+        # Базовое значение из БД, буфер ещё не сбрасывался
+        assert await counters.reconcile(code, state["v"], 10, 50.0)
+        state = await counters.read(code)
+        assert state["num"] + state["pending"] == 13
+        assert not counters.needs_reconcile(state)
+
+        # Сброс двух переходов в БД не меняет сумму
+        await counters.apply_flush({code: 2})
+        after = await counters.read(code)
+        assert (after["num"], after["pending"]) == (12, 1)
+
+        # Версия сменилась: значение из БД, прочитанное до сброса, не записывается
+        assert not await counters.reconcile(code, state["v"], 10, 50.0)
+        assert (await counters.read(code))["num"] == 12
+        await redis.delete(live_stats_key(code))
+
+    run_with_redis(scenario)
+
+
+def test_live_counters_rebuilt_after_redis_loss():
+    async def scenario(counters, redis):
+        code = f"live{uuid4().hex[:8]}"
+        await counters.record(code, clicked_at=100.0)
+        await counters.record(code, clicked_at=100.0)
+        # Хэш потерян, пока переходы лежали в буфере
+        await redis.delete(live_stats_key(code))
+        await counters.record(code, clicked_at=200.0)
+        await counters.apply_flush({code: 3})
+        state = await counters.read(code)
+        assert state["pending"] == 0
+        assert await counters.reconcile(code, state["v"], 3, 200.0)
+        state = await counters.read(code)
+        assert state["num"] + state["pending"] == 3
+        await redis.delete(live_stats_key(code))
+
+    run_with_redis(scenario)
+
+
+def test_reconcile_during_flush_does_not_double_count(monkeypatch):
+    async def scenario(counters, redis):
+        code = f"live{uuid4().hex[:8]}"
+        monkeypatch.setattr(clicks, "live_clicks", counters)
+        db = {"num": 10}
+        buffer = clicks.ClickBuffer()
+        for at in (100.0, 200.0):
+            buffer.record(code)
+            await counters.record(code, clicked_at=at)
+        state = await counters.read(code)
+        assert await counters.reconcile(code, state["v"], db["num"], 50.0)
+
+        async def apply(batch, applied):
+            # Транзакция зафиксирована, live-счётчик ещё не обновлён:
+            # сверка читает версию и уже увеличенный links.num
+            db["num"] += batch[code][0]
+            state = await counters.read(code)
+            assert not await counters.reconcile(code, state["v"], db["num"], 200.0)
+        monkeypatch.setattr(buffer, "_apply", apply)
+        assert await buffer.flush() == 2
+
+        state = await counters.read(code)
+        assert (state["num"], state["pending"]) == (12, 0)
+        assert await counters.reconcile(code, state["v"], db["num"], 200.0)
+
+        # Неудачный сброс снимает отметку, и сверка снова проходит
+        buffer.record(code)
+        await counters.record(code, clicked_at=300.0)
+
+        async def fail(batch, applied):
+            raise RuntimeError("БД недоступна")
+        monkeypatch.setattr(buffer, "_apply", fail)
+        with pytest.raises(RuntimeError):
+            await buffer.flush()
+        state = await counters.read(code)
+        assert await counters.reconcile(code, state["v"], db["num"], 300.0)
+        assert buffer.pending(code) == 1
+        await redis.delete(live_stats_key(code))
+
+    run_with_redis(scenario)
+
+
+def test_live_counter_survives_update_and_goes_with_delete():
+    # Изменение ссылки не трогает переходы, ещё лежащие в буферах воркеров
+    assert live_stats_key("abc") not in link_cache_keys(["abc"])
+    assert live_stats_key("abc") in link_cache_keys(["abc"], deleted=True)
@@ -0,0 +1,51 @@
+import os
+import subprocess
+import sys
+from uuid import uuid4
+
+from prometheus_client.parser import text_string_to_metric_families
+
+
+def sample_value(text, name, **labels):
+    for family in text_string_to_metric_families(text):
+        for sample in family.samples:
+            if sample.name == name and all(sample.labels.get(k) == v for k, v in labels.items()):
+                return sample.value
+    return 0.0
+
+
+def test_metrics_endpoint_reports_routes_cache_and_db(client):
+    long_link = f"http://metrics.com/{uuid4()}"
+    short_code = client.post("/links/shorten", json={"long_link": long_link}).json()["short_link"]
+    before = client.get("/metrics").text
+    client.get(f"/links/?short_link={short_code}", follow_redirects=False)
+    client.get(f"/links/?short_link={short_code}", follow_redirects=False)
+    client.get("/links/search", params={"long_link": long_link})
+    client.get("/links/search", params={"long_link": long_link})
+    after = client.get("/metrics").text
+
+    def delta(name, **labels):
+        return sample_value(after, name, **labels) - sample_value(before, name, **labels)
+
+    # Маршрут в метках - шаблон, а не путь с кодом ссылки
+    assert delta("http_request_duration_seconds_count", method="GET", route="/links/", status="307") == 2
+    assert delta("cache_requests_total", cache="link_l1", result="miss") == 1
+    assert delta("cache_requests_total", cache="link_l1", result="hit") == 1
+    assert delta("cache_requests_total", cache="search", result="miss") == 1
+    assert delta("cache_requests_total", cache="search", result="hit") == 1
+    assert delta("db_statement_duration_seconds_count", engine="async", operation="SELECT") >= 1
+    assert sample_value(after, "http_requests_in_progress", method="GET", route="/links/") == 0
+
+
+def test_multiprocess_metrics_are_aggregated(tmp_path):
+    # Два «воркера» пишут в общий каталог, третий процесс отдаёт сумму
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path), PYTHONPATH="src")
+    worker = "import metrics; metrics.record_cache('link_l1', 'hit')"
+    for _ in range(2):
+        subprocess.run([sys.executable, "-c", worker], env=env, check=True)
+    scrape = (
+        "import metrics; from prometheus_client import generate_latest; "
+        "print(generate_latest(metrics.metrics_registry()).decode())"
+    )
+    out = subprocess.run([sys.executable, "-c", scrape], env=env, check=True, capture_output=True, text=True).stdout
+    assert sample_value(out, "cache_requests_total", cache="link_l1", result="hit") == 2
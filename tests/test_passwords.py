@@ -0,0 +1,66 @@
+import asyncio
+import threading
+import time
+
+from auth.passwords import PasswordHashBusy, PasswordHasherPool
+
+
+class SlowHelper:
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.threads = set()
+
+    def hash(self, password: str) -> str:
+        self.threads.add(threading.current_thread().name)
+        time.sleep(self.delay)
+        return f"hashed:{password}"
+
+    def verify_and_update(self, plain_password: str, hashed_password: str):
+        return hashed_password == f"hashed:{plain_password}", None
+
+
+def test_hashing_runs_outside_event_loop():
+    helper = SlowHelper(0.2)
+    pool = PasswordHasherPool(workers=2, max_pending=10, helper=helper)
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        task = asyncio.create_task(ticker())
+        hashed = await pool.hash("secret")
+        task.cancel()
+        return hashed, ticks
+
+    hashed, ticks = asyncio.run(scenario())
+    pool.shutdown()
+    assert hashed == "hashed:secret"
+    assert ticks >= 5, "Цикл событий не должен простаивать, пока считается хэш"
+    assert all(name.startswith("password-hash") for name in helper.threads)
+
+
+def test_queue_overflow_is_rejected():
+    pool = PasswordHasherPool(workers=1, max_pending=2, helper=SlowHelper(0.1))
+
+    async def scenario():
+        return await asyncio.gather(*(pool.hash(str(i)) for i in range(4)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    pool.shutdown()
+    assert sum(isinstance(r, PasswordHashBusy) for r in results) == 2
+    assert pool.rejected == 2 and pool.pending == 0
+
+
+def test_login_rejected_with_503_when_hash_queue_full(client, monkeypatch):
+    from auth.passwords import password_hasher
+
+    client.post("/auth/register", json={"email": "busy@example.com", "password": "pass"})
+    monkeypatch.setattr(password_hasher, "max_pending", 0)
+    resp = client.post("/auth/jwt/login", data={"username": "busy@example.com", "password": "pass"})
+    assert resp.status_code == 503
+    assert resp.headers["retry-after"] == "1"
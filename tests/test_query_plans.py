@@ -0,0 +1,129 @@
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import text
+
+from src.database import sync_engine
+from src.links.urls import long_link_digest
+from src.links.clicks import build_flush_statement
+from src.tasks.tasks import build_sweep_statement
+from src.links.router import (
+    delete_link_query, duplicate_link_query, expired_links_query, find_links_query, link_record_query, link_stats_query,
+    search_query, update_link_query, user_links_query,
+)
+
+# Достаточно строк, чтобы планировщик предпочёл индекс последовательному чтению
+SEED_ROWS = 20000
+SEED_USER = uuid.UUID("00000000-0000-0000-0000-000000000007")
+
+
+def seed_links(conn):
+    # long_link_digest как в links/urls.py: запись ссылки уже каноническая
+    conn.execute(text("""
+        INSERT INTO links (long_link, long_link_digest, host, short_link, auth, user_id, start_date, last_date, num, expires_at)
+        SELECT
+            'https://seed.example/' || g,
+            substring(sha256(convert_to('https://seed.example/' || g, 'UTF8')) from 1 for 16),
+            'seed.example',
+            'seed' || g,
+            true,
+            ('00000000-0000-0000-0000-' || lpad((g % 500)::text, 12, '0'))::uuid,
+            now(),
+            now(),
+            0,
+            CASE WHEN g % 100 = 0 THEN now() - interval '1 hour' * (g % 48) END
+        FROM generate_series(1, :rows) AS g
+    """), {"rows": SEED_ROWS})
+    conn.execute(text("ANALYZE links"))
+
+
+def sorts_under_limit(plan, under_limit=False):
+    # Сортировки, результат которых обрезает LIMIT: значит, сортируются все
+    # подходящие строки, а не только строки страницы
+    found = [plan] if under_limit and plan.get("Node Type") == "Sort" else []
+    under_limit = under_limit or plan.get("Node Type") == "Limit"
+    for child in plan.get("Plans", []):
+        found.extend(sorts_under_limit(child, under_limit))
+    return found
+
+
+def seq_scans(plan):
+    # Рекурсивно ищем узлы Seq Scan по таблице links
+    found = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") == "links":
+        found.append(plan)
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child))
+    return found
+
+
+def explain(conn, stmt):
+    compiled = stmt.compile(dialect=sync_engine.dialect)
+    result = conn.exec_driver_sql("EXPLAIN (FORMAT JSON) " + str(compiled), compiled.params)
+    return result.scalar()[0]["Plan"]
+
+
+now = datetime.now(timezone.utc)
+user_id = str(SEED_USER)
+
+ROUTER_QUERIES = {
+    # load_link_record: редирект
+    "redirect_record": link_record_query("seed42"),
+    # get_link_stats
+    "stats": link_stats_query("seed42"),
+    # shorten_link: выяснение причины конфликта вставки
+    "shorten_duplicate_user": duplicate_link_query(long_link_digest("https://seed.example/7"), user_id),
+    "shorten_duplicate_anonymous": duplicate_link_query(long_link_digest("https://seed.example/7"), None),
+    # search_short_link
+    "search": search_query("https://seed.example/7"),
+    # update_link / delete_link: владелец проверяется в самом запросе
+    "update": update_link_query("seed7", user_id, "https://new.example", now),
+    "delete": delete_link_query("seed7", user_id),
+    # find_links: по домену, в том числе только свои ссылки
+    "find_domain": find_links_query(None, "seed.example", None, 19000).limit(100),
+    "find_domain_mine": find_links_query(None, "seed.example", user_id, 0).limit(100),
+    # get_my_links: глубокие страницы по курсору, с фильтрами
+    "mine_by_id": user_links_query(user_id, now, 100, "active", now.replace(year=2000), "id", {"id": 25000}),
+    "mine_by_clicks": user_links_query(user_id, now, 100, "expired", None, "clicks", {"num": 500, "id": 25000}),
+    # get_expired_links
+    "expired": expired_links_query(now, 0).limit(100),
+    # sweep_expired_links
+    "expiry_sweep": build_sweep_statement(1000),
+    # сброс буфера переходов
+    "click_flush": build_flush_statement([("seed1", 3, now), ("seed2", 1, now)]),
+}
+
+
+@pytest.mark.parametrize("name", sorted(ROUTER_QUERIES))
+def test_router_query_uses_index(name):
+    with sync_engine.begin() as conn:
+        seed_links(conn)
+        plan = explain(conn, ROUTER_QUERIES[name])
+    assert not seq_scans(plan), f"{name}: запрос читает links последовательно: {plan}"
+
+
+def test_find_contains_uses_trigram_index():
+    with sync_engine.begin() as conn:
+        if conn.execute(text("SELECT 1 FROM pg_indexes WHERE indexname = 'ix_links_long_link_trgm'")).first() is None:
+            pytest.skip("нет pg_trgm, триграммный индекс не создан")
+        seed_links(conn)
+        plan = explain(conn, find_links_query("example/1234", None, None, 0).limit(100))
+    assert not seq_scans(plan), f"find_contains: запрос читает links последовательно: {plan}"
+
+
+def test_my_links_page_is_read_in_index_order():
+    # У пользователя много ссылок: страница берётся из индекса в нужном
+    # порядке, без сортировки всех его ссылок (сортируется только сама страница)
+    with sync_engine.begin() as conn:
+        seed_links(conn)
+        conn.execute(text("""
+            INSERT INTO links (long_link, long_link_digest, host, short_link, auth, user_id, start_date, last_date, num, expires_at)
+            SELECT 'https://heavy.example/' || g, substring(sha256(convert_to('https://heavy.example/' || g, 'UTF8')) from 1 for 16),
+                   'heavy.example', 'heavy' || g, true, :user_id, now(), now(), g % 1000,
+                   CASE WHEN g % 2 = 0 THEN now() - interval '1 hour' END
+            FROM generate_series(1, 20000) AS g
+        """), {"user_id": user_id})
+        conn.execute(text("ANALYZE links"))
+        plan = explain(conn, ROUTER_QUERIES["mine_by_id"])
+    assert not sorts_under_limit(plan), f"mine_by_id: сортируются все ссылки пользователя: {plan}"
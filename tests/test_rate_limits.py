@@ -0,0 +1,91 @@
+import asyncio
+import os
+import time
+from collections import deque
+from uuid import uuid4
+
+import pytest
+import redis.asyncio as aioredis
+
+from database import PoolStats
+from links.limits import LoadShedder, RateLimiter, RateLimitPolicy, load_shedder, rate_limiter
+
+# Нужен настоящий Redis (например, из docker-compose); без него тест пропускается
+LIVE_REDIS_URL = os.getenv("TEST_REDIS_URL", "redis://localhost:6379/15")
+
+
+def test_token_bucket_is_shared_and_refills():
+    async def main():
+        redis = aioredis.Redis.from_url(LIVE_REDIS_URL)
+        try:
+            await redis.ping()
+        except Exception:
+            await redis.close()
+            pytest.skip(f"Redis недоступен: {LIVE_REDIS_URL}")
+        # Два «воркера» с общим Redis списывают из одной корзины
+        first, second = RateLimiter(), RateLimiter()
+        first.init(redis)
+        second.init(redis)
+        policy = RateLimitPolicy(f"test{uuid4().hex[:8]}", rate=10, burst=3)
+        try:
+            results = [await limiter.acquire(policy, "ip:1") for limiter in (first, second, first, second)]
+            assert results[:3] == [None, None, None]
+            assert 0 < results[3] <= 0.1
+            # У другого клиента своя корзина
+            assert await first.acquire(policy, "ip:2") is None
+            await asyncio.sleep(0.15)
+            assert await second.acquire(policy, "ip:1") is None
+            # Стоимость больше ёмкости урезается до ёмкости
+            assert await first.acquire(policy, "ip:3", cost=100) is None
+            assert await first.acquire(policy, "ip:3") is not None
+        finally:
+            await redis.close()
+    asyncio.run(main())
+
+
+def test_shedder_watches_loop_lag_and_pool_waiters():
+    stats = PoolStats("test")
+    shedder = LoadShedder(max_loop_lag=0.1, max_pool_waiters=2, pool_stats=stats, interval=0.01)
+
+    async def scenario():
+        monitor = asyncio.create_task(shedder.run_lag_monitor())
+        await asyncio.sleep(0.05)
+        time.sleep(0.2)  # блокируем цикл событий
+        await asyncio.sleep(0.02)
+        monitor.cancel()
+        return max(shedder.lag_samples)
+
+    assert asyncio.run(scenario()) >= 0.15
+    # Одиночная пауза не включает сброс, устойчивая задержка - включает
+    shedder.record_lag(0.0)
+    shedder.record_lag(0.5)
+    assert shedder.overload_reason() is None
+    shedder.record_lag(0.3)
+    assert shedder.overload_reason() == "loop_lag"
+    shedder.record_lag(0.0)
+    assert shedder.overload_reason() is None
+    stats.waiting = 2
+    assert shedder.overload_reason() == "pool_wait"
+
+
+def test_overloaded_or_limited_requests_are_rejected_early(client, monkeypatch):
+    monkeypatch.setattr(load_shedder, "lag_samples", deque([10.0, 10.0], maxlen=2))
+    resp = client.get("/links/", params={"short_link": "missing"}, follow_redirects=False)
+    assert resp.status_code == 503
+    assert resp.headers["retry-after"] == "1"
+
+    load_shedder.lag_samples.extend([0.0, 0.0])
+    costs = []
+
+    async def limited(policy, identity, cost=1):
+        costs.append((policy.name, identity, cost))
+        return 2.5
+    monkeypatch.setattr(rate_limiter, "acquire", limited)
+    resp = client.post("/links/shorten", json={"long_link": "https://example.com/limited"})
+    assert resp.status_code == 429
+    assert resp.headers["retry-after"] == "3"
+    resp = client.post("/links/shorten/batch", json=[
+        {"long_link": "https://example.com/a"}, {"long_link": "https://example.com/b"}
+    ])
+    assert resp.status_code == 429
+    assert costs == [("shorten", "ip:testclient", 1), ("shorten", "ip:testclient", 2)]
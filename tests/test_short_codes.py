@@ -0,0 +1,52 @@
+import asyncio
+from uuid import uuid4
+
+import pytest
+
+from src.links.shortcodes import ShortCodeAllocator, ShortCodeCodec
+
+
+class CounterSource:
+    def __init__(self):
+        self.block = 0
+
+    async def next_block(self, session=None):
+        self.block += 1
+        return self.block
+
+
+def test_codec_is_injective_and_fixed_length():
+    codec = ShortCodeCodec(alphabet="0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ", length=8)
+    codes = [codec.encode(n) for n in range(50000)]
+    assert len(set(codes)) == len(codes)
+    assert all(len(code) == 8 for code in codes)
+
+
+def test_codec_small_space_is_permutation():
+    codec = ShortCodeCodec(alphabet="abc", length=3)
+    codes = {codec.encode(n) for n in range(codec.capacity)}
+    assert len(codes) == 27
+    with pytest.raises(ValueError):
+        codec.encode(codec.capacity)
+
+
+def test_allocator_leases_blocks():
+    source = CounterSource()
+    allocator = ShortCodeAllocator(source, ShortCodeCodec(length=6), block_size=10)
+
+    async def run():
+        return await asyncio.gather(*(allocator.allocate() for _ in range(35)))
+
+    codes = asyncio.run(run())
+    assert len(set(codes)) == 35
+    assert source.block == 4, "35 кодов при блоке 10 требуют ровно 4 блока"
+
+
+def test_shorten_uses_allocated_codes(client):
+    codes = set()
+    for _ in range(20):
+        resp = client.post("/links/shorten", json={"long_link": f"https://alloc.example/{uuid4()}"})
+        assert resp.status_code == 200
+        codes.add(resp.json()["short_link"])
+    assert len(codes) == 20
+    assert all(len(code) == 8 for code in codes)
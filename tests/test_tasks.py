@@ -21,3 +21,68 @@ def test_delete_expired_link_task(client):
     assert row_after is None, "Запись должна быть удалена задачей Celery"
 
     delete_expired_link(link_id)
+
+
+def test_sweep_expired_links_deletes_due_links_in_batches(client, monkeypatch):
+    from datetime import datetime, timedelta, timezone
+    from uuid import uuid4
+    from src.tasks import tasks
+
+    past = (datetime.now(timezone.utc) - timedelta(minutes=5)).isoformat()
+    future = (datetime.now(timezone.utc) + timedelta(days=30)).isoformat()
+    expired = [
+        client.post("/links/shorten", json={"long_link": f"http://sweep.com/{uuid4()}", "expires_at": past}).json()
+        for _ in range(5)
+    ]
+    alive = client.post("/links/shorten", json={"long_link": f"http://sweep.com/{uuid4()}", "expires_at": future}).json()
+
+    from prometheus_client import REGISTRY
+    lag_before = REGISTRY.get_sample_value("expired_link_delete_lag_seconds_count") or 0
+
+    purged = []
+    monkeypatch.setattr(tasks, "purge_link_cache", lambda short_links, long_links: purged.append(short_links))
+    assert tasks.sweep_expired_links(batch_size=2) == 5
+    assert REGISTRY.get_sample_value("expired_link_delete_lag_seconds_count") - lag_before == 5
+    # Порции по 2: 2 + 2 + 1
+    assert [len(batch) for batch in purged] == [2, 2, 1]
+    assert sorted(sum(purged, [])) == sorted(link["short_link"] for link in expired)
+
+    with sync_engine.connect() as conn:
+        ids = [link["id"] for link in expired] + [alive["id"]]
+        left = conn.execute(text(f"SELECT id FROM links WHERE id IN ({','.join(map(str, ids))})")).scalars().all()
+    assert left == [alive["id"]]
+
+
+def test_delete_links_deletes_batches_and_purges_cache(client, monkeypatch):
+    from uuid import uuid4
+    from prometheus_client import REGISTRY
+    from src.tasks import tasks
+
+    created = [
+        client.post("/links/shorten", json={"long_link": f"http://batch-delete.com/{uuid4()}"}).json()
+        for _ in range(5)
+    ]
+    purged, purged_long = [], []
+
+    def purge(short_links, long_links):
+        purged.append(short_links)
+        purged_long.extend(long_links)
+    monkeypatch.setattr(tasks, "purge_link_cache", purge)
+    batches_before = REGISTRY.get_sample_value(
+        "link_delete_batch_duration_seconds_count", {"task": "delete_links", "stage": "db"}
+    ) or 0
+
+    ids = [link["id"] for link in created]
+    assert tasks.delete_links(ids + [0], batch_size=3) == 5
+    # Порции по 3 id: в каждой один DELETE и один сброс кэша
+    assert [len(batch) for batch in purged] == [3, 2]
+    assert sorted(sum(purged, [])) == sorted(link["short_link"] for link in created)
+    # Вместе с записями ссылок сбрасывается кэш поиска по их адресам
+    assert sorted(purged_long) == sorted(link["long_link"] for link in created)
+    assert REGISTRY.get_sample_value(
+        "link_delete_batch_duration_seconds_count", {"task": "delete_links", "stage": "db"}
+    ) - batches_before == 2
+
+    with sync_engine.connect() as conn:
+        left = conn.execute(text(f"SELECT id FROM links WHERE id IN ({','.join(map(str, ids))})")).scalars().all()
+    assert left == []